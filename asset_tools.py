@@ -0,0 +1,184 @@
+"""
+Tools to prepare the static assets served by the web server:
+
+    - precompressed .gz and .br siblings so that any static server (e.g. nginx with gzip_static/brotli_static)
+      can serve them without compressing on the fly.
+    - content-hash fingerprints (e.g. js/dojo-tools.0123456789.js) so that browsers can cache them forever.
+"""
+from __future__ import annotations
+
+import os
+import re
+import gzip
+import glob
+import hashlib
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Extensions of the files for which .gz and .br siblings are produced.
+# Note that the pseudopotential files are not included as they are mainly downloaded (also as tarballs).
+TEXT_EXTENSIONS = (".html", ".htm", ".json", ".js", ".css", ".svg")
+
+# Compression level used for gzip and quality used for brotli.
+# Brotli quality 11 is too slow for the large plotly pages.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# Number of hex digits of the sha256 used in the fingerprinted file names.
+HASH_LENGTH = 10
+
+
+def write_atomic(path: str, data: bytes | str, mtime_ns: int | None = None) -> None:
+    """
+    Write data to path via a temporary file that is then renamed so that the web server never sees
+    a partially written file. Files are never modified in place as they may be hardlinked to the files
+    of a previous build (see deploy.py). Set the mtime of the file if `mtime_ns` is not None.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(data.encode("utf-8") if isinstance(data, str) else data)
+    if mtime_ns is not None:
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+    os.replace(tmp_path, path)
+
+
+def precompress(path: str) -> int:
+    """
+    Write the .gz and .br siblings of path (.br only if the brotli package is installed).
+    The siblings have the same mtime as path so that they are regenerated only if path changed.
+
+    Return: number of files written.
+    """
+    st = os.stat(path)
+    todo = [ext for ext in (".gz", ".br") if ext == ".gz" or brotli is not None]
+    todo = [ext for ext in todo
+            if not os.path.exists(path + ext) or os.stat(path + ext).st_mtime_ns != st.st_mtime_ns]
+    if not todo:
+        return 0
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+
+    for ext in todo:
+        if ext == ".gz":
+            compressed = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+        else:
+            compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+        write_atomic(path + ext, compressed, mtime_ns=st.st_mtime_ns)
+
+    return len(todo)
+
+
+def find_text_assets(top: str) -> list[str]:
+    """Find all the files with extension in TEXT_EXTENSIONS starting from the top-level directory."""
+    paths = []
+    for root, dirs, files in os.walk(top):
+        for f in files:
+            if f.endswith(TEXT_EXTENSIONS):
+                paths.append(os.path.join(root, f))
+    return paths
+
+
+def precompress_paths(paths: list[str], nprocs: int = 1) -> int:
+    """
+    Precompress a list of files using `nprocs` threads (zlib and brotli release the GIL).
+    Return: number of files written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    if brotli is None:
+        print("WARNING: brotli package is not installed. Only .gz files will be produced.")
+
+    with ThreadPoolExecutor(max_workers=max(1, nprocs)) as executor:
+        return sum(executor.map(precompress, paths))
+
+
+def _fingerprint_pattern(relpath: str) -> re.Pattern:
+    """
+    Regular expression matching relpath e.g. `js/dojo-tools.js` and its fingerprinted versions
+    e.g. `js/dojo-tools.0123456789.js`.
+    """
+    root, ext = os.path.splitext(relpath)
+    return re.compile(re.escape(root) + r"(\.[0-9a-f]{%d})?" % HASH_LENGTH + re.escape(ext) + r"(?![\w.])")
+
+
+def content_hash(data: bytes) -> str:
+    """Return the first HASH_LENGTH hex digits of the sha256 of data."""
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def fingerprint(top: str, relpath: str) -> str:
+    """
+    Copy the file `relpath` (relative to top) to a file whose name contains the hash of its content
+    e.g. `js/dojo-tools.js` -> `js/dojo-tools.0123456789.js`.
+    The fingerprinted versions produced by previous builds are not removed as they may be still referenced
+    by the published pages (see remove_fingerprinted).
+
+    Return: relative path of the fingerprinted file.
+    """
+    path = os.path.join(top, relpath)
+    with open(path, "rb") as fh:
+        digest = content_hash(fh.read())
+
+    root, ext = os.path.splitext(relpath)
+    new_relpath = f"{root}.{digest}{ext}"
+    new_path = os.path.join(top, new_relpath)
+    if not os.path.exists(new_path):
+        shutil.copy2(path, new_path)
+
+    return new_relpath
+
+
+def find_fingerprinted(text: str, relpath: str) -> set[str]:
+    """Return the set of the fingerprinted versions of relpath referenced in text."""
+    return {m.group(0) for m in _fingerprint_pattern(relpath).finditer(text) if m.group(1)}
+
+
+def remove_fingerprinted(top: str, relpath: str, keep: set[str]) -> int:
+    """
+    Remove the fingerprinted versions of the file `relpath` (relative to top) and their compressed siblings
+    except for the ones whose relative path is in `keep`.
+
+    Return: number of files removed.
+    """
+    path = os.path.join(top, relpath)
+    keep = {os.path.basename(k) for k in keep}
+    pattern = _fingerprint_pattern(os.path.basename(relpath))
+    count = 0
+    for old_path in glob.glob(os.path.join(os.path.dirname(path), "*")):
+        name = os.path.basename(old_path)
+        if name.endswith((".gz", ".br")):
+            name = name[:-3]
+        m = pattern.fullmatch(name)
+        if m and m.group(1) and name not in keep:
+            os.remove(old_path)
+            count += 1
+
+    return count
+
+
+def render_page(template_path: str, out_path: str, mapping: dict[str, str]) -> bool:
+    """
+    Write the HTML page `out_path` obtained by replacing the references to the assets in the template
+    (e.g. `index.html.in`) with their fingerprinted version. The line endings of the template are preserved.
+    mapping: dictionary relpath -> fingerprinted relpath e.g. {"js/dojo-tools.js": "js/dojo-tools.0123456789.js"}
+
+    Return: True if out_path has been (re)written.
+    """
+    with open(template_path, "rt", encoding="utf-8", newline="") as fh:
+        text = fh.read()
+
+    for relpath, new_relpath in mapping.items():
+        text = _fingerprint_pattern(relpath).sub(new_relpath, text)
+
+    if os.path.isfile(out_path):
+        with open(out_path, "rt", encoding="utf-8", newline="") as fh:
+            if fh.read() == text:
+                return False
+
+    write_atomic(out_path, text)
+    return True
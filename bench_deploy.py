@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Benchmark the deploy pipeline (Website.build) with synthetic ONCVPSP and JTH repositories
+so that no network access and no real data are needed. Example:
+
+    python bench_deploy.py --nelements 80 -j 4
+    python bench_deploy.py --oncv-out Si.out --json bench.json
+
+The synthetic ONCVPSP repository provides psp8, upf, psml and djrepo files. The HTML pages of the
+ONCVPSP pseudos require the output file of oncvpsp that cannot be easily synthesized:
+use --oncv-out to give an oncvpsp output file that is copied for all the pseudos,
+otherwise the generation of the ONCVPSP HTML pages is disabled.
+"""
+from __future__ import annotations
+
+import sys
+import os
+import io
+import json
+import shutil
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+
+from deploy import Website, OncvpspRepo, JthRepo, parse_compressors, replace_dir, COMPRESSORS
+from profile_tools import BuildProfiler
+
+
+def _format_values(values: np.ndarray) -> str:
+    """Format an array of floats with 4 values per line as done in the pseudopotential files."""
+    lines = [" ".join(f"{v: .14E}" for v in values[i:i + 4]) for i in range(0, len(values), 4)]
+    return "\n".join(lines)
+
+
+def _radial_function(npoints: int, seed: int, l: int = 0) -> np.ndarray:
+    """Smooth radial function used to fill the synthetic files."""
+    r = np.linspace(1e-4, 10.0, npoints)
+    return r ** (l + 1) * np.exp(-r) * np.cos((1 + seed % 7) * r)
+
+
+def get_element_data(num_elements: int) -> list[tuple[str, int, float]]:
+    """Return list of (symbol, Z, number of valence electrons) for the first num_elements elements."""
+    from pymatgen.core.periodic_table import Element
+    data = []
+    for z in range(1, min(num_elements, 118) + 1):
+        data.append((Element.from_Z(z).symbol, z, float(min(z, 2 + z % 8))))
+    return data
+
+
+def make_pawxml(symbol: str, z: int, nv: float, npoints: int) -> str:
+    """Build a synthetic PAW XML file with the same structure as the JTH datasets."""
+    a, d = 4.33e-4, 6.06e-3
+    lines = [
+        '<?xml  version="1.0"?>',
+        '<paw_setup version="0.5">',
+        f'<atom symbol="{symbol}" Z="{z:.2f}" core="{z - nv:.2f}" valence="{nv:.2f}"/>',
+        '<xc_functional type="GGA" name="PBE"/>',
+        '<generator type="scalar-relativistic" name="atompaw">synthetic dataset</generator>',
+        '<PAW_radius rpaw=" 1.9"/>',
+        '<pw_ecut low="12.0" medium="16.0" high="20.0"/>',
+        '<valence_states>',
+        f'  <state n=" 3" l="0" f=" 2.0000000E+00" rc=" 1.9" e="-3.9736462E-01" id= "{symbol}1"/>',
+        f'  <state n=" 3" l="1" f=" 2.0000000E+00" rc=" 1.9" e="-1.4998148E-01" id= "{symbol}2"/>',
+        '</valence_states>',
+        f'<radial_grid eq="r=a*(exp(d*i)-1)" a="{a}" d="{d}" istart="0" iend="{npoints - 1}" id="log1"/>',
+        '<shape_function type="bessel" rc=" 1.6"/>',
+    ]
+
+    for i, tag in enumerate(["ae_core_density", "pseudo_core_density", "pseudo_valence_density",
+                             "zero_potential", "blochl_local_ionic_potential"]):
+        lines.extend([f'<{tag} grid="log1">', _format_values(_radial_function(npoints, seed=z + i)), f'</{tag}>'])
+
+    for l, state in enumerate([f"{symbol}1", f"{symbol}2"]):
+        for i, tag in enumerate(["ae_partial_wave", "pseudo_partial_wave", "projector_function"]):
+            values = _radial_function(npoints, seed=z + i, l=l)
+            lines.extend([f'<{tag} state= "{state}" grid="log1">', _format_values(values), f'</{tag}>'])
+
+    lines.extend([
+        '<kinetic_energy_differences>',
+        ' 1.0E-01  2.0E-02\n 2.0E-02  3.0E-01',
+        '</kinetic_energy_differences>',
+        '</paw_setup>',
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def make_psp8(symbol: str, z: int, nv: float, npoints: int) -> str:
+    """Build a synthetic psp8 file. Only the header is meaningful."""
+    lines = [
+        f"{symbol}    ONCVPSP-synthetic  r_core=   1.20000   1.20000",
+        f"{z:12.4f} {nv:12.4f}      220101    zatom,zion,pspd",
+        f"     8      11   1     4   {npoints}     0    pspcod,pspxc,lmax,lloc,mmax,r2well",
+        "  5.99000000  4.00000000  0.00000000    rchrg fchrg qchrg",
+        "     2     2     0     0     0    nproj",
+        "     0                                extension_switch",
+    ]
+    r = np.linspace(0, 0.01 * (npoints - 1), npoints)
+    values = _radial_function(npoints, seed=z)
+    lines.extend(f"{i:6d} {r[i]: .13E} {values[i]: .13E} {-values[i]: .13E}" for i in range(npoints))
+    return "\n".join(lines) + "\n"
+
+
+def make_upf(symbol: str, nv: float, npoints: int) -> str:
+    """Build a synthetic UPF2 file. Only the header is meaningful."""
+    return "\n".join([
+        '<UPF version="2.0.1">',
+        f'<PP_HEADER element="{symbol}" pseudo_type="NC" z_valence="{nv:.2f}" mesh_size="{npoints}"/>',
+        f'<PP_MESH><PP_R type="real" size="{npoints}">',
+        _format_values(np.linspace(0, 10, npoints)),
+        '</PP_R></PP_MESH>',
+        '</UPF>',
+    ]) + "\n"
+
+
+def make_oncv_source(top: str, num_elements: int, npoints: int, oncv_out: str | None) -> None:
+    """Write a synthetic ONCVPSP repository in directory top."""
+    symbols = []
+    for symbol, z, nv in get_element_data(num_elements):
+        dirpath = os.path.join(top, symbol)
+        os.makedirs(dirpath, exist_ok=True)
+        prefix = os.path.join(dirpath, f"{symbol}-sp")
+        with open(prefix + ".psp8", "wt") as fh:
+            fh.write(make_psp8(symbol, z, nv, npoints))
+        with open(prefix + ".upf", "wt") as fh:
+            fh.write(make_upf(symbol, nv, npoints))
+        with open(prefix + ".psml", "wt") as fh:
+            fh.write(f'<psml version="1.1"><header atomic-label="{symbol}" z-pseudo="{nv}"/></psml>\n')
+        with open(prefix + ".djrepo", "wt") as fh:
+            hints = {k: {"ecut": e} for k, e in zip(("low", "normal", "high"), (30.0, 36.0, 42.0), strict=True)}
+            json.dump(dict(basename=f"{symbol}-sp.psp8", hints=hints), fh)
+        with open(prefix + ".in", "wt") as fh:
+            fh.write(f"# synthetic oncvpsp input for {symbol}\n")
+        if oncv_out is not None:
+            shutil.copyfile(oncv_out, prefix + ".out")
+        symbols.append(symbol)
+
+    with open(os.path.join(top, "standard.txt"), "wt") as fh:
+        fh.write("\n".join(f"{s}/{s}-sp.psp8" for s in symbols) + "\n")
+    with open(os.path.join(top, "stringent.txt"), "wt") as fh:
+        fh.write("\n".join(f"{s}/{s}-sp.psp8" for s in symbols[::2]) + "\n")
+
+
+def make_jth_source(top: str, num_elements: int, npoints: int) -> None:
+    """Write a synthetic JTH repository in directory top."""
+    symbols = []
+    for symbol, z, nv in get_element_data(num_elements):
+        dirpath = os.path.join(top, symbol)
+        os.makedirs(dirpath, exist_ok=True)
+        prefix = os.path.join(dirpath, f"{symbol}.GGA_PBE-JTH")
+        with open(prefix + ".xml", "wt") as fh:
+            fh.write(make_pawxml(symbol, z, nv, npoints))
+        with open(prefix + ".UPF", "wt") as fh:
+            fh.write(make_upf(symbol, nv, npoints))
+        with open(prefix + ".atompaw.input", "wt") as fh:
+            fh.write(f"{symbol} {z}\nXMLOUT\nEND\n")
+        with open(os.path.join(dirpath, "README.md"), "wt") as fh:
+            fh.write(f"# {symbol}\n\nSynthetic JTH dataset for **{symbol}**.\n\n- Z: {z}\n- valence: {nv}\n")
+        symbols.append(symbol)
+
+    with open(os.path.join(top, "standard.txt"), "wt") as fh:
+        fh.write("\n".join(f"{s}/{s}.GGA_PBE-JTH.xml" for s in symbols) + "\n")
+
+
+class SyntheticSourceMixin:
+    """
+    Replace the download of the upstream data with a copy of a local directory.
+    Must come before the PseudosRepo subclass in the list of base classes.
+    """
+    source_dir = None
+
+    def get_source_id(self, cache_dir: str) -> str:
+        return f"synthetic:{os.path.abspath(self.source_dir)}"
+
+    def download_to(self, path: str, cache_dir: str) -> None:
+        tmp_path = path + ".synthetic"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.copytree(self.source_dir, tmp_path)
+        replace_dir(tmp_path, path)
+
+
+class SyntheticOncvpspRepo(SyntheticSourceMixin, OncvpspRepo):
+    """ONCVPSP repository whose data is copied from a local directory."""
+
+
+class SyntheticJthRepo(SyntheticSourceMixin, JthRepo):
+    """JTH repository whose data is copied from a local directory."""
+
+
+def run_build(site_dir: str, repos: list, from_scratch: bool, options) -> BuildProfiler:
+    """Run Website.build with the given repos and return the profiler with the timings."""
+    profiler = BuildProfiler(enabled=True)
+    website = Website(site_dir, verbose=0, nprocs=options.nprocs,
+                      compressors=parse_compressors(options.compression), profiler=profiler)
+    website.repos = repos
+
+    stream = sys.stdout if options.verbose else io.StringIO()
+    with contextlib.redirect_stdout(stream):
+        with profiler.phase("total"):
+            website.build(from_scratch=from_scratch)
+
+    return profiler
+
+
+def get_throughput(profiler: BuildProfiler, repos: list, ncompressors: int) -> dict:
+    """Compute the throughput of each stage of the build from the timings stored in the profiler."""
+    def _wall(suffix):
+        return sum(p["wall"] for p in profiler.phases if p["name"].endswith(suffix))
+
+    def _count(kind):
+        return sum(1 for a in profiler.artifacts if a["kind"] == kind)
+
+    # Size of the files stored in the tarballs (uncompressed).
+    tar_bytes = ncompressors * sum(os.path.getsize(p) for repo in repos
+                                   for table in repo.tables.values() for paths in table.values() for p in paths)
+
+    def _rate(value, wall):
+        return value / wall if wall > 0 else float("nan")
+
+    html_wall, tar_wall, meta_wall = _wall("/html"), _wall("/tarballs"), _wall("/meta")
+    return {
+        "html_pages": _count("html"),
+        "html_pages_per_s": _rate(_count("html"), html_wall),
+        "tarballs": _count("tarball"),
+        "tarball_mb": tar_bytes / 1024**2,
+        "tarball_mb_per_s": _rate(tar_bytes / 1024**2, tar_wall),
+        "meta_files": _count("meta"),
+        "meta_files_per_s": _rate(_count("meta"), meta_wall),
+        "total_wall": _wall("total"),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--nelements", default=40, type=int,
+                        help="Number of elements in each synthetic repository. Default: 40")
+    parser.add_argument("--npoints", default=2000, type=int,
+                        help="Number of points of the radial meshes (controls the size of the files). Default: 2000")
+    parser.add_argument("--oncv-out", default=None, type=str,
+                        help="oncvpsp output file used for all the ONCVPSP pseudos. "
+                             "If not given, the ONCVPSP HTML pages are not generated.")
+    parser.add_argument("-j", "--nprocs", default=1, type=int, help="Number of processes. Default: 1")
+    parser.add_argument("-z", "--compression", default="gz", type=str,
+                        help=f"Compressors for the tarballs. Possible values: {', '.join(COMPRESSORS)}. Default: gz")
+    parser.add_argument("--workdir", default=None, type=str,
+                        help="Directory used for the synthetic data and the website. Default: temporary directory.")
+    parser.add_argument("--json", default=None, type=str, help="Save the results in JSON format to this file.")
+    parser.add_argument("-v", "--verbose", default=0, action="count", help="Show the output of deploy.py.")
+    options = parser.parse_args()
+
+    workdir = options.workdir if options.workdir is not None else tempfile.mkdtemp(prefix="bench_deploy_")
+    oncv_dir, jth_dir = os.path.join(workdir, "sources", "ONCV"), os.path.join(workdir, "sources", "JTH")
+    site_dir = os.path.join(workdir, "site")
+    for path in (oncv_dir, jth_dir, site_dir):
+        shutil.rmtree(path, ignore_errors=True)
+
+    print(f"Generating synthetic repositories with {options.nelements} elements in {workdir}")
+    make_oncv_source(oncv_dir, options.nelements, options.npoints, options.oncv_out)
+    make_jth_source(jth_dir, options.nelements, options.npoints)
+    os.makedirs(site_dir)
+
+    oncv = SyntheticOncvpspRepo("ONCVPSP", "PBE", "SR", "PD", "0.4", url="synthetic")
+    oncv.source_dir = oncv_dir
+    oncv.with_html = options.oncv_out is not None
+    jth = SyntheticJthRepo("ATOMPAW", "PBE", "SR", "JTH", "2.0", url="synthetic")
+    jth.source_dir = jth_dir
+    repos = [oncv, jth]
+
+    ncompressors = len(parse_compressors(options.compression))
+    results = {"params": dict(nelements=options.nelements, npoints=options.npoints, nprocs=options.nprocs,
+                              compression=options.compression, oncv_html=oncv.with_html)}
+
+    # Cold build from scratch followed by an incremental build in which nothing changed.
+    for label, from_scratch in (("cold", True), ("noop", False)):
+        profiler = run_build(site_dir, repos, from_scratch, options)
+        results[label] = get_throughput(profiler, repos, ncompressors)
+
+    cold, noop = results["cold"], results["noop"]
+    print(f"\n{'stage':>24}  {'cold build':>24}")
+    print(f"{'HTML pages':>24}: {cold['html_pages_per_s']:10.1f} pages/s ({cold['html_pages']} pages)")
+    print(f"{'tarballs':>24}: {cold['tarball_mb_per_s']:10.1f} MB/s    "
+          f"({cold['tarballs']} tarballs, {cold['tarball_mb']:.1f} MB)")
+    print(f"{'metadata':>24}: {cold['meta_files_per_s']:10.1f} files/s ({cold['meta_files']} files)")
+    print(f"{'total':>24}: {cold['total_wall']:10.3f} s")
+    print(f"{'no-op incremental build':>24}: {noop['total_wall']:10.3f} s")
+    if not oncv.with_html:
+        print("\nONCVPSP HTML pages have been disabled. Use --oncv-out to enable them.")
+
+    if options.json is not None:
+        with open(options.json, "wt") as fh:
+            json.dump(results, fh, indent=2)
+        print("Results saved to:", options.json)
+
+    if options.workdir is None:
+        shutil.rmtree(workdir)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Benchmark the fast header readers of meta_tools against the full parsers (pymatgen, ElementTree)
+used to extract the metadata of the pseudos (PAW XML, psp8 and UPF files) and
+cross-validate the results. Example:
+
+    python bench_meta.py tables/ATOMPAW-PBE-JTHv2.0
+    python bench_meta.py tables/ONCVPSP-PBE-SR-PDv0.4
+"""
+from __future__ import annotations
+
+import sys
+import os
+import time
+import argparse
+
+from meta_tools import read_pawxml_meta, read_pawxml_meta_with_pymatgen, read_zval, read_zval_full
+
+
+# ext -> (fast reader, reference reader). Extensions are case-insensitive.
+READERS = {
+    ".xml": (read_pawxml_meta, read_pawxml_meta_with_pymatgen),
+    ".psp8": (read_zval, read_zval_full),
+    ".upf": (read_zval, read_zval_full),
+}
+
+
+def find_pseudos(top: str, ext: str) -> list[str]:
+    """Find all the pseudos with extension `ext` starting from the top-level directory."""
+    paths = []
+    for root, dirs, files in os.walk(top):
+        for f in files:
+            # Skip the core wavefunctions stored in the JTH repositories.
+            if f.lower().endswith(ext) and not f.endswith(".corewf.xml"):
+                paths.append(os.path.join(root, f))
+    return sorted(paths)
+
+
+def time_reader(reader, paths: list[str], repeat: int) -> tuple[float, list]:
+    """Return the best wall time over `repeat` runs and the results of the last run."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [reader(p) for p in paths]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("top", help="Directory with the pseudos e.g. a JTH table.")
+    parser.add_argument("-r", "--repeat", default=3, type=int, help="Number of repetitions. Default: 3")
+    options = parser.parse_args()
+
+    num_errors = 0
+    for ext, (fast, ref) in READERS.items():
+        paths = find_pseudos(options.top, ext)
+        if not paths: continue
+
+        t_fast, fast_results = time_reader(fast, paths, options.repeat)
+        t_ref, ref_results = time_reader(ref, paths, options.repeat)
+
+        # Cross-validate the results.
+        for path, r1, r2 in zip(paths, fast_results, ref_results, strict=True):
+            if r1 != r2:
+                print(f"Metadata mismatch for {path}:\n  {fast.__name__}: {r1}\n  {ref.__name__}: {r2}")
+                num_errors += 1
+
+        print(f"\n{len(paths)} {ext} files in {options.top}")
+        print(f"{ref.__name__:>32}: {t_ref:.4f} s ({len(paths) / t_ref:.1f} files/s)")
+        print(f"{fast.__name__:>32}: {t_fast:.4f} s ({len(paths) / t_fast:.1f} files/s)")
+        print(f"{'speedup':>32}: {t_ref / t_fast:.1f}x")
+
+    return num_errors
+
+
+if __name__ == "__main__":
+    sys.exit(main())
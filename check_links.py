@@ -1,132 +1,479 @@
-"""Check if all links in a set of HTML pages are valid"""
+#!/usr/bin/env python
+"""
+Check if all links in a set of HTML pages are valid.
+
+The HTML files are parsed from disk in parallel, local links are checked by looking at the filesystem
+while external URLs are deduplicated over all the pages and checked only once with a pooled session
+and a limited number of concurrent requests per host.
+The results for the external URLs are cached in .cache/links.json and reused until they expire (see --ttl).
+By default, the external URLs are checked with an asyncio engine based on the standard library:
+servers rejecting HEAD requests are checked again with a GET request that is closed as soon as the headers
+are received, redirects are followed and temporary failures (timeouts, 429, 5xx) are retried with backoff.
+The asyncio engine does not support proxies: the pool of threads is used if a proxy is set in the environment.
+"""
+from __future__ import annotations
+
 import os
-import fnmatch
+import sys
+import ssl
+import json
+import time
+import asyncio
+import argparse
+import threading
 import requests
 
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, unquote
+from urllib.request import getproxies
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+from asset_tools import write_atomic
+
+
+# Directories that are not scanned: builds contains the previous versions of the website while
+# current is a symlink to the build that is already reachable via the tables and json symlinks.
+EXCLUDE_DIRS = {".git", ".cache", "builds", "current", "node_modules", "__pycache__"}
+
+# (tag, attribute) pairs with the links that are checked.
+LINK_ATTRS = {("a", "href"), ("link", "href"), ("script", "src"), ("img", "src"), ("iframe", "src")}
+
+# Default location of the cache with the results for the external URLs.
+CACHE_BASENAME = os.path.join(".cache", "links.json")
+
+# Status codes returned by servers that do not implement HEAD requests properly.
+HEAD_FALLBACK_STATUS = {400, 403, 405, 501}
 
+# Status codes that are retried with backoff.
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
-def find_html_files(top_dir: str):
+REDIRECT_STATUS = {301, 302, 303, 307, 308}
+
+MAX_REDIRECTS = 10
+
+USER_AGENT = "pseudodojo-link-checker"
+
+
+def find_html_files(top_dir: str) -> list[str]:
     """Find all .html and .htm files starting from the top-level directory."""
     html_files = []
-    for root, dirs, files in os.walk(top_dir):
+    for root, dirs, files in os.walk(top_dir, followlinks=True):
+        dirs[:] = sorted(d for d in dirs if d not in EXCLUDE_DIRS)
         for file in files:
-            if fnmatch.fnmatch(file, '*.html') or fnmatch.fnmatch(file, '*.htm'):
+            if file.endswith((".html", ".htm")):
                 html_files.append(os.path.join(root, file))
     return html_files
 
 
-def fetch_html(url: str):
-    """Fetch the HTML content of a given URL."""
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"Error fetching {url}: {e}")
+class _LinkParser(HTMLParser):
+    """Collect the values of the attributes listed in LINK_ATTRS."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if value and (tag, name) in LINK_ATTRS:
+                self.links.append(value.strip())
+
+
+def extract_links(html_path: str) -> tuple[str, list[str]]:
+    """
+    Parse the HTML file and return (html_path, links).
+    This function is executed by the worker processes hence it must be defined at the module level.
+    """
+    parser = _LinkParser()
+    with open(html_path, "rt", encoding="utf-8", errors="replace") as fh:
+        parser.feed(fh.read())
+    parser.close()
+    return html_path, parser.links
+
+
+def resolve_local_link(link: str, html_path: str, top_dir: str) -> str | None:
+    """
+    Return the path of the file referenced by a local link found in html_path.
+    None if the link is not a local link (external URL, mailto:, javascript:, anchor in the same page...).
+    """
+    parts = urlsplit(link)
+    if parts.scheme or parts.netloc or not parts.path:
         return None
 
+    path = unquote(parts.path)
+    if path.startswith("/"):
+        path = os.path.join(top_dir, path.lstrip("/"))
+    else:
+        path = os.path.join(os.path.dirname(html_path), path)
 
-def extract_links(html, base_url):
-    """Extract all links from the given HTML content."""
-    soup = BeautifulSoup(html, 'html.parser')
-    links = []
-    for tag in soup.find_all('a', href=True):
-        link = urljoin(base_url, tag['href'])
-        if urlparse(link).scheme in ['http', 'https']:
-            links.append(link)
-    return links
+    if path.endswith("/") or os.path.isdir(path):
+        path = os.path.join(path, "index.html")
 
+    return os.path.normpath(path)
 
-def check_link(url: str, timeout=5):
-    """Check if a link is valid by making a HEAD request."""
-    try:
-        response = requests.head(url, allow_redirects=True, timeout=timeout)
-        if response.status_code < 400:
-            return (url, True)
-        else:
-            return (url, False)
-    except requests.RequestException:
-        return (url, False)
 
+def is_external_link(link: str) -> bool:
+    """True if link is an external http(s) URL."""
+    return urlsplit(link).scheme in ("http", "https")
+
+
+class LinkCache:
+    """
+    Results for the external URLs stored on disk. Entries older than ttl seconds are ignored.
+    Broken links expire after ttl / 4 so that temporary failures are checked again sooner.
+    """
+
+    def __init__(self, filepath: str | None, ttl: float):
+        self.filepath, self.ttl = filepath, ttl
+        self.data = {}
+        if filepath is not None and os.path.exists(filepath):
+            try:
+                with open(filepath, "rt") as fh:
+                    self.data = json.load(fh)
+            except (OSError, ValueError):
+                print("Ignoring corrupted cache file:", filepath)
+
+    def get(self, url: str) -> dict | None:
+        """Return the cached result for url if still valid else None."""
+        entry = self.data.get(url)
+        if entry is None:
+            return None
+        ttl = self.ttl if entry["ok"] else self.ttl / 4
+        return entry if time.time() - entry["time"] < ttl else None
 
-def validate_links(url, max_workers=10) -> list:
-    """Fetch the HTML, extract links, and validate them."""
-    html = fetch_html(url)
-    if not html:
-        return []
+    def set(self, url: str, result: dict) -> None:
+        self.data[url] = dict(result, time=time.time())
 
-    links = extract_links(html, url)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        return list(executor.map(check_link, links))
+    def save(self) -> None:
+        if self.filepath is None: return
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        # Remove expired entries so that the file does not grow indefinitely.
+        now = time.time()
+        data = {url: entry for url, entry in self.data.items() if now - entry["time"] < self.ttl}
+        write_atomic(self.filepath, json.dumps(data, separators=(",", ":")))
 
 
-def find_unused_port():
-    import socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(('', 0))
-        return s.getsockname()[1]
+class ExternalChecker:
+    """
+    Check external URLs with a requests Session shared by all the threads.
+    The number of concurrent requests to the same host is limited by per_host.
+    """
+
+    def __init__(self, nthreads: int = 16, per_host: int = 4, timeout: float = 10):
+        self.nthreads, self.per_host, self.timeout = nthreads, per_host, timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=nthreads, pool_maxsize=nthreads)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = USER_AGENT
+        self._host_semaphores = defaultdict(lambda: threading.Semaphore(self.per_host))
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, url: str) -> threading.Semaphore:
+        with self._lock:
+            return self._host_semaphores[urlsplit(url).netloc]
+
+    def check(self, url: str) -> dict:
+        """Check if a link is valid by making a HEAD request. Return dict with ok, status and error."""
+        with self._get_semaphore(url):
+            try:
+                response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+                return dict(ok=response.status_code < 400, status=response.status_code, error=None)
+            except requests.RequestException as exc:
+                return dict(ok=False, status=None, error=repr(exc))
+
+    def check_all(self, urls: list[str]) -> dict[str, dict]:
+        """Check a list of URLs in parallel. Return dict url -> result."""
+        with ThreadPoolExecutor(max_workers=self.nthreads) as executor:
+            return dict(zip(urls, executor.map(self.check, urls), strict=True))
+
+
+class AsyncChecker:
+    """
+    Check external URLs with asyncio using only the standard library.
+    At most `concurrency` requests are executed at the same time and at most `per_host` of them go to the same host.
+    The status line and the headers are read and then the connection is closed so that the body of
+    a GET request is never downloaded.
+    """
+
+    def __init__(self, concurrency: int = 32, per_host: int = 4, timeout: float = 10,
+                 retries: int = 2, backoff: float = 0.5):
+        """
+        Args:
+            concurrency: Maximum number of concurrent requests.
+            per_host: Maximum number of concurrent requests to the same host.
+            timeout: Timeout in seconds for each request.
+            retries: Number of times a request is retried after a timeout, a connection error or a RETRY_STATUS.
+            backoff: The n-th retry is executed after backoff * 2**n seconds.
+        """
+        self.concurrency, self.per_host, self.timeout = concurrency, per_host, timeout
+        self.retries, self.backoff = retries, backoff
+        self._ssl_context = ssl.create_default_context()
+
+    async def _request(self, method: str, url: str) -> tuple[int, dict]:
+        """Send a single request and return the status code and the headers of the response."""
+        parts = urlsplit(url)
+        is_https = parts.scheme == "https"
+        port = parts.port or (443 if is_https else 80)
+        reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                       ssl=self._ssl_context if is_https else None)
+        try:
+            target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            # netloc without the user info keeps the brackets of the IPv6 literals e.g. [::1]:8080
+            host = parts.netloc.rsplit("@", 1)[-1]
+            writer.write((f"{method} {target} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: {USER_AGENT}\r\n"
+                          f"Accept: */*\r\nConnection: close\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+            raise ValueError(f"malformed status line: {status_line[:80]!r}")
+        status = int(parts[1])
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        return status, headers
+
+    def _get_host_semaphore(self, url: str, host_semaphores: dict) -> asyncio.Semaphore:
+        return host_semaphores.setdefault(urlsplit(url).netloc.lower(), asyncio.Semaphore(self.per_host))
+
+    async def _fetch(self, method: str, url: str, host_semaphores: dict) -> tuple[int, str, int]:
+        """
+        Send a request following the redirects. Return (status, final_url, num_redirects).
+        Each request (including the ones to the targets of the redirects) is limited by the semaphore of its host.
+        """
+        for num_redirects in range(MAX_REDIRECTS + 1):
+            async with self._get_host_semaphore(url, host_semaphores):
+                status, headers = await asyncio.wait_for(self._request(method, url), self.timeout)
+            if status not in REDIRECT_STATUS or "location" not in headers:
+                return status, url, num_redirects
+            url = urljoin(url, headers["location"])
+            if urlsplit(url).scheme not in ("http", "https"):
+                raise ValueError(f"Redirect to unsupported URL: {url}")
+
+        raise ValueError(f"More than {MAX_REDIRECTS} redirects")
+
+    async def _check(self, url: str, semaphore: asyncio.Semaphore, host_semaphores: dict) -> dict:
+        """Check a single URL. Return dict with ok, status, error and details about the requests."""
+        start = time.perf_counter()
+        result = dict(ok=False, status=None, error=None, method="HEAD", final_url=url, redirects=0, attempts=0)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            result["attempts"] = attempt + 1
+            async with semaphore:
+                try:
+                    status, final_url, redirects = await self._fetch(result["method"], url, host_semaphores)
+                    if result["method"] == "HEAD" and status in HEAD_FALLBACK_STATUS:
+                        result["method"] = "GET"
+                        status, final_url, redirects = await self._fetch("GET", url, host_semaphores)
+                    result.update(status=status, final_url=final_url, redirects=redirects, error=None)
+                    if status not in RETRY_STATUS:
+                        break
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as exc:
+                    result.update(status=None, error=repr(exc) if str(exc) else type(exc).__name__)
+                except ValueError as exc:
+                    # Malformed responses and redirect loops are not retried.
+                    result.update(status=None, error=str(exc))
+                    break
+
+        result["ok"] = result["status"] is not None and result["status"] < 400
+        result["elapsed"] = time.perf_counter() - start
+        return result
+
+    async def _check_all(self, urls: list[str]) -> list[dict]:
+        semaphore, host_semaphores = asyncio.Semaphore(self.concurrency), {}
+        return await asyncio.gather(*(self._check(url, semaphore, host_semaphores) for url in urls))
+
+    def check_all(self, urls: list[str]) -> dict[str, dict]:
+        """Check a list of URLs. Return dict url -> result."""
+        if not urls: return {}
+        return dict(zip(urls, asyncio.run(self._check_all(urls)), strict=True))
+
+
+def print_summary(results: dict[str, dict], num_cached: int, elapsed: float, stream=sys.stdout) -> None:
+    """Print a summary of the results for the external URLs."""
+    num_ok = sum(1 for r in results.values() if r["ok"])
+    rows = [
+        ("external URLs", len(results)),
+        ("results from cache", num_cached),
+        ("valid", num_ok),
+        ("broken", len(results) - num_ok),
+        ("redirected", sum(1 for r in results.values() if r.get("redirects"))),
+        ("checked with GET (HEAD rejected)", sum(1 for r in results.values() if r.get("method") == "GET")),
+        ("retried", sum(1 for r in results.values() if r.get("attempts", 1) > 1)),
+        ("connection errors/timeouts", sum(1 for r in results.values() if r.get("error"))),
+    ]
+    print("\nSummary:", file=stream)
+    for name, value in rows:
+        print(f"  {name:<34} {value:>6}", file=stream)
+
+    slowest = sorted((r.get("elapsed", 0), url) for url, r in results.items() if r.get("elapsed"))[-5:]
+    if slowest:
+        print("  slowest URLs:", file=stream)
+        for secs, url in reversed(slowest):
+            print(f"    {secs:8.2f} s  {url}", file=stream)
+    print(f"  elapsed time: {elapsed:.2f} s", file=stream)
 
 
 class LinkChecker:
+    """
+    Check the local and external links found in the HTML files of a directory.
+    """
 
-    def __init__(self, top_dir: str):
+    def __init__(self, top_dir: str, nprocs: int = 1, concurrency: int = 32, per_host: int = 4,
+                 timeout: float = 10, retries: int = 2, ttl: float = 24 * 3600, use_cache: bool = True,
+                 engine: str = "async", verbose: int = 0):
+        """
+        Args:
+            top_dir: Top-level directory with the HTML files.
+            nprocs: Number of processes used to parse the HTML files.
+            concurrency: Maximum number of concurrent requests (number of threads if engine == "threads").
+            per_host: Maximum number of concurrent requests to the same host.
+            timeout: Timeout in seconds for each request.
+            retries: Number of retries after a temporary failure (async engine only).
+            ttl: Time in seconds after which the cached results for the external URLs expire.
+            use_cache: False to ignore the cached results (the cache is updated anyway).
+            engine: "async" to use AsyncChecker, "threads" to use ExternalChecker.
+                The threads engine is used if a proxy is set in the environment (e.g. HTTPS_PROXY).
+            verbose: Verbosity level.
+        """
         self.top_dir = top_dir
+        if engine == "async" and any(scheme in getproxies() for scheme in ("http", "https")):
+            # requests honors HTTP(S)_PROXY while AsyncChecker connects directly to the hosts.
+            print("Using the threads engine since a proxy is set and the async engine does not support proxies.")
+            engine = "threads"
+        self.nprocs, self.concurrency, self.per_host = nprocs, concurrency, per_host
+        self.timeout, self.retries = timeout, retries
+        self.ttl, self.use_cache, self.engine, self.verbose = ttl, use_cache, engine, verbose
         self.html_files = find_html_files(top_dir)
         print(f"Found {len(self.html_files)} .html|.htm files starting from {top_dir=}")
 
-    def check_with_endpoint(self, endpoint: str) -> int:
-        urls = [endpoint + f for f in self.html_files]
-        cnt = 0
-        for url in urls:
-            print(f"Checking links in {url}")
-            results = validate_links(url)
-            for link, is_valid in results:
-                status = "Valid" if is_valid else "Broken"
-                print(f"{link}: {status}")
-                if not is_valid:
-                    cnt += 1
-        return cnt
-
-    def start_server_and_check(self, host="127.0.0.1") -> int:
-        import subprocess
-        import time
-        port = find_unused_port()
-        endpoint = f"http://{host}:{port}/"
-
-        cmd = f"python -m http.server {port} --bind {host}"
-        stdout_file, stderr_file = "web_server.stdout", "web_server.stderr"
-        print("Starting webserver with command", cmd)
-        print("Redirecting webserver stdout and stderr to: ", stdout_file, stderr_file)
-
-        with open(stdout_file, 'w') as stdout, open(stderr_file, 'w') as stderr:
-            args = cmd.split(" ")
-            server_process = subprocess.Popen(args, start_new_session=True, stdout=stdout, stderr=stderr)
-
-        # Give the server a moment to start
-        time.sleep(2)
+    def get_external_checker(self):
+        """Return the object used to check the external URLs."""
+        if self.engine == "async":
+            return AsyncChecker(concurrency=self.concurrency, per_host=self.per_host, timeout=self.timeout,
+                                retries=self.retries)
+        if self.engine == "threads":
+            return ExternalChecker(nthreads=self.concurrency, per_host=self.per_host, timeout=self.timeout)
+        raise ValueError(f"Invalid engine: {self.engine}")
 
-        try:
-            return self.check_with_endpoint(endpoint)
-        finally:
-            print("Terminating the server subprocess...")
-            server_process.terminate()
-            server_process.wait()
+    def collect_links(self) -> tuple[dict, dict]:
+        """
+        Parse the HTML files and return two dictionaries mapping the external URLs and the local paths
+        to the set of pages in which they are used.
+        """
+        external, local = defaultdict(set), defaultdict(set)
+        if self.nprocs > 1 and len(self.html_files) > 1:
+            chunksize = max(1, len(self.html_files) // (4 * self.nprocs))
+            with Pool(processes=self.nprocs) as pool:
+                results = list(pool.imap_unordered(extract_links, self.html_files, chunksize=chunksize))
+        else:
+            results = map(extract_links, self.html_files)
+
+        for html_path, links in results:
+            for link in links:
+                if is_external_link(link):
+                    # The fragment is not sent to the server.
+                    external[link.split("#")[0]].add(html_path)
+                else:
+                    path = resolve_local_link(link, html_path, self.top_dir)
+                    if path is not None:
+                        local[path].add(html_path)
+
+        return external, local
+
+    def check(self) -> int:
+        """Check all the links. Return the number of broken links."""
+        start = time.perf_counter()
+        external, local = self.collect_links()
+        print(f"Found {len(external)} unique external URLs and {len(local)} unique local paths "
+              f"in {time.perf_counter() - start:.2f} s")
+
+        broken = {}
+        for path, pages in local.items():
+            if not os.path.exists(path):
+                broken[os.path.relpath(path, self.top_dir)] = (dict(ok=False, status=None, error="File not found"),
+                                                               pages)
+
+        cache = LinkCache(os.path.join(self.top_dir, CACHE_BASENAME), self.ttl)
+        results, todo = {}, []
+        for url in external:
+            entry = cache.get(url) if self.use_cache else None
+            if entry is not None:
+                results[url] = entry
+            else:
+                todo.append(url)
+
+        num_cached = len(results)
+        print(f"Checking {len(todo)} external URLs ({num_cached} results from cache) with the {self.engine} engine, "
+              f"{self.concurrency} concurrent requests and at most {self.per_host} requests per host")
+        start = time.perf_counter()
+        for url, result in self.get_external_checker().check_all(todo).items():
+            cache.set(url, result)
+            results[url] = result
+        cache.save()
+        elapsed = time.perf_counter() - start
+
+        for url, result in results.items():
+            if self.verbose:
+                print(f"{url}: {'Valid' if result['ok'] else 'Broken'}")
+            if not result["ok"]:
+                broken[url] = (result, external[url])
+
+        for link, (result, pages) in sorted(broken.items()):
+            reason = f"status {result['status']}" if result.get("status") is not None else result.get("error")
+            print(f"Broken: {link} ({reason})")
+            for page in sorted(pages)[:5]:
+                print(f"    in {os.path.relpath(page, self.top_dir)}")
+            if len(pages) > 5:
+                print(f"    ... and {len(pages) - 5} more pages")
+
+        print_summary(results, num_cached, elapsed)
+        print(f"\nFound {len(broken)} broken links out of {len(external) + len(local)}")
+        return len(broken)
 
 
 def main():
-    # List of URLs to check
-    import os
-    endpoint = "http://127.0.0.1:8000/"
-    checker = LinkChecker(".")
-    #num_errors = checker.check_with_endpoint(endpoint)
-    num_errors = checker.start_server_and_check()
-    return num_errors
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("top_dir", nargs="?", default=".", help="Top-level directory. Default: current directory.")
+    parser.add_argument("-j", "--nprocs", default=1, type=int,
+                        help="Number of processes used to parse the HTML files. Default: 1")
+    parser.add_argument("-c", "--concurrency", default=32, type=int,
+                        help="Maximum number of concurrent requests. Default: 32")
+    parser.add_argument("--per-host", default=4, type=int,
+                        help="Maximum number of concurrent requests to the same host. Default: 4")
+    parser.add_argument("--timeout", default=10, type=float, help="Timeout in seconds for each request. Default: 10")
+    parser.add_argument("--retries", default=2, type=int,
+                        help="Number of retries after a timeout, a connection error or a 429/5xx status. Default: 2")
+    parser.add_argument("--engine", default="async", choices=["async", "threads"],
+                        help="Check the external URLs with asyncio or with a pool of threads. Default: async")
+    parser.add_argument("--ttl", default=24, type=float,
+                        help="Hours after which the cached results for the external URLs expire. Default: 24")
+    parser.add_argument("--no-cache", default=False, action="store_true",
+                        help="Check all the external URLs again ignoring the cache.")
+    parser.add_argument("-v", "--verbose", default=0, action="count", help="Print the result for each URL.")
+    options = parser.parse_args()
+
+    checker = LinkChecker(options.top_dir, nprocs=options.nprocs, concurrency=options.concurrency,
+                          per_host=options.per_host, timeout=options.timeout, retries=options.retries,
+                          ttl=options.ttl * 3600, use_cache=not options.no_cache, engine=options.engine,
+                          verbose=options.verbose)
+    num_errors = checker.check()
+    return 1 if num_errors else 0
 
 
 if __name__ == "__main__":
-    import sys
     sys.exit(main())
-
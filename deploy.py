@@ -10,18 +10,25 @@ import abc
 import json
 import shutil
 import subprocess
+import threading
+import functools
 
-from pathlib import Path
+from urllib.parse import urlsplit
 from collections import defaultdict
-from multiprocessing import Pool, cpu_count
-#from tqdm import tqdm
-from pymatgen.io.abinit.pseudos import Pseudo, PawXmlSetup
-from abipy.flowtk.psrepos import download_repo_from_url  # md5_for_filepath
+import multiprocessing
+from multiprocessing import cpu_count
+from tqdm import tqdm
 
-from html_tools import write_html_from_oncvpsp_outpath, write_html_from_jth_xml
+from html_tools import (write_html_from_oncvpsp_outpath, write_html_from_jth_xml, SIDECAR_SUFFIX,
+                        clear_file_caches, embed_plots_sidecar)
+from meta_tools import read_pawxml_meta, read_pawxml_meta_with_pymatgen, read_zval, read_zval_full
+from profile_tools import BuildProfiler, get_rss_mb, get_rss_delta_mb
+from asset_tools import (write_atomic, content_hash, fingerprint, find_fingerprinted, remove_fingerprinted,
+                         render_page, find_text_assets, precompress_paths)
 
 
-ALL_ELEMENTS = set([
+# Element symbols ordered by atomic number.
+ELEMENTS_BY_Z = [
   'H', 'He',
   'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne','Na', 'Mg', "Al", "Si", 'P', 'S', 'Cl', 'Ar',
   'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
@@ -33,64 +40,518 @@ ALL_ELEMENTS = set([
   "Ac", "Th", "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr",
   "Rf", "Db", "Sg", "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og",
   "Uue", "Ubn",
-])
+]
 
+ALL_ELEMENTS = set(ELEMENTS_BY_Z)
 
-def write_and_run_script(target_dir: str, repo: str, subdir: str) -> None:
-    target_dir = Path(target_dir).resolve()
-    print(f"Cloning {repo=}, in {subdir=}\nworking in {target_dir}")
+# Metadata of the pseudos used to compute the statistics of the tables shown by the frontend.
+META_KEYS = ("hl", "hn", "hh", "nv")
 
-    #REPO="https://github.com/abinit/paw_jth_datasets.git"
-    #SUBDIR="pseudos/JTH-PBE-v2.0"
 
-    script_content = """#!/usr/bin/env bash
-set -euo pipefail
-#set -x
+# Bump this number to invalidate all the artifacts recorded in the build manifests
+# e.g. after a change in the layout of the tarballs or in the metadata extracted from the pseudos.
+BUILD_VERSION = 1
 
-TARGET_DIR="$1"
-REPO="$2"
-SUBDIR="$3"
+BUILD_MANIFEST_BASENAME = ".build_manifest.json"
 
-# Ensure target directory exists
-mkdir -p "$TARGET_DIR"
 
-# Clone inside target directory
-git clone --depth=1 --filter=blob:none --sparse "$REPO" "$TARGET_DIR/paw_jth_datasets"
+def sha256_for_filepath(filepath: str, chunk_size: int = 1024**2) -> str:
+    """
+    Compute and return the sha256 of a file reading it in chunks of `chunk_size` bytes.
+    """
+    import hashlib
+    h = hashlib.sha256()
+    with open(filepath, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-cd "$TARGET_DIR/paw_jth_datasets"
 
-git sparse-checkout set "$SUBDIR"
+def get_fingerprint(kind: str) -> str:
+    """
+    Return a string identifying the code used to generate the artifacts of the given `kind`.
+    Changing the fingerprint invalidates all the artifacts of that kind.
+    """
+    if kind == "html":
+        # HTML pages also depend on the jinja2 templates and on the plotting code in html_tools.
+        html_tools_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "html_tools.py")
+        return f"{BUILD_VERSION}:{sha256_for_filepath(html_tools_path)}"
 
-#git clone --depth=1 --filter=blob:none --sparse https://github.com/abinit/paw_jth_datasets.git
-#cd paw_jth_datasets
-#git sparse-checkout set pseudos/JTH-PBE-v2.0
-"""
-    # TODO: Should use tmp file
-    script_path = "clone_" + subdir.replace("/", "_")
-    script_path = Path("clone_sparse.sh").resolve()
+    if kind in ("tgz", "meta"):
+        return str(BUILD_VERSION)
+
+    raise ValueError(f"Invalid {kind=}")
+
+
+class BuildManifest:
+    """
+    Persistent record of the inputs used to generate the artifacts (HTML pages, tarballs)
+    stored in a repository directory. An artifact is rebuilt only if it does not exist or if the
+    content hash of one of its inputs or the fingerprint of the code that produced it has changed.
+
+    The file is a JSON dictionary with the following structure:
+
+        artifacts[key] = {"fingerprint": str, "inputs": {relpath: sha256}, "payload": ...}
+        stats[relpath] = [size, mtime_ns, sha256]
+
+    where stats is used to avoid recomputing the hash of files whose size and mtime did not change.
+    The entries used in the current run are tracked so that the ones of deleted or renamed files
+    can be removed with `prune` before saving.
+    The same class is used for the metadata cache (see Website.build) in which case the payload
+    stores the metadata extracted from the pseudos.
+    """
+
+    def __init__(self, dirpath: str, filepath: str | None = None):
+        """
+        Args:
+            dirpath: Directory with respect to which the paths of the inputs are stored.
+            filepath: Path of the JSON file. Default: BUILD_MANIFEST_BASENAME inside dirpath.
+        """
+        self.dirpath = dirpath
+        self.filepath = filepath if filepath is not None else os.path.join(dirpath, BUILD_MANIFEST_BASENAME)
+        self.artifacts, self.stats = {}, {}
+        # Keys of artifacts and stats used in this run.
+        self._used_artifacts, self._used_stats = set(), set()
+
+        if os.path.isfile(self.filepath):
+            with open(self.filepath, "rt") as fh:
+                data = json.load(fh)
+            self.artifacts, self.stats = data["artifacts"], data["stats"]
+
+    def relpath(self, path: str) -> str:
+        return os.path.relpath(path, start=self.dirpath)
+
+    def get_sha256(self, path: str) -> str:
+        """Return the sha256 of path. Use the cached value if size and mtime did not change."""
+        st = os.stat(path)
+        rpath = self.relpath(path)
+        self._used_stats.add(rpath)
+        cached = self.stats.get(rpath)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        sha = sha256_for_filepath(path)
+        self.stats[rpath] = [st.st_size, st.st_mtime_ns, sha]
+        return sha
+
+    def hash_inputs(self, input_paths: list[str]) -> dict[str, str | None]:
+        """Map the relative path of each input to its sha256. None if the file does not exist."""
+        return {self.relpath(p): self.get_sha256(p) if os.path.exists(p) else None for p in input_paths}
+
+    def is_stale(self, key: str, input_paths: list[str], fingerprint: str,
+                 artifact_path: str | None = None) -> bool:
+        """
+        True if the artifact identified by `key` should be rebuilt.
+
+        Args:
+            key: String identifying the artifact.
+            input_paths: List of files used to build the artifact.
+            fingerprint: Fingerprint of the code used to build the artifact.
+            artifact_path: Path of the file produced. None if the artifact is not a file.
+        """
+        self._used_artifacts.add(key)
+        if artifact_path is not None and not os.path.exists(artifact_path):
+            return True
+
+        entry = self.artifacts.get(key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return True
+
+        return entry["inputs"] != self.hash_inputs(input_paths)
+
+    def record(self, key: str, input_paths: list[str], fingerprint: str, payload=None) -> None:
+        """Register the artifact identified by `key` with its inputs and an optional JSON-serializable payload."""
+        self._used_artifacts.add(key)
+        self.artifacts[key] = dict(
+            fingerprint=fingerprint,
+            inputs=self.hash_inputs(input_paths),
+            payload=payload,
+        )
+
+    def get_payload(self, key: str):
+        self._used_artifacts.add(key)
+        return self.artifacts[key]["payload"]
+
+    def prune(self) -> None:
+        """
+        Remove the artifacts and the stats that have not been used in this run e.g. the entries of
+        pseudos that have been deleted or renamed. Call it only after a complete build.
+        """
+        removed = len(self.artifacts) - len(self._used_artifacts & self.artifacts.keys())
+        self.artifacts = {k: v for k, v in self.artifacts.items() if k in self._used_artifacts}
+        self.stats = {k: v for k, v in self.stats.items() if k in self._used_stats}
+        if removed:
+            print(f"Removed {removed} unused entries from {self.filepath}")
+
+    def save(self) -> None:
+        """Write the manifest to disk. Use rename so that we never leave a partially written file."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.filepath)), exist_ok=True)
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "wt") as fh:
+            json.dump(dict(artifacts=self.artifacts, stats=self.stats), fh)
+        os.replace(tmp_path, self.filepath)
+
+
+# Entries added to files.json and targz.json for each file.
+CHECKSUM_KEYS = ("size", "sha256", "md5")
+
+
+def checksums_for_filepath(filepath: str, chunk_size: int = 1024**2) -> tuple[int, str, str]:
+    """
+    Compute the size, the sha256 and the md5 of a file in a single pass.
+    The file is read in chunks of `chunk_size` bytes using a preallocated buffer.
+    """
+    import hashlib
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    size = 0
+    with open(filepath, "rb", buffering=0) as fh:
+        while True:
+            n = fh.readinto(buf)
+            if not n: break
+            sha256.update(view[:n])
+            md5.update(view[:n])
+            size += n
+    return size, sha256.hexdigest(), md5.hexdigest()
+
+
+class ChecksumCache:
+    """
+    Cache with the size and checksums of the files served by the website so that
+    only the files whose size or mtime changed are hashed again.
+    The file is a JSON dictionary: relpath -> [size, mtime_ns, sha256, md5]
+    The entries of the files that are not passed to `compute` (e.g. deleted or renamed files)
+    are removed with `prune` before saving.
+    """
+
+    def __init__(self, dirpath: str, filepath: str | None = None):
+        """
+        Args:
+            dirpath: Directory with respect to which the paths are stored.
+            filepath: Path of the JSON file. Default: .cache/checksums.json inside dirpath.
+        """
+        self.dirpath = dirpath
+        self.filepath = filepath if filepath is not None else os.path.join(dirpath, ".cache", "checksums.json")
+        self.entries = {}
+        # Relative paths of the files passed to compute in this run.
+        self._used = set()
+        if os.path.isfile(self.filepath):
+            with open(self.filepath, "rt") as fh:
+                self.entries = json.load(fh)
+
+    def is_stale(self, path: str, st: os.stat_result) -> bool:
+        """True if path should be hashed again."""
+        entry = self.entries.get(os.path.relpath(path, start=self.dirpath))
+        return entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns
+
+    def compute(self, paths: list[str], nprocs: int = 1, force: bool = False) -> dict[str, tuple[int, str, str]]:
+        """
+        Return dictionary path -> (size, sha256, md5).
+        Files are hashed with `nprocs` threads (hashlib releases the GIL) if they are not in the cache,
+        if their size/mtime changed or if force is True.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        paths = sorted(set(paths))
+        stats = {path: os.stat(path) for path in paths}
+        todo = [p for p in paths if force or self.is_stale(p, stats[p])]
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, nprocs)) as executor:
+                for path, (size, sha256, md5) in zip(todo, executor.map(checksums_for_filepath, todo), strict=True):
+                    rpath = os.path.relpath(path, start=self.dirpath)
+                    self.entries[rpath] = [size, stats[path].st_mtime_ns, sha256, md5]
+
+        print(f"Hashed {len(todo)}/{len(paths)} files")
+        out = {}
+        for path in paths:
+            rpath = os.path.relpath(path, start=self.dirpath)
+            self._used.add(rpath)
+            size, _, sha256, md5 = self.entries[rpath]
+            out[path] = (size, sha256, md5)
+        return out
+
+    def prune(self) -> None:
+        """Remove the entries of the files that have not been passed to compute in this run."""
+        removed = len(self.entries) - len(self._used & self.entries.keys())
+        self.entries = {k: v for k, v in self.entries.items() if k in self._used}
+        if removed:
+            print(f"Removed {removed} unused entries from {self.filepath}")
+
+    def save(self) -> None:
+        """Write the cache to disk. Use rename so that we never leave a partially written file."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.filepath)), exist_ok=True)
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "wt") as fh:
+            json.dump(self.entries, fh)
+        os.replace(tmp_path, self.filepath)
+
+
+# Compression backends for the tarballs: name -> (file extension, default level, command).
+# A None command means that the compression is performed in-process with the gzip module,
+# otherwise the tar stream is piped to the external command that writes to stdout.
+# "gz" and "pigz" (multi-threaded gzip) produce the same kind of file so they are mutually exclusive.
+COMPRESSORS = {
+    "gz": (".tgz", 9, None),
+    "pigz": (".tgz", 9, ["pigz", "--no-name", "--stdout"]),
+    "zst": (".tar.zst", 19, ["zstd", "--quiet", "--threads=0", "--stdout"]),
+}
+
+# Fixed mtime (2000-01-01) for the members of the tarballs so that the output is reproducible.
+TARBALL_MTIME = 946684800
+
+
+def parse_compressors(spec: str) -> list[tuple[str, int]]:
+    """
+    Parse a comma-separated list of compressors with an optional level e.g. `gz`, `pigz:6,zst:19`.
+    Return list of (name, level) tuples.
+    """
+    compressors = []
+    for token in spec.split(","):
+        name, _, level = token.strip().partition(":")
+        if name not in COMPRESSORS:
+            raise ValueError(f"Invalid compressor {name=}. It should be in {list(COMPRESSORS)}")
+        if COMPRESSORS[name][2] is not None and shutil.which(COMPRESSORS[name][2][0]) is None:
+            raise RuntimeError(f"Cannot find the `{COMPRESSORS[name][2][0]}` executable required by {name=}")
+        compressors.append((name, int(level) if level else COMPRESSORS[name][1]))
+
+    exts = [COMPRESSORS[name][0] for name, _ in compressors]
+    if len(set(exts)) != len(exts):
+        raise ValueError(f"Compressors in {spec=} produce files with the same extension")
+
+    return compressors
+
+
+def _add_members(tar, paths: list[str]) -> None:
+    """Add files to tar in a reproducible way: sorted by name, fixed mtime and ownership."""
+
+    def _normalize(tarinfo):
+        tarinfo.mtime = TARBALL_MTIME
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ""
+        tarinfo.mode = 0o644
+        return tarinfo
+
+    import io
+    for path in sorted(paths, key=os.path.basename):
+        # The figures of the HTML pages are embedded in the copy stored in the tarball
+        # as browsers do not fetch the sidecar files from file:// URLs.
+        html = embed_plots_sidecar(path) if path.endswith(".html") else None
+        if html is None:
+            tar.add(path, arcname=os.path.basename(path), filter=_normalize)
+        else:
+            data = html.encode("utf-8")
+            tarinfo = _normalize(tar.gettarinfo(path, arcname=os.path.basename(path)))
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+
+
+def write_tarball(tar_path: str, paths: list[str], compressor: str, level: int) -> bool:
+    """
+    Write a compressed tarball with the files in `paths` stored without directories.
+    The archive is written to a temporary file that is renamed at the end so that the web server
+    never serves a partially written file. If tar_path already exists and has the same content,
+    it is left untouched.
+
+    Return: True if tar_path has been (re)written.
+    """
+    import gzip
+    import tarfile
+    import filecmp
+
+    tmp_path = f"{tar_path}.{os.getpid()}.tmp"
+    command = COMPRESSORS[compressor][2]
+    try:
+        with open(tmp_path, "wb") as fh:
+            if command is None:
+                # Empty filename and fixed mtime in the gzip header for reproducibility.
+                with gzip.GzipFile(filename="", mode="wb", fileobj=fh, compresslevel=level, mtime=0) as gz:
+                    with tarfile.open(fileobj=gz, mode="w|") as tar:
+                        _add_members(tar, paths)
+            else:
+                proc = subprocess.Popen(command + [f"-{level}"], stdin=subprocess.PIPE, stdout=fh)
+                try:
+                    with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                        _add_members(tar, paths)
+                finally:
+                    proc.stdin.close()
+                    if proc.wait() != 0:
+                        raise RuntimeError(f"{command[0]} returned {proc.returncode} while writing {tar_path}")
+
+        if os.path.isfile(tar_path) and filecmp.cmp(tmp_path, tar_path, shallow=False):
+            os.remove(tmp_path)
+            return False
+
+        os.replace(tmp_path, tar_path)
+        return True
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_pool_context():
+    """
+    Return the multiprocessing context used for the pool of workers building the HTML pages.
+    The repositories are fetched by threads running while the pages are built and forking a process
+    with live threads may leave locks held in the children, hence the workers are started by a
+    forkserver (spawn if not available) that imports html_tools only once.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["html_tools"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+# Name of the file storing the id (ETag, git commit) of the upstream data unpacked in a repo directory.
+SOURCE_ID_BASENAME = ".source_id"
+
+
+def retry(function, *args, ntries: int = 3, delay: float = 2.0, **kwargs):
+    """
+    Call function(*args, **kwargs) and retry up to `ntries` times with exponential backoff
+    if a network or subprocess error is raised.
+    """
+    for itry in range(ntries):
+        try:
+            return function(*args, **kwargs)
+        except (OSError, subprocess.SubprocessError) as exc:
+            if itry == ntries - 1:
+                raise
+            wait = delay * 2 ** itry
+            print(f"{function.__name__} failed with {exc!r}. Retrying in {wait} seconds...")
+            time.sleep(wait)
+
+
+def fetch_url(url: str, cache_dir: str, chunk_size: int = 2 * 1024**2) -> tuple[str, str]:
+    """
+    Download the file at `url` and store it in `cache_dir`.
+    If the file has been already downloaded, send a conditional request with the ETag
+    received previously so that the file is downloaded again only if it changed.
+
+    Return: (path of the file in the cache, id of the file). The id is the ETag if provided
+        by the server else the sha256 of the file.
+    """
+    import hashlib
+    import requests
+
+    os.makedirs(cache_dir, exist_ok=True)
+    ext = os.path.splitext(urlsplit(url).path)[1]
+    filepath = os.path.join(cache_dir, hashlib.sha256(url.encode()).hexdigest()[:16] + ext)
+    meta_path = filepath + ".json"
+
+    headers, etag = {}, None
+    if os.path.isfile(filepath) and os.path.isfile(meta_path):
+        with open(meta_path, "rt") as fh:
+            etag = json.load(fh)["etag"]
+        if etag is not None:
+            headers["If-None-Match"] = etag
 
-    # Write script to file and make it executable
-    script_path.write_text(script_content)
-    os.chmod(script_path, 0o755)
+    with requests.get(url, stream=True, headers=headers, timeout=60) as r:
+        if r.status_code == 304:
+            print("Using cached file for:", url)
+            return filepath, etag
 
-    # Run it
-    subprocess.run(
-        [str(script_path), str(target_dir), str(repo), str(subdir)],
-        check=True,
-    )
+        r.raise_for_status()
+        print("Downloading:", url)
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                fh.write(chunk)
+        os.replace(tmp_path, filepath)
+        etag = r.headers.get("ETag")
+
+    with open(meta_path, "wt") as fh:
+        json.dump(dict(url=url, etag=etag), fh)
+
+    return filepath, etag if etag is not None else sha256_for_filepath(filepath)
+
+
+# Serialize the git operations on the local mirrors as they are shared by different repos.
+_GIT_MIRROR_LOCK = threading.Lock()
+_UPDATED_MIRRORS = set()
+
+
+def run_git(*args, cwd: str | None = None) -> str:
+    """Execute git with the given arguments and return stdout."""
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+def update_git_mirror(url: str, mirror_dir: str) -> None:
+    """
+    Create a persistent partial clone of the git repository at `url` in mirror_dir.
+    Only the files at the top-level are checked out, subdirectories are materialized
+    on demand with `git sparse-checkout add`. If the mirror already exists, fetch only the new commits.
+    The update is performed at most once per process. Must be called with _GIT_MIRROR_LOCK acquired.
+    """
+    if mirror_dir in _UPDATED_MIRRORS:
+        return
+
+    if not os.path.isdir(os.path.join(mirror_dir, ".git")):
+        print(f"Creating local mirror of {url} in {mirror_dir}")
+        shutil.rmtree(mirror_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(os.path.abspath(mirror_dir)), exist_ok=True)
+        run_git("clone", "--filter=blob:none", "--sparse", url, mirror_dir)
+    else:
+        print(f"Fetching new commits from {url} in {mirror_dir}")
+        run_git("fetch", "--filter=blob:none", "origin", cwd=mirror_dir)
+        run_git("reset", "--hard", "origin/HEAD", cwd=mirror_dir)
+
+    _UPDATED_MIRRORS.add(mirror_dir)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hardlink src to dst. Fallback to copy if the two paths are on different filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def is_generated_file(path: str) -> bool:
+    """True if path has been produced by deploy.py and it is not part of the upstream repository."""
+    suffixes = (".html", SIDECAR_SUFFIX, BUILD_MANIFEST_BASENAME) + tuple(ext for ext, _, _ in COMPRESSORS.values())
+    return path.endswith(suffixes)
+
+
+def replace_dir(src: str, dst: str) -> None:
+    """
+    Replace directory `dst` with `src` using rename.
+    The files produced by a previous build in `dst` (HTML pages, tarballs, manifest) are moved to the new
+    directory so that the build manifest can decide whether they are still up to date.
+    src and dst must be on the same filesystem.
+    """
+    if os.path.isdir(dst):
+        for root, _, filenames in os.walk(dst):
+            for f in filenames:
+                old_path = os.path.join(root, f)
+                if not is_generated_file(old_path): continue
+                new_path = os.path.join(src, os.path.relpath(old_path, start=dst))
+                if os.path.isdir(os.path.dirname(new_path)) and not os.path.exists(new_path):
+                    os.replace(old_path, new_path)
+
+        old_dst = dst + ".old"
+        shutil.rmtree(old_dst, ignore_errors=True)
+        os.rename(dst, old_dst)
+        os.rename(src, dst)
+        shutil.rmtree(old_dst)
+    else:
+        os.rename(src, dst)
 
 
 # These two functions must have the same prototype.
 
-def make_oncv_html(dirpath, prefix, from_scratch):
+def make_oncv_html(dirpath, prefix, tolerance=None):
     """
     Generate the HTML file with the oncvps results and the validation results
     read from a json file placed in the same directory as the pseudo.
 
     Args:
         dirpath: Path to the directory with the pseudo.
-        prefix:
-        from_scratch:
+        prefix: Path of the pseudo relative to dirpath without file extension e.g. `Ag/Ag-sp`.
+        tolerance: Tolerance used to simplify the curves. None to keep all the points.
     """
     # TODO: Generate HTML files from the djrepo file.
 
@@ -103,23 +564,19 @@ def make_oncv_html(dirpath, prefix, from_scratch):
 
     #print(f"{dirpath=}, {prefix=}")
     out_path = os.path.join(dirpath, prefix + ".out")
-    html_path = os.path.join(dirpath, prefix + ".html")
-    if not from_scratch and os.path.exists(html_path):
-        print(f"Won't regenerate HTML file: {html_path=}")
-        return
-
-    return write_html_from_oncvpsp_outpath(out_path)
+    # The data of the figures is stored in a sidecar file loaded lazily by the browser.
+    return write_html_from_oncvpsp_outpath(out_path, sidecar=True, tolerance=tolerance)
 
 
-def make_atompaw_html(dirpath, prefix, from_scratch):
+def make_atompaw_html(dirpath, prefix, tolerance=None):
     """
     Generate the HTML file with the JTH results and the validation results
     read from a json file placed in the same directory as the pseudo.
 
     Args:
         dirpath: Path to the directory with the pseudo.
-        prefix:
-        from_scratch:
+        prefix: Path of the pseudo relative to dirpath without file extension e.g. `Ag/Ag.GGA_PBE-JTH`.
+        tolerance: Tolerance used to simplify the curves. None to keep all the points.
     """
     # Typical structure of a JTH subdirectory
     #
@@ -137,16 +594,57 @@ def make_atompaw_html(dirpath, prefix, from_scratch):
 
     xml_path = os.path.join(dirpath, prefix) + ".xml"
 
-    elm, prefix = prefix.split("/") # -> Ag, Ag.GGA_PBE-JTH
+    elm, _ = prefix.split("/") # -> Ag, Ag.GGA_PBE-JTH
     if elm not in ALL_ELEMENTS:
         raise ValueError(f"Invalid element {elm}")
 
-    html_path = os.path.join(dirpath, prefix + ".html")
-    if not from_scratch and os.path.exists(html_path):
-        print(f"Won't regenerate HTML file: {html_path=}")
-        return
+    # The data of the figures is stored in a sidecar file loaded lazily by the browser.
+    return write_html_from_jth_xml(xml_path, sidecar=True, tolerance=tolerance)
 
-    return write_html_from_jth_xml(xml_path)
+
+def run_html_task(args: tuple) -> tuple[str, str | None, dict]:
+    """
+    Execute `function(dirpath, prefix)` and return (prefix, traceback, stats) where stats is a dictionary
+    with the wall time, the CPU time and the change of the RSS of the worker during the task.
+    Exceptions are caught so that a single pseudo cannot abort the build of the full table.
+    This function is executed by the worker processes hence it must be defined at the module level.
+    """
+    function, dirpath, prefix = args
+    wall_start, cpu_start, rss_start = time.perf_counter(), time.process_time(), get_rss_mb()
+    tb = None
+    try:
+        function(dirpath, prefix)
+    except Exception:
+        import traceback
+        tb = traceback.format_exc()
+
+    stats = dict(wall=time.perf_counter() - wall_start, cpu=time.process_time() - cpu_start,
+                 rss_delta_mb=get_rss_delta_mb(rss_start))
+    return prefix, tb, stats
+
+
+def run_html_chunk(arg_tuples: list[tuple]) -> list[tuple[str, str | None, dict]]:
+    """Execute run_html_task for a chunk of tasks in the same worker process."""
+    return [run_html_task(args) for args in arg_tuples]
+
+
+def imap_html_tasks(arg_tuples: list[tuple], nprocs: int):
+    """
+    Execute run_html_task for each tuple in arg_tuples with `nprocs` worker processes
+    and yield the results in completion order.
+    Contrary to multiprocessing.Pool that waits forever for the results of a worker killed
+    e.g. by the OOM killer, BrokenProcessPool is raised if a worker dies.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    # Small chunks keep the load balanced as some pseudos are much slower than others.
+    # The pseudos are sorted so the pseudos of the same directory usually end up in the same
+    # chunk and the inputs they share are read once per worker (see html_tools.file_memoize).
+    chunksize = max(1, len(arg_tuples) // (4 * nprocs))
+    with ProcessPoolExecutor(max_workers=nprocs, mp_context=get_pool_context()) as executor:
+        futures = [executor.submit(run_html_chunk, arg_tuples[i:i + chunksize])
+                   for i in range(0, len(arg_tuples), chunksize)]
+        for future in as_completed(futures):
+            yield from future.result()
 
 
 class PseudosRepo(abc.ABC):
@@ -155,6 +653,13 @@ class PseudosRepo(abc.ABC):
     with the same XC functional and the same treatment of relativistic effects.
     """
 
+    # False to skip the generation of the HTML pages e.g. in benchmarks without oncvpsp output files.
+    with_html = True
+
+    # Tolerance used to simplify the curves in the HTML pages (see html_tools.decimate_figure).
+    # None or 0 to keep all the points.
+    plot_tolerance = None
+
     def __init__(self, ps_generator: str, xc_name: str, relativity_type: str, project_name: str,
                  version: str, url: str):
         """
@@ -209,24 +714,108 @@ class PseudosRepo(abc.ABC):
     def formats(self):
         """List of file formats provided by the repository."""
 
-    def setup(self, workdir: str, from_scratch: bool) -> None:
+    @property
+    @abc.abstractmethod
+    def type_label(self) -> str:
+        """Label of the pseudo type shown in the user interface e.g. `NC SR (ONCVPSP v0.4)`."""
+
+    @abc.abstractmethod
+    def get_source_id(self, cache_dir: str) -> str:
+        """
+        Return a string identifying the current version of the upstream data (e.g. ETag or git commit).
+        Subclasses may download the data in cache_dir at this stage.
         """
-        Perform the initialization step:
 
-            1) Download the tarball from the github url, unpack it and save it in the self.name directory.
+    @abc.abstractmethod
+    def download_to(self, path: str, cache_dir: str) -> None:
+        """Fetch the upstream data and unpack it inside directory `path`."""
+
+    @abc.abstractmethod
+    def get_html_inputs(self, prefix: str) -> list[str]:
+        """List of files used to generate the HTML page of the pseudo with the given `prefix`."""
+
+    @abc.abstractmethod
+    def get_meta_inputs(self, path: str) -> list[str]:
+        """List of files used to extract the metadata from `path`."""
+
+    @abc.abstractmethod
+    def parse_meta(self, path: str) -> dict:
+        """Extract the metadata (hints and number of valence electrons) from `path`."""
+
+    def get_meta(self, path: str, meta_cache: BuildManifest, profiler: BuildProfiler | None = None) -> dict:
+        """
+        Return the metadata associated to `path`. Use the value stored in meta_cache
+        if the size and mtime (or the content hash) of the inputs did not change since the previous run.
+        The time spent to parse the file is registered in the profiler if given.
+        """
+        key = f"meta:{meta_cache.relpath(path)}"
+        inputs, meta_fp = self.get_meta_inputs(path), get_fingerprint("meta")
+        if not meta_cache.is_stale(key, inputs, meta_fp):
+            return meta_cache.get_payload(key)
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        meta = self.parse_meta(path)
+        if profiler is not None:
+            profiler.add_artifact("meta", meta_cache.relpath(path), time.perf_counter() - wall_start,
+                                  cpu=time.process_time() - cpu_start)
+        meta_cache.record(key, inputs, meta_fp, payload=meta)
+        return meta
+
+    def fetch(self, workdir: str, from_scratch: bool, cache_dir: str, ntries: int = 3) -> None:
+        """
+        Download the data from github and save it in the self.name directory inside workdir.
+        The download is skipped if the directory already contains the latest version of the upstream data.
+        This method performs network I/O only so it can be executed in a thread while other repos are processed.
+
+        Args:
+            workdir: Directory in which the repository is unpacked.
+            from_scratch: True if the data should be unpacked again even if it did not change.
+            cache_dir: Directory used to store the files downloaded previously.
+            ntries: Number of attempts in case of network errors.
+        """
+        self.path = os.path.join(workdir, self.name)
+        source_id = retry(self.get_source_id, cache_dir, ntries=ntries)
+
+        id_path = os.path.join(self.path, SOURCE_ID_BASENAME)
+        if not from_scratch and os.path.isfile(id_path):
+            with open(id_path, "rt") as fh:
+                if fh.read() == source_id:
+                    print("Skipping download step as", self.path, "is already up to date")
+                    return
+
+        retry(self.download_to, self.path, cache_dir, ntries=ntries)
+        write_atomic(id_path, source_id)
+
+    def setup(self, workdir: str, from_scratch: bool, nprocs: int = 1, verbose: int = 0,
+              compressors: list[tuple[str, int]] | None = None, profiler: BuildProfiler | None = None) -> None:
+        """
+        Perform the initialization step. Assume the data has been already downloaded by `fetch`.
+
+            1) Build HTML pages for the pseudos.
             2) Build list of tables by extracting the relative paths from the `table_name.txt` files.
                found in the top-level directory and build self.tables
             3) Create targz files with all pseudos associated to a given table.
+
+        Args:
+            workdir: Directory in which the repository is unpacked.
+            from_scratch: True if all the artifacts should be rebuilt.
+            nprocs: Number of processes used to build the HTML pages and the tarballs.
+            verbose: Verbosity level.
+            compressors: List of (name, level) tuples with the compression backends used for the tarballs.
+                None to produce .tgz files with the default compression level.
+            profiler: BuildProfiler used to record the timings of the phases and of the artifacts.
+
+        The pseudos whose HTML page cannot be generated are stored in self.html_failures
+        (dict prefix -> traceback).
         """
-        doit = from_scratch or (not from_scratch and not os.path.isdir(self.name))
         self.path = os.path.join(workdir, self.name)
-        start = time.perf_counter()
+        profiler = profiler if profiler is not None else BuildProfiler()
 
-        if doit:
-            # Fetch data from github and copy data to self.path
-            self.download_to(self.path)
-        else:
-            print("Skipping download step as", self.path, "directory already exists")
+        # Load the manifest with the inputs used to build the artifacts in the previous run.
+        # In from_scratch mode, we start with an empty manifest so that everything is rebuilt.
+        if from_scratch and os.path.exists(os.path.join(self.path, BUILD_MANIFEST_BASENAME)):
+            os.remove(os.path.join(self.path, BUILD_MANIFEST_BASENAME))
+        self.manifest = BuildManifest(self.path)
 
         # Find the .txt files defining the tables provided by this repo.
         excluded = {
@@ -248,68 +837,136 @@ class PseudosRepo(abc.ABC):
 
         # Preparing args required to build HTML pages.
         unique_paths = sorted(set(p for l in relpaths_table.values() for p in l))
-        nprocs = max(1, cpu_count() // 2)
-        nprocs = 1
 
         if self.ps_generator == "ONCVPSP":
-            function = make_oncv_html
+            function = functools.partial(make_oncv_html, tolerance=self.plot_tolerance)
         elif self.ps_generator == "ATOMPAW":
-            function = make_atompaw_html
-
-        with_html = True
-        if with_html:
-            print(f"Building HTML pages with {nprocs=} ...")
-            html_start = time.perf_counter()
-
-            if nprocs == 1:
-                # This is not parallelized but debugging is easier.
+            function = functools.partial(make_atompaw_html, tolerance=self.plot_tolerance)
+
+        self.html_failures = {}
+        if self.with_html:
+            with profiler.phase(f"{self.name}/html"):
+                # Select the pseudos whose HTML page is missing or out of date.
+                html_fp = f"{get_fingerprint('html')}:{self.plot_tolerance}"
+                stale_paths = []
                 for prefix in unique_paths:
-                    function(self.path, prefix, from_scratch)
-
-            else:
-              # Using pool to speedup execution. Prepare argument tuples
-              arg_tuples = [(self.path, prefix, from_scratch) for prefix in unique_paths]
-              with Pool(processes=nprocs) as pool:
-                  pool.starmap(function, arg_tuples)
-
-            print(f"html build. elapsed time: {time.perf_counter() - html_start:.6f} seconds\n")
+                    if self.manifest.is_stale(f"html:{prefix}", self.get_html_inputs(prefix), html_fp,
+                                              artifact_path=os.path.join(self.path, prefix + ".html")):
+                        stale_paths.append(prefix)
+
+                html_nprocs = max(1, min(nprocs, len(stale_paths)))
+                print(f"Building {len(stale_paths)}/{len(unique_paths)} HTML pages with {html_nprocs=} ...")
+                arg_tuples = [(function, self.path, prefix) for prefix in stale_paths]
+
+                with tqdm(total=len(arg_tuples), unit="page", disable=not arg_tuples) as pbar:
+                    if html_nprocs == 1:
+                        # This is not parallelized but debugging is easier.
+                        results = map(run_html_task, arg_tuples)
+                        self._collect_html_results(results, html_fp, pbar, verbose, profiler)
+                    else:
+                        # Using pool to speedup execution.
+                        from concurrent.futures.process import BrokenProcessPool
+                        try:
+                            results = imap_html_tasks(arg_tuples, html_nprocs)
+                            self._collect_html_results(results, html_fp, pbar, verbose, profiler)
+                        except BrokenProcessPool:
+                            # Keep the pages built so far so that the next update does not rebuild them.
+                            self.manifest.save()
+                            print(f"A worker building the HTML pages of {self.name} died unexpectedly "
+                                  "(e.g. killed by the OOM killer). Try again with a smaller value of -j")
+                            raise
+
+                self.manifest.save()
+                if self.html_failures:
+                    print(f"WARNING: cannot build {len(self.html_failures)} HTML pages:", list(self.html_failures))
 
         # Build dictionary: tables[name][file_ext] -> files
-        self.tables = defaultdict(dict)
-        for table_name, relpaths in relpaths_table.items():
-            for ext in self.formats:
-                all_files = [os.path.join(self.path, f"{rpath}.{ext}") for rpath in relpaths]
-                files = list(filter(os.path.isfile, all_files))
-                if len(files) != len(all_files):
-                    print(f"{table_path} WARNING: cannot find files with ext: {ext}.",
-                          f"expected: {len(all_files)}, found: {len(files)}")
-                self.tables[table_name][ext] = files
-                #print("table:", table_name, "ext:", ext, "\n", self.tables[table_name][ext])
+        with profiler.phase(f"{self.name}/tables"):
+            self.tables = defaultdict(dict)
+            for table_name, relpaths in relpaths_table.items():
+                for ext in self.formats:
+                    all_files = [os.path.join(self.path, f"{rpath}.{ext}") for rpath in relpaths]
+                    files = list(filter(os.path.isfile, all_files))
+                    if len(files) != len(all_files):
+                        print(f"{table_path} WARNING: cannot find files with ext: {ext}.",
+                              f"expected: {len(all_files)}, found: {len(files)}")
+                    self.tables[table_name][ext] = files
+                    #print("table:", table_name, "ext:", ext, "\n", self.tables[table_name][ext])
 
         # Build targz file with all pseudos belonging to table_name so that the user can download it via the web interface.
-        # This part is slow but we do it only once.
-        import tarfile
+        with profiler.phase(f"{self.name}/tarballs"):
+            self.build_tarballs(compressors or [("gz", COMPRESSORS["gz"][1])], nprocs, profiler=profiler)
+
+        # All the artifacts of the repo have been checked so the entries of removed pseudos can be dropped.
+        self.manifest.prune()
+        self.manifest.save()
+
+    def build_tarballs(self, compressors: list[tuple[str, int]], nprocs: int,
+                       profiler: BuildProfiler | None = None) -> None:
+        """
+        Build the tarballs with all the files of a given format belonging to the same table.
+        One archive is produced for each compressor. Tarballs are built concurrently and only if
+        their members changed since the previous build. Set self.targz[table_name][ext] with
+        the path of the tarball listed in targz.json i.e. the .tgz file if available.
+        """
+        from concurrent.futures import ThreadPoolExecutor
         self.targz = defaultdict(dict)
+        tgz_fp = get_fingerprint("tgz")
 
+        tasks = []
         for table_name, table in self.tables.items():
             for ext, rpaths in table.items():
                 if not rpaths: continue
-                tar_path = os.path.join(self.path, f"{self.type}_{self.xc_name}_{table_name}_{ext}.tgz")
-                doit = from_scratch or (not from_scratch and not os.path.isfile(tar_path))
-                if doit:
-                    print("Creating tarball:", tar_path)
-                    targz = tarfile.open(tar_path, "w:gz")
-                    for rpath in rpaths:
-                        targz.add(rpath, arcname=os.path.basename(rpath))
-                    targz.close()
-                else:
-                    print("Skipping tarball creation:", tar_path)
-                    assert os.path.isfile(tar_path)
-
-                self.targz[table_name][ext] = tar_path
-            print("")
-
-        print(f"setup elapsed time: {time.perf_counter() - start:.6f} seconds\n")
+                inputs = rpaths
+                if ext == "html":
+                    # The data of the sidecar files is embedded in the HTML pages stored in the tarball.
+                    sidecars = [os.path.splitext(p)[0] + SIDECAR_SUFFIX for p in rpaths]
+                    inputs = rpaths + [p for p in sidecars if os.path.isfile(p)]
+                for i, (name, level) in enumerate(compressors):
+                    suffix = COMPRESSORS[name][0]
+                    tar_path = os.path.join(self.path, f"{self.type}_{self.xc_name}_{table_name}_{ext}{suffix}")
+                    if i == 0 or suffix == ".tgz":
+                        self.targz[table_name][ext] = tar_path
+
+                    key, fp = f"tgz:{os.path.basename(tar_path)}", f"{tgz_fp}:{name}:{level}"
+                    if self.manifest.is_stale(key, inputs, fp, artifact_path=tar_path):
+                        tasks.append((key, fp, tar_path, rpaths, inputs, name, level))
+                    else:
+                        print("Skipping tarball creation:", tar_path)
+
+        if not tasks: return
+        print(f"Creating {len(tasks)} tarballs with {nprocs=} ...")
+
+        def _write(tar_path, rpaths, name, level):
+            start = time.perf_counter()
+            return write_tarball(tar_path, rpaths, name, level), time.perf_counter() - start
+
+        # Threads are enough here as zlib and the external compressors release the GIL.
+        with ThreadPoolExecutor(max_workers=max(1, nprocs)) as executor:
+            futures = [executor.submit(_write, tar_path, rpaths, name, level)
+                       for (_, _, tar_path, rpaths, _, name, level) in tasks]
+
+            for (key, fp, tar_path, _, inputs, _, _), future in zip(tasks, futures, strict=True):
+                changed, wall = future.result()
+                print("Created tarball:" if changed else "Tarball is unchanged:", tar_path)
+                self.manifest.record(key, inputs, fp)
+                if profiler is not None:
+                    profiler.add_artifact("tarball", os.path.relpath(tar_path, start=os.path.dirname(self.path)), wall)
+
+    def _collect_html_results(self, results, html_fp: str, pbar, verbose: int, profiler: BuildProfiler) -> None:
+        """
+        Consume the (prefix, traceback, stats) tuples produced by run_html_task, register the
+        successful pages in the manifest and the failed ones in self.html_failures.
+        """
+        for prefix, tb, stats in results:
+            pbar.update(1)
+            profiler.add_artifact("html", os.path.join(self.name, prefix), **stats)
+            if tb is None:
+                self.manifest.record(f"html:{prefix}", self.get_html_inputs(prefix), html_fp)
+            else:
+                self.html_failures[prefix] = tb
+                if verbose:
+                    pbar.write(f"Cannot build HTML page for {prefix}:\n{tb}")
 
 
 class OncvpspRepo(PseudosRepo):
@@ -354,27 +1011,73 @@ class OncvpspRepo(PseudosRepo):
         else:
             raise ValueError(f"Invalid relativity_type {self.relativity_type}")
 
+    @property
+    def type_label(self) -> str:
+        return f"NC {self.relativity_type} (ONCVPSP v{self.version})"
+
     @property
     def formats(self) -> list[str]:
         """List of file formats provided by the repository."""
         return ["psp8", "upf", "psml", "html", "djrepo"]
 
-    def download_to(self, path: str) -> None:
-        """Get the targz from github and unpack it inside directory `path`."""
-        print("Downloading onvpsp pseudos from:", self.url, "to:", self.path)
-        download_repo_from_url(self.url, self.path)
+    def get_source_id(self, cache_dir: str) -> str:
+        # Download the zip file (if changed) and use the ETag returned by github.
+        self.zip_path, source_id = fetch_url(self.url, cache_dir)
+        return source_id
+
+    def download_to(self, path: str, cache_dir: str) -> None:
+        """Unpack the zip file downloaded from github inside directory `path`."""
+        import zipfile
+        print("Unpacking onvpsp pseudos from:", self.url, "to:", path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp_dir:
+            with zipfile.ZipFile(self.zip_path) as zf:
+                zf.extractall(tmp_dir)
+
+            # github archives contain a single directory e.g. ONCVPSP-PBE-PDv0.4-master
+            dirpaths = [os.path.join(tmp_dir, d) for d in os.listdir(tmp_dir)]
+            if len(dirpaths) != 1 or not os.path.isdir(dirpaths[0]):
+                raise RuntimeError(f"Expecting single directory in {self.url}, got {dirpaths}")
+            replace_dir(dirpaths[0], path)
+
+    def get_html_inputs(self, prefix: str) -> list[str]:
+        out_path = os.path.join(self.path, prefix + ".out")
+        json_path = os.path.join(self.path, prefix + ".djson")
+        return [out_path, json_path] if os.path.exists(json_path) else [out_path]
+
+    @staticmethod
+    def get_pseudo_path_from_djrepo(path: str, data: dict | None = None) -> str:
+        """
+        Return the path of the pseudo associated to the djrepo file (stored in the `basename` entry).
+        `data` is the content of the djrepo file if already loaded.
+        """
+        if data is None:
+            with open(path, "r") as fh:
+                data = json.load(fh)
+        return os.path.join(os.path.dirname(path), data["basename"])
+
+    def get_meta_inputs(self, path: str) -> list[str]:
+        # The number of valence electrons is read from the pseudo referenced by the djrepo file.
+        return [path, self.get_pseudo_path_from_djrepo(path)]
+
+    def parse_meta(self, path: str) -> dict:
+        return self.get_meta_from_djrepo(path)
 
     def get_meta_from_djrepo(self, path: str) -> dict:
-        dirname = os.path.dirname(path)
         with open(path, "r") as fh:
             data = json.load(fh)
             hints = data["hints"]
-            # parse the pseudo to geh the number of valence electrons.
-            pseudo_path = os.path.join(dirname, data["basename"])
-            pseudo = Pseudo.from_file(pseudo_path)
+            # Read the number of valence electrons from the header of the pseudo.
+            # Parse the full file if the header has an unexpected structure.
+            pseudo_path = self.get_pseudo_path_from_djrepo(path, data)
+            try:
+                nv = read_zval(pseudo_path)
+            except Exception as exc:
+                print(f"Cannot read header of {pseudo_path} with {exc!r}. Parsing the full file.")
+                nv = read_zval_full(pseudo_path)
 
             meta = {
-                "nv": pseudo.Z_val,
+                "nv": nv,
                 "hl": hints["low"]["ecut"],
                 "hn": hints["normal"]["ecut"],
                 "hh": hints["high"]["ecut"]
@@ -402,19 +1105,40 @@ class JthRepo(PseudosRepo):
         url = f"https://github.com/abinit/paw_jth_datasets/tree/main/pseudos/JTH-{xc_name}-v{version}"
         return cls(ps_generator, xc_name, relativity_type, project_name, version, url)
 
-    def download_to(self, path: str) -> None:
-        # JTH use a single repository with all the versions and functionals.
-        # Here we clone the repo in a temp directory, sparse-checkout the subdirectory
-        # with the pseudos and copy the content inside `path`
-        # Directory is deleted automatically on exit
+    # JTH use a single repository with all the versions and functionals.
+    # A local mirror of this repository is shared by all the JthRepo instances.
+    git_url = "https://github.com/abinit/paw_jth_datasets.git"
 
-        #tmp_dir = tempfile.mkdtemp(prefix="paw_clone_"))
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            repo = "https://github.com/abinit/paw_jth_datasets.git"
-            subdir = f"pseudos/JTH-{self.xc_name}-v{self.version}"
-            write_and_run_script(tmp_dir, repo, subdir)
-            src = os.path.join(tmp_dir, "paw_jth_datasets", subdir)
-            shutil.copytree(src, path, dirs_exist_ok=True)
+    @property
+    def subdir(self) -> str:
+        """Subdirectory of the git repository with the pseudos."""
+        return f"pseudos/JTH-{self.xc_name}-v{self.version}"
+
+    def get_mirror_dir(self, cache_dir: str) -> str:
+        return os.path.join(cache_dir, "paw_jth_datasets")
+
+    def get_source_id(self, cache_dir: str) -> str:
+        # Update the local mirror and use the id of the git tree associated to the subdirectory
+        # so that the copy is skipped if other directories of the repo changed but not this one.
+        mirror_dir = self.get_mirror_dir(cache_dir)
+        with _GIT_MIRROR_LOCK:
+            update_git_mirror(self.git_url, mirror_dir)
+            return run_git("rev-parse", f"HEAD:{self.subdir}", cwd=mirror_dir).strip()
+
+    def download_to(self, path: str, cache_dir: str) -> None:
+        # Materialize the subdirectory with the pseudos in the mirror (missing blobs are fetched in batch
+        # by git) and hardlink the files inside `path`. Note that git never modifies files in place
+        # so the hardlinks are not affected by subsequent updates of the mirror.
+        mirror_dir = self.get_mirror_dir(cache_dir)
+        with _GIT_MIRROR_LOCK:
+            run_git("sparse-checkout", "add", self.subdir, cwd=mirror_dir)
+
+        print("Copying JTH pseudos from:", os.path.join(mirror_dir, self.subdir), "to:", path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp_dir:
+            src = os.path.join(tmp_dir, self.name)
+            shutil.copytree(os.path.join(mirror_dir, self.subdir), src, copy_function=link_or_copy)
+            replace_dir(src, path)
 
     @property
     def ps_type(self) -> str:
@@ -427,7 +1151,7 @@ class JthRepo(PseudosRepo):
 
     def validate_checksums(self, verbose: int) -> None:
         print(f"\nValidating md5 checksums of {repr(self)} ...")
-        cprint("WARNING: JTH-PAW repository does not support md5 checksums!!!", color="red")
+        print("WARNING: JTH-PAW repository does not support md5 checksums!!!")
 
     @property
     def type(self) -> str:
@@ -438,43 +1162,395 @@ class JthRepo(PseudosRepo):
         else:
             raise ValueError(f"Invalid relativity_type {self.relativity_type}")
 
+    @property
+    def type_label(self) -> str:
+        return f"PAW (JTH v{self.version})" if self.relativity_type == "SR" else \
+               f"PAW {self.relativity_type} (JTH v{self.version})"
+
     @property
     def formats(self) -> list[str]:
         """List of file formats provided by the repository."""
         return ["xml", "UPF", "html"]
         #return ["xml", "UPF", "html", "djrepo"]
 
+    def get_html_inputs(self, prefix: str) -> list[str]:
+        xml_path = os.path.join(self.path, prefix + ".xml")
+        input_path = os.path.join(self.path, prefix + ".atompaw.input")
+        readme_path = os.path.join(self.path, os.path.dirname(prefix), "README.md")
+        return [xml_path, input_path, readme_path]
+
+    def get_meta_inputs(self, path: str) -> list[str]:
+        return [path]
+
+    def parse_meta(self, path: str) -> dict:
+        return self.get_meta_from_pawxml(path)
+
     def get_meta_from_pawxml(self, path: str) -> dict:
-        pseudo = PawXmlSetup(path)
-        meta = {
-            "nv": pseudo.valence,
-        }
+        # Read only the header of the XML file. Use pymatgen if the header has an unexpected structure.
+        try:
+            return read_pawxml_meta(path)
+        except Exception as exc:
+            print(f"Cannot read header of {path} with {exc!r}. Using PawXmlSetup.")
+            return read_pawxml_meta_with_pymatgen(path)
 
-        e = pseudo.root.find("pw_ecut")
-        if e is None:
-            print("Cannot find hints (pw_ecut) in:", path)
-            low, normal, high = -1, -1, -1
-        else:
-            hints = e.attrib
-            low = float(hints["low"])
-            normal = float(hints["medium"])
-            high = float(hints["high"])
 
-        meta.update(hl=low, hn=normal, hh=high)
-        #print(f"meta for path: {path}\n", meta)
-        return meta
+# Assets referenced in the top-level HTML files that are served with a content-hash in the name.
+# json/index.json is fingerprinted as well but it belongs to the build (see Website.prepare_build_assets).
+ASSETS_TO_FINGERPRINT = ["js/dojo-tools.js", "css/style.css"]
+
+
+# The top-level pages of the website are generated from the templates tracked by git (e.g. index.html.in -> index.html)
+# so that the references to the fingerprinted assets do not modify the files of the git checkout.
+PAGE_TEMPLATE_SUFFIX = ".in"
+
+
+def find_page_templates(site_path: str) -> list[str]:
+    """Return the sorted list of the templates of the top-level HTML pages e.g. ./index.html.in"""
+    return [os.path.join(site_path, f) for f in sorted(os.listdir(site_path))
+            if f.endswith(".html" + PAGE_TEMPLATE_SUFFIX)]
+
+
+def get_page_names(site_path: str) -> list[str]:
+    """Return the names of the top-level HTML pages generated from the templates e.g. index.html"""
+    return [os.path.basename(p)[:-len(PAGE_TEMPLATE_SUFFIX)] for p in find_page_templates(site_path)]
+
+
+def prepare_site_assets(site_path: str, pages_dir: str, index_relpath: str | None, nprocs: int = 1) -> None:
+    """
+    Copy js/dojo-tools.js and css/style.css to files whose name contains the hash of the content,
+    generate the top-level HTML files in `pages_dir` from the templates replacing the references to the assets
+    (including the location of the fingerprinted index of the build) and precompress the HTML,
+    JS and CSS files.
+    The fingerprinted files of the previous builds are kept as they are still referenced by the published pages
+    (see remove_unused_site_assets).
+
+    Args:
+        site_path: Root directory of the website.
+        pages_dir: Directory where the HTML files are written e.g. the directory of the build to be published.
+        index_relpath: Relative path of the fingerprinted json/index.json. None if not available.
+        nprocs: Number of threads used to compress the files.
+    """
+    print("Fingerprinting and precompressing static assets")
+    mapping = {}
+    if index_relpath is not None:
+        mapping["json/index.json"] = index_relpath
+    for relpath in ASSETS_TO_FINGERPRINT:
+        if os.path.exists(os.path.join(site_path, relpath)):
+            mapping[relpath] = fingerprint(site_path, relpath)
+
+    html_paths = []
+    for template_path in find_page_templates(site_path):
+        html_path = os.path.join(pages_dir, os.path.basename(template_path)[:-len(PAGE_TEMPLATE_SUFFIX)])
+        if render_page(template_path, html_path, mapping):
+            print("Rendered page with references to fingerprinted assets:", html_path)
+        html_paths.append(html_path)
+
+    paths = html_paths.copy()
+    for dirname in ("js", "css"):
+        paths.extend(find_text_assets(os.path.join(site_path, dirname)))
+
+    count = precompress_paths(paths, nprocs=nprocs)
+    print(f"Wrote {count} compressed files for {len(paths)} text assets")
+
+
+def link_site_pages(site_path: str) -> None:
+    """
+    Make the top-level HTML pages (and their .gz and .br siblings) symlinks to the pages of the current build
+    so that the pages and the fingerprinted index they reference are published by the same swap of `current`.
+    Regular files left by a previous version of deploy.py are replaced atomically.
+    """
+    for name in get_page_names(site_path):
+        for path_name in (name, name + ".gz", name + ".br"):
+            if not os.path.exists(os.path.join(site_path, CURRENT_LINKNAME, path_name)): continue
+            path = os.path.join(site_path, path_name)
+            target = os.path.join(CURRENT_LINKNAME, path_name)
+            if os.path.islink(path) and os.readlink(path) == target: continue
+            tmp_link = path + ".tmp"
+            if os.path.lexists(tmp_link):
+                os.remove(tmp_link)
+            os.symlink(target, tmp_link)
+            os.replace(tmp_link, path)
+
+
+def remove_unused_site_assets(site_path: str) -> None:
+    """
+    Remove the fingerprinted JS and CSS files that are not referenced by the pages of the website
+    or by the pages of the builds left for rollback.
+    """
+    text = ""
+    page_dirs = [site_path] + [os.path.join(site_path, BUILDS_DIRNAME, b) for b in list_builds(site_path)]
+    for page_dir in page_dirs:
+        for name in get_page_names(site_path):
+            path = os.path.join(page_dir, name)
+            if os.path.isfile(path):
+                with open(path, "rt", encoding="utf-8") as fh:
+                    text += fh.read()
+
+    for relpath in ASSETS_TO_FINGERPRINT:
+        count = remove_fingerprinted(site_path, relpath, keep=find_fingerprinted(text, relpath))
+        if count:
+            print(f"Removed {count} unused fingerprinted files of {relpath}")
+
+
+# Builds produced by `deploy.py new` are stored in BUILDS_DIRNAME/build_id and published by pointing
+# the `current` symlink to the build. The web server sees `tables` and `json` via symlinks to `current`.
+BUILDS_DIRNAME = "builds"
+CURRENT_LINKNAME = "current"
+SERVED_DIRNAMES = ("tables", "json")
+
+# Id of the build used to store the tables and json directories of an installation
+# created before the introduction of versioned builds. The name ensures it is the oldest build.
+LEGACY_BUILD_ID = "00000000T000000-legacy"
+
+
+def list_builds(site_path: str) -> list[str]:
+    """Return the sorted list of build ids (oldest first). Incomplete builds are ignored."""
+    builds_dir = os.path.join(site_path, BUILDS_DIRNAME)
+    if not os.path.isdir(builds_dir):
+        return []
+    return sorted(name for name in os.listdir(builds_dir)
+                  if not name.startswith(".") and os.path.isdir(os.path.join(builds_dir, name)))
+
+
+def get_current_build(site_path: str) -> str | None:
+    """Return the id of the published build. None if the website does not use versioned builds."""
+    current = os.path.join(site_path, CURRENT_LINKNAME)
+    if not os.path.islink(current):
+        return None
+    return os.path.basename(os.readlink(current).rstrip("/"))
+
+
+def publish_build(site_path: str, build_dir: str) -> None:
+    """
+    Publish the build stored in `build_dir` by atomically replacing the `current` symlink.
+    The build must contain the top-level HTML pages (see prepare_site_assets).
+    Create the `tables` and `json` symlinks as well as the symlinks to the pages if needed. If the website has been deployed with a version
+    of deploy.py without versioned builds, tables and json are moved to builds/LEGACY_BUILD_ID first.
+    """
+    for name in SERVED_DIRNAMES:
+        path = os.path.join(site_path, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            legacy_dir = os.path.join(site_path, BUILDS_DIRNAME, LEGACY_BUILD_ID)
+            print(f"Moving {path} to {legacy_dir}")
+            os.makedirs(legacy_dir, exist_ok=True)
+            os.rename(path, os.path.join(legacy_dir, name))
+
+    # Create the new symlink with a temporary name and rename it as rename is atomic.
+    current = os.path.join(site_path, CURRENT_LINKNAME)
+    tmp_link = current + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.relpath(build_dir, start=site_path), tmp_link)
+    os.replace(tmp_link, current)
+
+    for name in SERVED_DIRNAMES:
+        path = os.path.join(site_path, name)
+        if not os.path.islink(path):
+            os.symlink(os.path.join(CURRENT_LINKNAME, name), path)
+
+    # No-op once the pages are symlinks. Websites deployed with a previous version of deploy.py
+    # have regular files that reference the index of the old build until they are replaced here.
+    link_site_pages(site_path)
+    print("Published build:", build_dir)
+
+
+def prune_builds(site_path: str, keep: int) -> None:
+    """Remove the oldest builds so that only the last `keep` builds are left. The current build is never removed."""
+    current = get_current_build(site_path)
+    builds = list_builds(site_path)
+    for build_id in builds[:max(0, len(builds) - keep)]:
+        if build_id == current: continue
+        print("Removing old build:", build_id)
+        shutil.rmtree(os.path.join(site_path, BUILDS_DIRNAME, build_id))
+
+
+def get_expected_checksums(json_dir: str) -> dict[str, tuple]:
+    """
+    Read files.json and targz.json from json_dir.
+    Return: dictionary path -> (size, sha256, md5) for all the files listed in the json files.
+    """
+    with open(os.path.join(json_dir, "files.json"), "rt") as fh:
+        files = json.load(fh)
+    with open(os.path.join(json_dir, "targz.json"), "rt") as fh:
+        targz = json.load(fh)
+
+    expected = {}
+    def _add(entry):
+        for fmt, path in entry.items():
+            if fmt in CHECKSUM_KEYS or fmt == "meta": continue
+            if "sha256" not in entry:
+                raise ValueError("json files do not contain checksums. Run `deploy.py update` first.")
+            expected[path] = tuple(entry[k][fmt] for k in CHECKSUM_KEYS)
+
+    for xc_dict in files.values():
+        for tables in xc_dict.values():
+            for table in tables.values():
+                for entry in table.values():
+                    _add(entry)
+    for xc_dict in targz.values():
+        for tables in xc_dict.values():
+            for entry in tables.values():
+                _add(entry)
+
+    return expected
+
+
+def validate_build(build_dir: str) -> list[str]:
+    """
+    Check that all the files listed in the json files of a build exist and have the expected size.
+    Return: list of error messages.
+    """
+    errors = []
+    try:
+        expected = get_expected_checksums(os.path.join(build_dir, "json"))
+    except Exception as exc:
+        return [f"Cannot read the json files in {build_dir}: {exc!r}"]
+
+    for relpath, (size, _, _) in expected.items():
+        path = os.path.join(build_dir, relpath)
+        if not os.path.isfile(path):
+            errors.append(f"Missing file: {relpath}")
+        elif os.path.getsize(path) != size:
+            errors.append(f"Wrong size for {relpath}: expected {size}, found {os.path.getsize(path)}")
+
+    if not os.path.isfile(os.path.join(build_dir, "json", "index.json")):
+        errors.append("Missing file: json/index.json")
+
+    return errors
+
+
+def stat_files(paths: list[str], nthreads: int = 16) -> dict[str, int | None]:
+    """
+    Stat the files in a single parallel pass (threads are enough as os.stat releases the GIL
+    and hide the latency of network filesystems).
+
+    Return: dictionary path -> size in bytes or None if the file does not exist.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def _size(path):
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+        return dict(zip(paths, executor.map(_size, paths), strict=True))
+
+
+def read_tar_index(tar_path: str) -> dict[str, int]:
+    """
+    Read the headers of the members of a (compressed) tarball without extracting the files.
+    The .tar.zst files are decompressed by piping them through `zstd` as tarfile does not support zstd.
+    Return: dictionary member name -> size in bytes.
+    """
+    import tarfile
+    # Stream mode so that the content of the members is skipped while decompressing.
+    if not tar_path.endswith(COMPRESSORS["zst"][0]):
+        with tarfile.open(tar_path, mode="r|*") as tar:
+            return {member.name: member.size for member in tar if member.isfile()}
+
+    if shutil.which("zstd") is None:
+        raise RuntimeError(f"Cannot find the `zstd` executable required to read {tar_path}")
+    proc = subprocess.Popen(["zstd", "--quiet", "--decompress", "--stdout", tar_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            index = {member.name: member.size for member in tar if member.isfile()}
+    finally:
+        proc.stdout.close()
+        _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"zstd returned {proc.returncode} while reading {tar_path}: {stderr.decode().strip()}")
+    return index
+
+
+def get_table_formats(files: dict, repos: list[PseudosRepo]) -> dict[tuple[str, str], list[str]]:
+    """
+    Return dictionary (typ, xc_name) -> list of the formats that should be available in the tables,
+    taken from the definition of the repository (`formats` property).
+    For tables that do not correspond to any repository, use all the formats found in the tables of the same type.
+    """
+    repo_formats = {(repo.type, repo.xc_name): repo.formats for repo in repos}
+    skip = set(CHECKSUM_KEYS) | {"meta"}
+    found = defaultdict(set)
+    for typ, xc_dict in files.items():
+        for tables in xc_dict.values():
+            for table in tables.values():
+                for entry in table.values():
+                    found[typ].update(k for k in entry if k not in skip)
+
+    return {(typ, xc_name): repo_formats.get((typ, xc_name), sorted(found[typ]))
+            for typ, xc_dict in files.items() for xc_name in xc_dict}
+
+
+def get_table_stats(table: dict) -> dict:
+    """
+    Compute the statistics of the metadata of a table that are shown by the frontend
+    so that the browser does not need to compute them each time the user selects a table.
+
+    Args:
+        table: Dictionary element symbol -> entry of files.json.
+
+    Return: dictionary with:
+
+        count: number of elements with metadata.
+        stats: {key: [mean, min, max]} for each key in META_KEYS.
+        meta: dense list indexed by Z - 1 with the values of META_KEYS for each element (None if not available).
+    """
+    import math
+    meta = [None] * len(ELEMENTS_BY_Z)
+    values = {key: [] for key in META_KEYS}
+
+    for z, elm in enumerate(ELEMENTS_BY_Z):
+        elm_meta = table.get(elm, {}).get("meta")
+        if not elm_meta: continue
+        row = []
+        for key in META_KEYS:
+            value = elm_meta.get(key)
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                value = None
+            if value is not None and not math.isfinite(value):
+                value = None
+            # Negative hints mean that the pseudo does not provide hints hence they are not included in the stats.
+            if value is not None and (key == "nv" or value >= 0):
+                values[key].append(value)
+            row.append(value)
+        meta[z] = row
+
+    stats = {key: [round(sum(v) / len(v), 2), min(v), max(v)] for key, v in values.items() if v}
+    return dict(count=sum(1 for row in meta if row is not None), stats=stats, meta=meta)
 
 
 class Website:
     """
     files[typ][xc_name][table_name][elm][fmt]
+    files[typ][xc_name][table_name][elm][key][fmt]
     targz[typ][xc_name][table_name][fmt]
+    targz[typ][xc_name][table_name][key][fmt]
+
+    where key is one of CHECKSUM_KEYS ("size", "sha256", "md5").
     """
 
-    def __init__(self, path: str, verbose: int) -> None:
+    def __init__(self, path: str, verbose: int, nprocs: int = 1,
+                 compressors: list[tuple[str, int]] | None = None, rebuild_meta: bool = False,
+                 profiler: BuildProfiler | None = None, plot_tolerance: float | None = None) -> None:
         #self.path = os.path.abspath(path)
         self.path = path
+        # Directory in which tables and json are produced. Changed by build_new to build in a staging directory.
+        # The caches are always stored in the root of the website.
+        self.build_path = path
         self.verbose = verbose
+        # Number of processes used to build the HTML pages. 0 means all the available CPUs.
+        self.nprocs = nprocs if nprocs > 0 else cpu_count()
+        # Compression backends used for the tarballs.
+        self.compressors = compressors
+        # True if the metadata should be extracted from the pseudos instead of using the cache.
+        self.rebuild_meta = rebuild_meta
+        # Used to record the timings of the build. Disabled by default.
+        self.profiler = profiler if profiler is not None else BuildProfiler()
 
         # Create list of repositories.
         _mk_onc = OncvpspRepo.from_github
@@ -495,15 +1571,87 @@ class Website:
             #_mk_jth(xc_name="LDA", relativity_type="SR", version="2.0"),
         ]
 
-    def build(self, from_scratch: bool) -> None:
+        # Tolerance used to simplify the curves in the HTML pages.
+        for repo in self.repos:
+            repo.plot_tolerance = plot_tolerance
+
+    def build_new(self, clean: bool = False, keep: int = 3) -> int:
+        """
+        Build the website in a new directory inside `builds` and publish it by swapping the `current` symlink
+        so that the web server never sees a partially built website.
+        `tables` and `json` in the root of the website are symlinks to `current/tables` and `current/json`.
+
+        Args:
+            clean: True to rebuild everything from scratch. By default, the staging directory is initialized
+                with hardlinks to the files of the current build so that unchanged files are neither copied
+                nor stored twice and only the artifacts whose inputs changed are rebuilt.
+            keep: Number of builds to keep for rollback.
+
+        Return: Number of HTML pages that could not be generated, 1 if the build could not be validated.
+        """
+        builds_dir = os.path.join(self.path, BUILDS_DIRNAME)
+        os.makedirs(builds_dir, exist_ok=True)
+        # Remove the staging directories left by builds that did not complete.
+        for name in os.listdir(builds_dir):
+            if name.endswith(".staging"):
+                shutil.rmtree(os.path.join(builds_dir, name))
+
+        build_id = time.strftime("%Y%m%dT%H%M%S")
+        while os.path.exists(os.path.join(builds_dir, build_id)):
+            time.sleep(1)
+            build_id = time.strftime("%Y%m%dT%H%M%S")
+
+        staging_dir = os.path.join(builds_dir, f".{build_id}.staging")
+        os.mkdir(staging_dir)
+
+        tables_dirpath = os.path.join(self.path, "tables")
+        if not clean and os.path.isdir(tables_dirpath):
+            print(f"Hardlinking the files of the current build from {tables_dirpath}")
+            with self.profiler.phase("link_previous_build"):
+                shutil.copytree(tables_dirpath, os.path.join(staging_dir, "tables"),
+                                symlinks=True, copy_function=link_or_copy)
+
+        self.build_path = staging_dir
+        nfailed = self.build(from_scratch=clean)
+
+        with self.profiler.phase("validate"):
+            errors = validate_build(staging_dir)
+        if errors:
+            print(f"\nERROR: build in {staging_dir} is not valid and it will not be published:")
+            for err in errors:
+                print("   ", err)
+            return 1
+
+        # The pages and the fingerprinted assets they reference must exist before the swap.
+        with self.profiler.phase("site_assets"):
+            prepare_site_assets(self.path, staging_dir, self.index_relpath, nprocs=self.nprocs)
+
+        build_dir = os.path.join(builds_dir, build_id)
+        os.rename(staging_dir, build_dir)
+        self.build_path = build_dir
+        publish_build(self.path, build_dir)
+        prune_builds(self.path, keep)
+        remove_unused_site_assets(self.path)
+
+        return nfailed
+
+    def build(self, from_scratch: bool) -> int:
+        """
+        Build tables and json in self.build_path. Return the number of HTML pages that could not be generated.
+        """
         print(f"Building static website with {from_scratch=}")
+        # The caches of the inputs shared by several HTML pages (e.g. README.md) live for a single build.
+        clear_file_caches()
 
         # files[typ][xc_name][table_name][elm][fmt]
         # targz[typ][xc_name][table_name][fmt]
+        # plus the "meta", "size", "sha256" and "md5" entries (see class docstring).
         files = defaultdict(dict)
         targz = defaultdict(dict)
+        # List of (dict, fmt, path) for all the files listed in files and targz.
+        served = []
 
-        tables_dirpath = os.path.join(self.path, "tables")
+        tables_dirpath = os.path.join(self.build_path, "tables")
 
         if from_scratch:
             print(f"Removing {tables_dirpath} directory since {from_scratch=}")
@@ -512,98 +1660,503 @@ class Website:
         if not os.path.isdir(tables_dirpath):
             os.mkdir(tables_dirpath)
 
-        for repo in self.repos:
-            repo.setup(tables_dirpath, from_scratch)
-            if repo.type in files and repo.xc_name in files[repo.type]:
-                raise ValueError(f"repo.type: {repo.type}, repo.xc_name: {repo.xc_name} is already in {files.keys()}")
+        # Fetch the repositories concurrently. The processing of repo N starts as soon as
+        # its data is available while the download of the other repos continues in the background.
+        from concurrent.futures import ThreadPoolExecutor
+        cache_dir = os.path.join(self.path, ".cache", "downloads")
+        def _fetch(repo):
+            start = time.perf_counter()
+            repo.fetch(tables_dirpath, from_scratch, cache_dir)
+            self.profiler.add_artifact("fetch", repo.name, time.perf_counter() - start)
+
+        # The metadata cache is stored outside of tables so that it survives `deploy.py new`.
+        meta_cache = BuildManifest(self.build_path, filepath=os.path.join(self.path, ".cache", "meta_cache.json"))
+        if self.rebuild_meta:
+            print("Ignoring the metadata cache since rebuild_meta is True")
+            meta_cache.artifacts.clear()
+
+        # The executor is shut down also if the processing of a repo fails.
+        with ThreadPoolExecutor(max_workers=max(1, min(4, len(self.repos)))) as fetch_executor:
+            fetch_futures = [fetch_executor.submit(_fetch, repo) for repo in self.repos]
+
+            for repo, future in zip(self.repos, fetch_futures, strict=True):
+                # Time spent waiting for the download of this repo.
+                with self.profiler.phase(f"{repo.name}/fetch_wait"):
+                    future.result()
+                repo.setup(tables_dirpath, from_scratch, nprocs=self.nprocs, verbose=self.verbose,
+                           compressors=self.compressors, profiler=self.profiler)
+                if repo.type in files and repo.xc_name in files[repo.type]:
+                    raise ValueError(f"repo.type: {repo.type}, repo.xc_name: {repo.xc_name} is already in {files.keys()}")
+
+                files[repo.type][repo.xc_name] = defaultdict(dict)
+                targz[repo.type][repo.xc_name] = defaultdict(dict)
+
+                # Build the entries of files.json and targz.json, extract the metadata from the pseudos.
+                with self.profiler.phase(f"{repo.name}/meta"):
+                    for table_name, table in repo.tables.items():
+                        files[repo.type][repo.xc_name][table_name] = defaultdict(dict)
+                        targz[repo.type][repo.xc_name][table_name] = defaultdict(dict)
+
+                        for fmt, rpaths in table.items():
+                            # Store the relative location of the targz file
+                            if fmt in repo.targz[table_name]:
+                                tgz_path = repo.targz[table_name][fmt]
+                                p = os.path.relpath(tgz_path, start=self.build_path)
+                                targz[repo.type][repo.xc_name][table_name][fmt] = p
+                                # Size and checksums are added below after hashing all the files.
+                                served.append((targz[repo.type][repo.xc_name][table_name], fmt, tgz_path))
+
+                            for rpath in rpaths:
+
+                                if repo.ps_generator == "ONCVPSP":
+                                    # Get the element symbol from the relative path.
+                                    # e.g. ONCVPSP-PBE-SR-PDv0.4/Ag/Ag-sp.psp8
+                                    elm = rpath.split(os.sep)[-2]
+
+                                    if fmt == "djrepo":
+                                        # Get hints from the djrepo file if NC pseudo.
+                                        meta = repo.get_meta(rpath, meta_cache, profiler=self.profiler)
+                                        files[repo.type][repo.xc_name][table_name][elm]["meta"] = meta
+
+                                elif repo.ps_generator == "ATOMPAW":
+                                    # Get the element symbol from the relative path.
+                                    # e.g. ATOMICDATA/Ag.LDA_PW-JTH.xml
+                                    elm = os.path.basename(rpath).split(".")[0]
+
+                                    if fmt == "xml":
+                                        # Extract hints from PAW xml
+                                        meta = repo.get_meta(rpath, meta_cache, profiler=self.profiler)
+                                        files[repo.type][repo.xc_name][table_name][elm]["meta"] = meta
+
+                                else:
+                                    raise ValueError(f"Invalid value for repo.ps_generator: {repo.ps_generator}")
+
+                                if elm not in ALL_ELEMENTS:
+                                    raise ValueError(f"Invalid element symbol: `{elm}`")
+
+                                files[repo.type][repo.xc_name][table_name][elm][fmt] = \
+                                    os.path.relpath(rpath, start=self.build_path)
+                                # Only existing files are listed in the tables.
+                                served.append((files[repo.type][repo.xc_name][table_name][elm], fmt, rpath))
+
+                # Save the metadata extracted from the pseudos so that we don't need to parse them again.
+                meta_cache.save()
+
+        # The metadata of all the pseudos served by the website have been requested:
+        # drop the entries of the pseudos that have been removed or renamed.
+        meta_cache.prune()
+        meta_cache.save()
+
+        # Add size and checksums of the files so that the frontend does not need to probe the server
+        # and users can validate the files they download.
+        print(f"\nComputing checksums of {len(served)} files")
+        with self.profiler.phase("checksums"):
+            checksum_cache = ChecksumCache(self.build_path,
+                                           filepath=os.path.join(self.path, ".cache", "checksums.json"))
+            checksums = checksum_cache.compute([path for (_, _, path) in served], nprocs=self.nprocs)
+            checksum_cache.prune()
+            checksum_cache.save()
+        for entry, fmt, path in served:
+            size, sha256, md5 = checksums[path]
+            entry.setdefault("size", {})[fmt] = size
+            entry.setdefault("sha256", {})[fmt] = sha256
+            entry.setdefault("md5", {})[fmt] = md5
 
-            files[repo.type][repo.xc_name] = defaultdict(dict)
-            targz[repo.type][repo.xc_name] = defaultdict(dict)
+        print("\nWriting files.json and targz.json")
+        workdir = os.path.join(self.build_path, "json")
+        if not os.path.isdir(workdir):
+            os.mkdir(workdir)
 
-            for table_name, table in repo.tables.items():
-                files[repo.type][repo.xc_name][table_name] = defaultdict(dict)
-                targz[repo.type][repo.xc_name][table_name] = defaultdict(dict)
+        with self.profiler.phase("json"):
+            write_atomic(os.path.join(workdir, "files.json"),
+                         json.dumps(files, separators=(",", ":"), sort_keys=True))
+            write_atomic(os.path.join(workdir, "targz.json"),
+                         json.dumps(targz, separators=(",", ":"), sort_keys=True))
+            self.write_shards(files, targz)
+
+        # Report the pseudos for which the HTML page could not be generated.
+        html_failures = {os.path.join(repo.name, prefix): tb
+                         for repo in self.repos for prefix, tb in repo.html_failures.items()}
+        failures_path = os.path.join(workdir, "html_failures.json")
+        if html_failures:
+            write_atomic(failures_path, json.dumps(html_failures, indent=2, sort_keys=True))
+            print(f"\nWARNING: {len(html_failures)} HTML pages could not be generated.",
+                  f"See {failures_path} for the tracebacks.")
+        elif os.path.exists(failures_path):
+            os.remove(failures_path)
+
+        with self.profiler.phase("build_assets"):
+            self.index_relpath = self.prepare_build_assets()
 
-                for fmt, rpaths in table.items():
-                    # Store the relative location of the targz file
-                    if fmt in repo.targz[table_name]:
-                        p = os.path.relpath(repo.targz[table_name][fmt], start=self.path)
-                        targz[repo.type][repo.xc_name][table_name][fmt] = p
+        print("Rember to execute `serve.sh` to test the web-server!")
+        return len(html_failures)
 
-                    for rpath in rpaths:
+    def write_shards(self, files: dict, targz: dict) -> None:
+        """
+        Write one compact JSON file per (type, xc_name, table_name) with the content of files.json
+        for that table and a small index.json with the location of the shards and the targz dictionary.
+        The frontend loads only the index at startup and fetches the shard of the selected table on demand.
 
-                        if repo.ps_generator == "ONCVPSP":
-                            # Get the element symbol from the relative path.
-                            # e.g. ONCVPSP-PBE-SR-PDv0.4/Ag/Ag-sp.psp8
-                            elm = rpath.split(os.sep)[-2]
+            index["shards"][typ][xc_name][table_name] = "json/shards/typ/xc_name/table_name.HASH.json"
+            index["targz"] = targz
+            index["capabilities"] = types, XC functionals, tables and formats available (see get_capabilities)
+            index["tables"][typ][xc_name][table_name] = statistics and dense array of hints (see get_table_stats)
 
-                            if fmt == "djrepo":
-                                # Get hints from the djrepo file if NC pseudo.
-                                meta = repo.get_meta_from_djrepo(rpath)
-                                files[repo.type][repo.xc_name][table_name][elm]["meta"] = meta
+        The hashes are stored only in files.json and targz.json.
+        The name of the shard contains the hash of its content so that it can be cached forever by the browser.
+        """
+        print("Writing index.json and per-table shards")
+        json_dir = os.path.join(self.build_path, "json")
+        # The shards of the previous index are removed by remove_stale_build_assets once the pages
+        # referencing the new index have been written.
+        shards = defaultdict(dict)
+        for typ, xc_dict in files.items():
+            for xc_name, tables in xc_dict.items():
+                shards[typ][xc_name] = {}
+                for table_name, table in tables.items():
+                    # The frontend needs only the size so we don't store the hashes in the shards.
+                    table = {elm: {k: v for k, v in entry.items() if k not in ("sha256", "md5")}
+                             for elm, entry in table.items()}
+                    data = json.dumps(table, separators=(",", ":"), sort_keys=True)
+                    basename = f"{table_name}.{content_hash(data.encode())}.json"
+                    relpath = "/".join(["json", "shards", typ, xc_name, basename])
+                    shard_path = os.path.join(self.build_path, *relpath.split("/"))
+                    os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+                    write_atomic(shard_path, data)
+                    shards[typ][xc_name][table_name] = relpath
+
+        targz = {typ: {xc_name: {table_name: {k: v for k, v in entry.items() if k not in ("sha256", "md5")}
+                                 for table_name, entry in tables.items()}
+                       for xc_name, tables in xc_dict.items()}
+                 for typ, xc_dict in targz.items()}
+
+        tables = {typ: {xc_name: {table_name: get_table_stats(table) for table_name, table in xc_tables.items()}
+                        for xc_name, xc_tables in xc_dict.items()}
+                  for typ, xc_dict in files.items()}
+
+        index = dict(shards=shards, targz=targz, capabilities=self.get_capabilities(files),
+                     meta_keys=META_KEYS, tables=tables)
+        write_atomic(os.path.join(json_dir, "index.json"), json.dumps(index, separators=(",", ":"), sort_keys=True))
+
+    def get_capabilities(self, files: dict) -> list[dict]:
+        """
+        Return the list of the pseudo types, XC functionals, tables and formats actually built
+        with the number of elements available for each table and format.
+        The frontend uses this list to fill the dropdown menus so that only combinations that exist are shown.
+        Lists are used to preserve the order of the options in the menus:
+
+            [{"type": "nc-sr-v0.4", "label": "NC SR (ONCVPSP v0.4)", "xcs": [
+                {"xc": "PBE", "tables": [
+                    {"table": "standard", "count": 72, "formats": [["psp8", 72], ["upf", 72], ...]}, ...]}, ...]}, ...]
+        """
+        capabilities = {}
+        for repo in self.repos:
+            tables = files.get(repo.type, {}).get(repo.xc_name)
+            if not tables: continue
+            if repo.type not in capabilities:
+                capabilities[repo.type] = dict(type=repo.type, label=repo.type_label, xcs=[])
+
+            xc_entry = dict(xc=repo.xc_name, tables=[])
+            # The standard table is always shown first.
+            for table_name in sorted(tables, key=lambda t: (t != "standard", t)):
+                table = tables[table_name]
+                formats = [[fmt, sum(1 for entry in table.values() if fmt in entry)] for fmt in repo.formats]
+                formats = [f for f in formats if f[1] > 0]
+                if not formats: continue
+                xc_entry["tables"].append(dict(table=table_name, count=len(table), formats=formats))
+
+            if xc_entry["tables"]:
+                capabilities[repo.type]["xcs"].append(xc_entry)
+
+        return [c for c in capabilities.values() if c["xcs"]]
+
+    def prepare_build_assets(self) -> str:
+        """
+        Copy json/index.json to a file whose name contains the hash of the content and write
+        .gz and .br siblings for all the HTML and JSON files of the build so that the server
+        does not need to compress them on the fly.
 
-                        elif repo.ps_generator == "ATOMPAW":
-                            # Get the element symbol from the relative path.
-                            # e.g. ATOMICDATA/Ag.LDA_PW-JTH.xml
-                            elm = os.path.basename(rpath).split(".")[0]
+        Return: relative path of the fingerprinted index.
+        """
+        print("Fingerprinting and precompressing the files of the build")
+        index_relpath = fingerprint(self.build_path, "json/index.json")
 
-                            if fmt == "xml":
-                                # Extract hints from PAW xml
-                                meta = repo.get_meta_from_pawxml(rpath)
-                                files[repo.type][repo.xc_name][table_name][elm]["meta"] = meta
+        paths = []
+        for dirname in SERVED_DIRNAMES:
+            paths.extend(find_text_assets(os.path.join(self.build_path, dirname)))
 
-                        else:
-                            raise ValueError(f"Invalid value for repo.ps_generator: {repo.ps_generator}")
+        count = precompress_paths(paths, nprocs=self.nprocs)
+        print(f"Wrote {count} compressed files for {len(paths)} text assets")
+        return index_relpath
 
-                        if elm not in ALL_ELEMENTS:
-                            raise ValueError(f"Invalid element symbol: `{elm}`")
 
-                        files[repo.type][repo.xc_name][table_name][elm][fmt] = rpath
+    def remove_stale_build_assets(self) -> None:
+        """
+        Remove the fingerprinted versions of json/index.json and the shards that are not referenced
+        by the current index. Must be called after the pages have been updated.
+        """
+        json_dir = os.path.join(self.build_path, "json")
+        remove_fingerprinted(self.build_path, "json/index.json", keep={self.index_relpath})
 
-        print("\nWriting files.json and targz.json")
-        workdir = os.path.join(self.path, "json")
-        if not os.path.isdir(workdir):
-            os.mkdir(workdir)
+        with open(os.path.join(json_dir, "index.json"), "rt") as fh:
+            shards = {os.path.normpath(relpath) for xc_dict in json.load(fh)["shards"].values()
+                      for tables in xc_dict.values() for relpath in tables.values()}
 
-        with open(os.path.join(workdir, "files.json"), "w") as fh:
-            json.dump(files, fh, indent=2, sort_keys=True)
+        shards_dir = os.path.join(json_dir, "shards")
+        for root, dirs, filenames in os.walk(shards_dir, topdown=False):
+            for f in filenames:
+                path = os.path.join(root, f)
+                name = f[:-3] if f.endswith((".gz", ".br")) else f
+                if os.path.relpath(os.path.join(root, name), self.build_path) not in shards:
+                    os.remove(path)
+            if root != shards_dir and not os.listdir(root):
+                os.rmdir(root)
 
-        with open(os.path.join(workdir, "targz.json"), "w") as fh:
-            json.dump(targz, fh, indent=2, sort_keys=True)
 
-        print("Rember to execute `serve.sh` to test the web-server!")
+def get_profiler(options) -> BuildProfiler:
+    """Build the profiler from the command line options."""
+    return BuildProfiler(enabled=options.profile is not None or options.cprofile is not None,
+                         cprofile_phase=options.cprofile, cprofile_dir=os.path.join(".cache", "profile"))
+
 
-    #def check(self) -> None:
+def write_profile(profiler: BuildProfiler, options) -> None:
+    """Write the JSON report and print the summary if profiling is enabled."""
+    if not profiler.enabled: return
+    profiler.print_summary(top=options.profile_top)
+    if options.profile is not None:
+        profiler.write_report(options.profile)
 
 
 def new(options) -> int:
     """
     Deploy new website in the current working directory.
-    1) download tables from github
+    1) download tables from github in a new build directory
     2) generate new json files
+    3) publish the new build
     """
-    website = Website(".", options.verbose)
-    website.build(from_scratch=True)
-    return 0
+    profiler = get_profiler(options)
+    website = Website(".", options.verbose, nprocs=options.nprocs,
+                      compressors=parse_compressors(options.compression), rebuild_meta=options.rebuild_meta,
+                      profiler=profiler, plot_tolerance=options.plot_tolerance)
+    with profiler.phase("total"):
+        nfailed = website.build_new(clean=options.clean, keep=options.keep_builds)
+    write_profile(profiler, options)
+    return 1 if nfailed else 0
 
 
 def update(options) -> int:
     """
     Update a pre-existent installation.
+    If the website uses versioned builds, the update is built in a new build directory initialized
+    with hardlinks to the current build and published only if valid (same as `deploy.py new`)
+    so that the files of the published build are never modified.
+    Websites deployed before the introduction of versioned builds are updated in place.
     """
-    website = Website(".", options.verbose)
-    website.build(from_scratch=False)
+    profiler = get_profiler(options)
+    website = Website(".", options.verbose, nprocs=options.nprocs,
+                      compressors=parse_compressors(options.compression), rebuild_meta=options.rebuild_meta,
+                      profiler=profiler, plot_tolerance=options.plot_tolerance)
+    with profiler.phase("total"):
+        if os.path.isdir(os.path.join(website.path, BUILDS_DIRNAME)):
+            nfailed = website.build_new(clean=False, keep=options.keep_builds)
+        else:
+            nfailed = website.build(from_scratch=False)
+            with profiler.phase("site_assets"):
+                prepare_site_assets(website.path, website.path, website.index_relpath, nprocs=website.nprocs)
+                website.remove_stale_build_assets()
+                remove_unused_site_assets(website.path)
+    write_profile(profiler, options)
+    return 1 if nfailed else 0
+
+
+def rollback(options) -> int:
+    """
+    Publish a previous build. Default: the build preceding the current one.
+    """
+    site_path = "."
+    builds, current = list_builds(site_path), get_current_build(site_path)
+
+    if options.list:
+        for build_id in builds:
+            print("*" if build_id == current else " ", build_id)
+        return 0
+
+    if current is None:
+        print("The website does not use versioned builds. Use `deploy.py new` first.")
+        return 1
+
+    if options.to is not None:
+        if options.to not in builds:
+            print(f"Cannot find build {options.to} in {builds}")
+            return 1
+        build_id = options.to
+    else:
+        older = [b for b in builds if b < current]
+        if not older:
+            print("There is no build older than the current one:", current)
+            return 1
+        build_id = older[-1]
+
+    build_dir = os.path.join(site_path, BUILDS_DIRNAME, build_id)
+    index_path = os.path.join(build_dir, "json", "index.json")
+    index_relpath = fingerprint(build_dir, "json/index.json") if os.path.isfile(index_path) else None
+    nprocs = options.nprocs if options.nprocs > 0 else cpu_count()
+    # Render the pages again as the build may be older than the templates (or may not contain the pages at all).
+    prepare_site_assets(site_path, build_dir, index_relpath, nprocs=nprocs)
+    publish_build(site_path, build_dir)
+    remove_unused_site_assets(site_path)
     return 0
 
 
+def verify(options) -> int:
+    """
+    Verify the size and the checksums of the files listed in files.json and targz.json.
+    Only the files whose size or mtime changed since the last hashing are read unless --full is used.
+    """
+    website_path = "."
+    # Dictionary path -> expected (size, sha256, md5).
+    expected = get_expected_checksums(os.path.join(website_path, "json"))
+
+    missing = [path for path in expected if not os.path.isfile(path)]
+    for path in missing:
+        print("Missing file:", path)
+
+    checksum_cache = ChecksumCache(website_path)
+    paths = [path for path in expected if path not in missing]
+    checksums = checksum_cache.compute(paths, nprocs=options.nprocs if options.nprocs > 0 else cpu_count(),
+                                       force=options.full)
+    checksum_cache.prune()
+    checksum_cache.save()
+
+    wrong = [path for path in paths if checksums[path] != expected[path]]
+    for path in wrong:
+        print(f"Checksum mismatch for {path}:\n  expected: {expected[path]}\n  found:    {checksums[path]}")
+
+    print(f"Verified {len(expected)} files: {len(missing)} missing, {len(wrong)} with wrong checksum.")
+    return 1 if (missing or wrong) else 0
+
+
+def check(options) -> int:
+    """
+    Check the internal consistency of the website without starting a web server:
+
+    1) all the files listed in files.json, targz.json and the shards listed in index.json exist
+       and have the size stored in the json files (a single parallel stat pass, no hashing)
+    2) the members of each tarball match the files of the table (only the tar headers are read).
+       The size of the HTML pages is not checked as the tarballs contain a copy with the figures embedded.
+    3) report the elements of each table for which some format is not available (coverage gaps)
+    """
+    start = time.perf_counter()
+    website_path = "."
+    json_dir = os.path.join(website_path, "json")
+    nthreads = options.nprocs if options.nprocs > 0 else cpu_count()
+
+    with open(os.path.join(json_dir, "files.json"), "rt") as fh:
+        files = json.load(fh)
+    with open(os.path.join(json_dir, "targz.json"), "rt") as fh:
+        targz = json.load(fh)
+    # Dictionary path -> expected (size, sha256, md5).
+    expected = get_expected_checksums(json_dir)
+
+    shards = []
+    with open(os.path.join(json_dir, "index.json"), "rt") as fh:
+        for xc_dict in json.load(fh)["shards"].values():
+            for tables in xc_dict.values():
+                shards.extend(tables.values())
+
+    errors = []
+    sizes = stat_files(list(expected) + shards, nthreads=nthreads)
+    for path, size in sizes.items():
+        if size is None:
+            errors.append(f"Missing file: {path}")
+        elif path in expected and size != expected[path][0]:
+            errors.append(f"Wrong size for {path}: expected {expected[path][0]}, found {size}")
+
+    # Compare the members of the tarballs with the files of the table.
+    tasks = []
+    for typ, xc_dict in targz.items():
+        for xc_name, tables in xc_dict.items():
+            for table_name, entry in tables.items():
+                for fmt, tar_path in entry.items():
+                    if fmt in CHECKSUM_KEYS or sizes.get(tar_path) is None: continue
+                    # The HTML pages in the tarballs embed the data of the figures (see embed_plots_sidecar)
+                    # so only the names of the members are compared.
+                    members = {os.path.basename(e[fmt]): e["size"][fmt] if fmt != "html" else None
+                               for e in files[typ][xc_name][table_name].values() if fmt in e}
+                    tasks.append((tar_path, members))
+                    # Archives produced by the other compressors (e.g. .tar.zst next to the .tgz) are not
+                    # listed in targz.json but they are served as well.
+                    for suffix in {c[0] for c in COMPRESSORS.values()}:
+                        if not tar_path.endswith(suffix): continue
+                        stem = tar_path[:-len(suffix)]
+                        for other in {c[0] for c in COMPRESSORS.values()} - {suffix}:
+                            if os.path.isfile(stem + other):
+                                tasks.append((stem + other, members))
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+        futures = [executor.submit(read_tar_index, tar_path) for tar_path, _ in tasks]
+        for (tar_path, members), future in zip(tasks, futures, strict=True):
+            try:
+                index = future.result()
+            except Exception as exc:
+                errors.append(f"Cannot read {tar_path}: {exc!r}")
+                continue
+            for name in sorted(set(members) - set(index)):
+                errors.append(f"{tar_path}: missing member {name}")
+            for name in sorted(set(index) - set(members)):
+                errors.append(f"{tar_path}: unexpected member {name}")
+            for name in sorted(set(members) & set(index)):
+                if members[name] is not None and members[name] != index[name]:
+                    errors.append(f"{tar_path}: wrong size for {name}: expected {members[name]}, found {index[name]}")
+
+    # Coverage gaps i.e. elements of the table without some format or formats without tarball.
+    print("Coverage of the tables:")
+    num_gaps = 0
+    table_formats = get_table_formats(files, Website(website_path, options.verbose).repos)
+    for typ, xc_dict in files.items():
+        for xc_name, tables in xc_dict.items():
+            for table_name, table in tables.items():
+                table_targz = targz.get(typ, {}).get(xc_name, {}).get(table_name, {})
+                print(f"  {typ}/{xc_name}/{table_name}: {len(table)} elements")
+                for fmt in table_formats[typ, xc_name]:
+                    missing = [elm for elm in ELEMENTS_BY_Z if elm in table and fmt not in table[elm]]
+                    count = len(table) - len(missing)
+                    line = f"    {fmt:<8} {count:>4}/{len(table)}"
+                    if missing:
+                        line += "  missing for all the elements" if not count else f"  missing: {', '.join(missing)}"
+                    if count and fmt not in table_targz:
+                        line += "  (no tarball)"
+                        num_gaps += 1
+                    num_gaps += len(missing)
+                    print(line)
+
+    failures_path = os.path.join(json_dir, "html_failures.json")
+    if os.path.isfile(failures_path):
+        with open(failures_path, "rt") as fh:
+            print(f"{len(json.load(fh))} HTML pages could not be generated, see {failures_path}")
+
+    for error in errors:
+        print(error)
+
+    print(f"\nChecked {len(sizes)} files and {len(tasks)} tarballs in {time.perf_counter() - start:.2f} s: "
+          f"{len(errors)} errors, {num_gaps} coverage gaps.")
+    return 1 if errors else 0
+
 
 def get_epilog() -> str:
     usage = """\
 
 Usage example:
 
-  deploy.py new     =>  Upload git repos and deploy website from scratch.
+  deploy.py new     =>  Upload git repos and deploy website in a new build directory.
+  deploy.py new --clean  =>  Same as above but rebuild everything from scratch.
+  deploy.py rollback     =>  Publish the build preceding the current one.
   deploy.py update  =>  Update git repos and a pre-existent website.
+  deploy.py update -j 8  =>  Same as above but use 8 processes to build the HTML pages.
+  deploy.py update --profile  =>  Update and write timings of phases and artifacts to profile.json.
+  deploy.py verify  =>  Verify size and checksums of the files listed in files.json and targz.json.
+  deploy.py check -j 8  =>  Check files, tarball members and coverage of the tables with 8 threads.
 """
     return usage
 
@@ -614,6 +2167,24 @@ def get_parser(with_epilog=False):
     copts_parser = argparse.ArgumentParser(add_help=False)
     copts_parser.add_argument('-v', '--verbose', default=0, action='count', # -vv --> verbose=2
         help='verbose, can be supplied multiple times to increase verbosity.')
+    copts_parser.add_argument('-j', '--nprocs', default=1, type=int,
+        help='Number of processes used to build the HTML pages and the tarballs. 0 to use all the CPUs. Default: 1')
+    copts_parser.add_argument('-z', '--compression', default="gz", type=str,
+        help=("Comma-separated list of compressors for the tarballs with optional level e.g. `pigz:6,zst:19`. "
+              f"Possible values: {', '.join(COMPRESSORS)}. Default: gz"))
+    copts_parser.add_argument('--rebuild-meta', default=False, action="store_true",
+        help="Parse the pseudos to extract the metadata (hints, nv) instead of using the cache.")
+    copts_parser.add_argument('--plot-tolerance', default=0.0, type=float,
+        help=("Simplify the curves of the HTML pages so that they change by less than this fraction "
+              "of the range of each curve e.g. 5e-4. Default: 0 i.e. keep all the points."))
+    copts_parser.add_argument('--profile', nargs="?", default=None, const="profile.json", type=str,
+        help=("Record wall time, CPU time and change of the RSS of the phases of the build and of each artifact "
+              "and write the report to the given JSON file. Default: profile.json"))
+    copts_parser.add_argument('--profile-top', default=10, type=int,
+        help="Number of slowest artifacts of each kind shown in the profiling summary. Default: 10")
+    copts_parser.add_argument('--cprofile', default=None, type=str, metavar="PHASE",
+        help=("Run the phases whose name starts with PHASE (e.g. `ONCVPSP-PBE-SR-PDv0.4/html`) with cProfile. "
+              "Results are saved in .cache/profile. Use -j 1 to profile the HTML pages."))
     #copts_parser.add_argument('--loglevel', default="ERROR", type=str,
     #    help="Set the loglevel. Possible values: CRITICAL, ERROR (default), WARNING, INFO, DEBUG.")
 
@@ -627,11 +2198,35 @@ def get_parser(with_epilog=False):
 
     # Subparser for new command.
     p_new = subparsers.add_parser('new', parents=[copts_parser],
-                                  help="Upload git repos and deploy website from scratch.")
+                                  help="Upload git repos and deploy website in a new build directory.")
+    p_new.add_argument('--clean', default=False, action="store_true",
+        help="Rebuild everything from scratch instead of reusing the files of the current build.")
+    p_new.add_argument('--keep-builds', default=3, type=int,
+        help="Number of builds to keep for rollback. Default: 3")
 
     # Subparser for update command.
     p_update = subparsers.add_parser('update', parents=[copts_parser],
                                      help="Update git repos and a pre-existent website.")
+    p_update.add_argument('--keep-builds', default=3, type=int,
+        help="Number of builds to keep for rollback (websites with versioned builds). Default: 3")
+
+    # Subparser for verify command.
+    p_verify = subparsers.add_parser('verify', parents=[copts_parser],
+                                     help="Verify size and checksums of the files listed in the json files.")
+    p_verify.add_argument('--full', default=False, action="store_true",
+        help="Hash all the files instead of only the ones whose size or mtime changed.")
+
+    # Subparser for check command.
+    subparsers.add_parser('check', parents=[copts_parser],
+        help="Check that the files listed in the json files exist and that the tarballs match the tables.")
+
+    # Subparser for rollback command.
+    p_rollback = subparsers.add_parser('rollback', parents=[copts_parser],
+                                       help="Publish a previous build created by `deploy.py new`.")
+    p_rollback.add_argument('--to', default=None, type=str,
+        help="Id of the build to publish. Default: the build preceding the current one.")
+    p_rollback.add_argument('--list', default=False, action="store_true",
+        help="List the available builds. The current one is marked with `*`.")
 
     return parser
 
@@ -1,21 +1,95 @@
 from __future__ import annotations
 
 import os
+import re
 import json
+import base64
+import functools
+import threading
+import collections
 import dataclasses
+import numpy as np
 import plotly.io as pio
 import markdown
 
 from pathlib import Path
 from jinja2 import Environment
+from abipy.core.atom import l2char
 from abipy.ppcodes.oncv_plotter import OncvParser
 
+from asset_tools import write_atomic
+
 # Instantiate the jinja2 template.
 env = Environment()
 #env.globals["zip"] = zip
 
 # Jinja2 templates that allows us to use python syntax to generate HTML programmatically.
 
+# plotly.js is loaded from CDN to reduce file size. Note that the base64 typed arrays used
+# in the sidecar files require plotly.js >= 2.28 (plotly-latest.min.js is frozen at v1.58).
+PLOTLY_CDN_URL = "https://cdn.plot.ly/plotly-2.35.2.min.js"
+
+# Suffix of the JSON file with the data of the figures shown in the HTML page (see write_plots_sidecar).
+SIDECAR_SUFFIX = ".plots.json"
+
+# Placeholder replaced by the data of the sidecar file in the copies of the pages stored in the tarballs
+# (see embed_plots_sidecar) as browsers do not fetch file:// URLs.
+PLOTS_DATA_MARKER = "<!-- plots-data -->"
+
+# Section of the templates with the list of plots.
+# If sidecar is set, the page is a small shell and the figures are read from the sidecar file
+# that is fetched when the first plot is about to become visible (or from the data embedded in the page).
+# Each figure is rendered only when the user scrolls to it.
+PLOTS_HTML = """
+{% for plot in plots %}
+  <h2>{{ plot.title }}</h2>
+  <p>{{ plot.text }}</p>
+  {% if sidecar %}
+  <div class="plot" data-index="{{ loop.index0 }}" style="min-height: 450px;"></div>
+  {% else %}
+  <div class="plot">
+    {{ plot.html | safe }}
+  </div>
+  {% endif %}
+{% endfor %}
+
+{% if sidecar %}
+<!-- plots-data -->
+<script>
+(function () {
+  var figures = null;
+  function load() {
+    if (figures === null) {
+      var embedded = document.getElementById("plots-data");
+      figures = embedded !== null ? Promise.resolve(JSON.parse(embedded.textContent).figures) :
+        fetch("{{ sidecar }}").then(function (r) { return r.json(); }).then(function (d) { return d.figures; });
+    }
+    return figures;
+  }
+  function render(div) {
+    load().then(function (figs) {
+      var fig = figs[Number(div.dataset.index)];
+      Plotly.newPlot(div, fig.data, fig.layout, {responsive: true});
+    });
+  }
+  var divs = document.querySelectorAll("div.plot[data-index]");
+  if (!("IntersectionObserver" in window)) {
+    divs.forEach(render);
+    return;
+  }
+  var observer = new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+      if (!entry.isIntersecting) return;
+      observer.unobserve(entry.target);
+      render(entry.target);
+    });
+  }, {rootMargin: "300px"});
+  divs.forEach(function (div) { observer.observe(div); });
+})();
+</script>
+{% endif %}
+"""
+
 ONCV_TEMPLATE = env.from_string("""
 <!DOCTYPE html>
 <html>
@@ -23,7 +97,7 @@ ONCV_TEMPLATE = env.from_string("""
   <meta charset="utf-8">
   <title>{{ title }}</title>
   <!-- Include Plotly JS in the head -->
-  <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+  <script src="{{ plotly_url }}"></script>
 </head>
 
 <body>
@@ -35,14 +109,7 @@ ONCV_TEMPLATE = env.from_string("""
 <pre><code> {{ input_str | e }} </code></pre>
 
 <!-- Show list of plots -->
-{% for plot in plots %}
-  <h2>{{ plot.title }}</h2>
-  <p>{{ plot.text }}</p>
-  <div class="plot">
-    {{ plot.html | safe }}
-  </div>
-{% endfor %}
-
+""" + PLOTS_HTML + """
 </body>
 </html>
 """
@@ -54,6 +121,8 @@ JTH_TEMPLATE = env.from_string("""
 <head>
   <meta charset="utf-8">
   <title>{{ title }}</title>
+  <!-- Include Plotly JS in the head -->
+  <script src="{{ plotly_url }}"></script>
 </head>
 
 <body>
@@ -64,106 +133,427 @@ JTH_TEMPLATE = env.from_string("""
 <h2>Atompaw input</h2>
 <pre><code> {{ input_str | e }} </code></pre>
 
-<!-- Show README file -->
-<h2>README (from github repo)</h2>
-{{ readme_str }}
+<!-- Show list of plots -->
+""" + PLOTS_HTML + """
+{{ readme_html }}
 
 </body>
 </html>
 """
 )
 
+# The README section is rendered separately as it is the same for all the pseudos in the same directory.
+README_TEMPLATE = env.from_string("""
+<!-- Show README file -->
+<h2>README (from github repo)</h2>
+{{ readme_str }}
+"""
+)
+
+
+
+# Colors and line styles used for the ONCVPSP figures (same conventions as abipy's OncvPlotter).
+COLOR_L = {0: "black", 1: "red", -1: "magenta", 2: "blue", -2: "cyan", 3: "orange", -3: "yellow"}
+DASH_AEPS = {"ae": "solid", "ps": "dash"}
+DASH_N = {1: "solid", 2: "dash", 3: "dot", 4: "dashdot"}
+LINE_WIDTH = 2
+
+# Minimal layout shared by all the figures. We don't use the plotly_white template
+# as it would be serialized in each figure.
+BASE_LAYOUT = dict(
+    paper_bgcolor="white",
+    plot_bgcolor="white",
+    hovermode="closest",
+    margin=dict(l=60, r=20, t=40, b=50),
+    title=dict(x=0.5, xanchor="center", yanchor="top", font=dict(size=14)),
+)
+
+AXIS_LAYOUT = dict(showgrid=True, gridcolor="#EBF0F8", zeroline=False, linecolor="#444", mirror=True, ticks="outside")
+
+# List of (name, title, text) with the ONCVPSP figures shown in the HTML page.
+# name is the suffix of the plot method of OncvPlotter and of the _oncv_fig function in this module.
+ONCV_PLOTS = [
+    ("radial_wfs", "AE and PS radial wavefunctions", "These are the radial wavefunctions"),
+    ("atan_logders", "Arctan of the logarithmic derivatives",
+     "These are the famous ATAN LOGDERs signaling the presence of ghost states ..."),
+    ("kene_vs_ecut", "Convergence in  G-space estimated by ONCVPSP", "kene_vs_ecut ..."),
+    ("projectors", "Projectors", "These are the projectors"),
+    ("potentials", "Local potential and l -dependent potentials", "These are the potentials"),
+    ("densities", "Core-Valence-Model charge densities", "These are the densities"),
+]
+
+# Figures available only for meta-gga pseudos.
+ONCV_METAPSP_PLOTS = [
+    ("tau", "Kinetic energy density", "This is tau"),
+    ("vtau", "Meta-GGA potential", "This is vtau"),
+]
 
 
 @dataclasses.dataclass(kw_only=True)
-class OncvData:
+class PlotData:
     """Collect info on a figure passed to the jinja2 template."""
     html: str
     title: str
     text: str
 
 
-def write_html_from_oncvpsp_outpath(out_path: str) -> str:
+def _line(x, y, name: str, color: str | None = None, dash: str = "solid", **kwargs) -> dict:
+    """
+    Return dictionary with a plotly scatter trace drawn with lines.
+    The $ of the LaTeX labels used by abipy are removed as plotly does not render LaTeX in the legend.
+    """
+    line = dict(width=LINE_WIDTH, dash=dash)
+    if color is not None:
+        line["color"] = color
+    return dict(type="scatter", mode="lines", x=x, y=y, name=name.replace("$", ""), line=line, **kwargs)
+
+
+def _vlines(positions: list[tuple[float, str]]) -> list[dict]:
+    """Dashed vertical lines spanning the full height of the plot. positions: list of (x, color)."""
+    return [dict(type="line", x0=x, x1=x, y0=0, y1=1, xref="x", yref="y domain",
+                 line=dict(width=2, dash="dash", color=color)) for x, color in positions]
+
+
+def _rc_shapes(parser, with_lloc: bool = False) -> list[dict]:
+    """Vertical lines showing the core radii (and the radius of the local part if with_lloc)."""
+    rcs = [(rc, COLOR_L[l]) for l, rc in parser.rc_l.items()]
+    if with_lloc:
+        rcs.append((parser.rc5, "magenta" if parser.lloc == 4 else "black"))
+
+    return _vlines(rcs)
+
+
+def _figure(traces: list[dict], xlabel: str, ylabel: str, title: str = "", shapes=None,
+            xtype: str | None = None, ytype: str | None = None) -> dict:
+    """Build the dictionary with the plotly figure."""
+    xaxis = dict(AXIS_LAYOUT, title=dict(text=xlabel))
+    yaxis = dict(AXIS_LAYOUT, title=dict(text=ylabel))
+    if xtype is not None: xaxis["type"] = xtype
+    if ytype is not None: yaxis["type"] = ytype
+
+    layout = dict(BASE_LAYOUT, xaxis=xaxis, yaxis=yaxis)
+    layout["title"] = dict(layout["title"], text=title)
+    if shapes:
+        layout["shapes"] = shapes
+
+    return dict(data=traces, layout=layout)
+
+
+def decimate_indices(x, y, tolerance: float) -> np.ndarray:
+    """
+    Error-bounded simplification of the polyline (x, y) (Ramer-Douglas-Peucker).
+    All the segments are refined at the same time so that each iteration is a vectorized pass over the points.
+    If x is sorted, the error is the vertical distance from the simplified curve so that the curve obtained
+    by linear interpolation of the points that are kept differs by less than tolerance from all the points.
+    The distance from the segments is used otherwise.
+
+    Args:
+        x, y: Coordinates of the points in the units in which the tolerance is given.
+        tolerance: Maximum distance between the points that are removed and the simplified curve.
+
+    Return: sorted array with the indices of the points to keep (first and last point are always kept).
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    npts = len(x)
+    if npts <= 2:
+        return np.arange(npts)
+
+    vertical = bool(np.all(np.diff(x) >= 0))
+    keep = np.zeros(npts, dtype=bool)
+    keep[[0, -1]] = True
+    points = np.arange(npts)
+
+    while True:
+        idx = np.flatnonzero(keep)
+        # Index of the segment (idx[k], idx[k+1]) containing each point.
+        seg = np.minimum(np.searchsorted(idx, points, side="right") - 1, len(idx) - 2)
+        i0, i1 = idx[seg], idx[seg + 1]
+        dx, dy = x[i1] - x[i0], y[i1] - y[i0]
+        cross = np.abs(dx * (y - y[i0]) - dy * (x - x[i0]))
+        norm = np.abs(dx) if vertical else np.hypot(dx, dy)
+        # Distance of each point from the segment (from the first point if the segment is degenerate).
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dist = np.where(norm > 0, cross / norm, np.hypot(x - x[i0], y - y[i0]))
+        dist[keep] = 0.0
+
+        seg_max = np.maximum.reduceat(dist, idx[:-1])
+        # Add the farthest point of all the segments whose error is larger than the tolerance.
+        split = (dist > tolerance) & (dist == seg_max[seg])
+        if not split.any():
+            return idx
+        keep |= split
+
+
+def decimate_figure(fig: dict, tolerance: float) -> dict:
+    """
+    Remove the points of the traces that do not change the curves by more than tolerance
+    where tolerance is a fraction of the width/height of the trace e.g. 1e-3 is half a pixel for a 500 px plot.
+    Each trace is normalized with its own range so that small traces plotted next to large ones are preserved
+    when the user zooms in or hides the other traces. Log axes are taken into account.
+    Traces with non-finite values are not changed.
+
+    Return: new figure (the input figure is not modified).
+    """
+    layout = fig["layout"]
+    logx = layout.get("xaxis", {}).get("type") == "log"
+    logy = layout.get("yaxis", {}).get("type") == "log"
+
+    def _coords(values, log):
+        values = np.asarray(values, dtype=float)
+        if log:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.log10(values)
+        return values
+
+    traces = []
+    for trace in fig["data"]:
+        cx, cy = _coords(trace["x"], logx), _coords(trace["y"], logy)
+        if len(cx) > 2 and np.all(np.isfinite(cx)) and np.all(np.isfinite(cy)):
+            xrange, yrange = np.ptp(cx) or 1.0, np.ptp(cy) or 1.0
+            idx = decimate_indices(cx / xrange, cy / yrange, tolerance)
+            trace = dict(trace, x=np.asarray(trace["x"])[idx], y=np.asarray(trace["y"])[idx])
+        traces.append(trace)
+
+    return dict(fig, data=traces)
+
+
+def encode_array(values) -> dict:
+    """
+    Encode an array of floats as a base64 typed array accepted by plotly.js e.g. {"dtype": "f4", "bdata": "..."}.
+    float32 is more than enough for the plots and halves the size of the data wrt float64.
+    """
+    data = np.ascontiguousarray(values, dtype="<f4").tobytes()
+    return dict(dtype="f4", bdata=base64.b64encode(data).decode("ascii"))
+
+
+def encode_figure(fig: dict) -> dict:
+    """Return a copy of the figure in which the x and y arrays of the traces are encoded with encode_array."""
+    traces = [dict(trace, **{k: encode_array(trace[k]) for k in ("x", "y") if k in trace}) for trace in fig["data"]]
+    return dict(fig, data=traces)
+
+
+def write_plots_sidecar(html_path: str, figures: list[dict]) -> str:
+    """
+    Write the figures shown in the HTML page to a compact JSON file placed next to the HTML page
+    e.g. Si.html -> Si.plots.json so that the data can be loaded lazily by the browser.
+
+    Return: basename of the sidecar file (the URL used in the HTML page).
+    """
+    sidecar_path = os.path.splitext(html_path)[0] + SIDECAR_SUFFIX
+    data = dict(figures=[encode_figure(fig) for fig in figures])
+    write_atomic(sidecar_path, json.dumps(data, separators=(",", ":")))
+    return os.path.basename(sidecar_path)
+
+
+def embed_plots_sidecar(html_path: str) -> str | None:
+    """
+    Return a copy of the HTML page in which the data of the sidecar file is embedded so that the figures
+    are shown also when the page is opened from the local filesystem e.g. after extracting the tarball.
+    None if the page has no sidecar file.
+    """
+    sidecar_path = os.path.splitext(html_path)[0] + SIDECAR_SUFFIX
+    if not os.path.isfile(sidecar_path):
+        return None
+
+    with open(html_path, "rt", encoding="utf-8") as fh:
+        html = fh.read()
+    if PLOTS_DATA_MARKER not in html:
+        raise ValueError(f"Cannot find the placeholder for the data of the figures in {html_path}")
+
+    with open(sidecar_path, "rt", encoding="utf-8") as fh:
+        # Escape "</" so that the data cannot close the script element.
+        data = fh.read().replace("</", "<\\/")
+    script = f'<script type="application/json" id="plots-data">{data}</script>'
+    return html.replace(PLOTS_DATA_MARKER, script, 1)
+
+
+def _oncv_fig_radial_wfs(parser) -> dict:
+    ae_wfs, ps_wfs = parser.radial_wfs.ae, parser.radial_wfs.ps
+    traces = []
+    for nlk, ae_wf in ae_wfs.items():
+        ps_wf, l = ps_wfs[nlk], nlk.l
+        traces.append(_line(ae_wf.rmesh, ae_wf.values, f"AE {nlk.latex}", COLOR_L[l], DASH_AEPS["ae"]))
+        traces.append(_line(ps_wf.rmesh, ps_wf.values, f"PS {nlk.latex}", COLOR_L[l], DASH_AEPS["ps"]))
+
+    return _figure(traces, "r (Bohr)", "phi(r)", title="Wave Functions", shapes=_rc_shapes(parser))
+
+
+def _oncv_fig_atan_logders(parser) -> dict:
+    ae, ps = parser.atan_logders.ae, parser.atan_logders.ps
+    traces = []
+    for l, ae_alog in ae.items():
+        ps_alog = ps[l]
+        lch = l2char[abs(l)]
+        if parser.relativistic:
+            lch += "^+" if l >= 0 else "^-"
+        # Add pad to avoid overlapping curves.
+        pad = (abs(l) + 1) * 1.0
+        traces.append(_line(ae_alog.energies, ae_alog.values + pad, f"AE {lch}", COLOR_L[l], DASH_AEPS["ae"]))
+        traces.append(_line(ps_alog.energies, ps_alog.values + pad, f"PS {lch}", COLOR_L[l], DASH_AEPS["ps"]))
+
+    return _figure(traces, "Energy (Ha)", "phi(E) = arctan(R * d psi_E(r)/dr |_R)")
+
+
+def _oncv_fig_kene_vs_ecut(parser) -> dict:
+    traces = []
+    for l, data in parser.kene_vs_ecut.items():
+        traces.append(_line(data.energies, data.values, f"Conv l={l2char[l]}", COLOR_L[l], DASH_AEPS["ae"]))
+
+    for nlk, data in parser.kinerr_nlk.items():
+        traces.append(_line(data.ecuts, data.values_ha, f"{nlk.latex}", COLOR_L[nlk.l], DASH_AEPS["ps"],
+                            showlegend=False))
+
+    return _figure(traces, "Ecut (Ha)", "Delta E_kin (Ha)", ytype="log")
+
+
+def _oncv_fig_projectors(parser) -> dict:
+    traces = [_line(proj.rmesh, proj.values, f"Proj {nlk.n}, l={nlk.latex_l}", COLOR_L.get(nlk.l, "black"),
+                    DASH_N[nlk.n]) for nlk, proj in parser.projectors.items()]
+
+    return _figure(traces, "r (Bohr)", "p(r)", title="Projectors", shapes=_rc_shapes(parser))
+
+
+def _oncv_fig_potentials(parser) -> dict:
+    traces = [_line(pot.rmesh, pot.values, "V_{loc}" if l == -1 else "PS V_{%s}" % l2char[l], COLOR_L[l],
+                    DASH_AEPS["ae"]) for l, pot in parser.potentials.items()]
+
+    return _figure(traces, "r (Bohr)", "v_l(r)", title="Ion Pseudopotentials",
+                   shapes=_rc_shapes(parser, with_lloc=True))
+
+
+def _oncv_fig_densities(parser) -> dict:
+    traces = [_line(rho.rmesh, rho.values, name) for name, rho in parser.densities.items()]
+
+    return _figure(traces, "r (Bohr)", "n(r)", title="Charge densities")
+
+
+def _oncv_fig_tau(parser) -> dict:
+    traces = [_line(den.rmesh, den.values, den.name) for den in parser.kin_densities.values()]
+
+    return _figure(traces, "r (Bohr)", "Kinetic energy densities", shapes=_rc_shapes(parser, with_lloc=True),
+                   ytype="log")
+
+
+def _oncv_fig_vtau(parser) -> dict:
+    traces = [_line(pot.rmesh, pot.values, pot.name, COLOR_L[0], DASH_AEPS["ae" if key == "vtau_ae" else "ps"])
+              for key, pot in parser.vtaus.items()]
+
+    return _figure(traces, "r (Bohr)", "Vtaus (Ha / a_B)", shapes=_rc_shapes(parser, with_lloc=True),
+                   xtype="log")
+
+
+def get_oncv_plots(parser) -> list[tuple[str, str, str]]:
+    """Return list of (name, title, text) with the figures available for this pseudo."""
+    return ONCV_PLOTS + ONCV_METAPSP_PLOTS if parser.is_metapsp else ONCV_PLOTS
+
+
+def get_oncv_figures(parser, native: bool = True) -> dict[str, dict]:
+    """
+    Build the plotly figures from the data stored in the parser.
+
+    Args:
+        parser: OncvParser object. Note that the arrays are parsed only once as OncvParser caches them.
+        native: True to build the plotly figures directly from the arrays.
+            False to use the plot methods of OncvPlotter that produce a matplotlib figure
+            that is then converted to plotly (much slower, used to check the results of the native version).
+
+    Return: dictionary mapping the name of the plot to the plotly figure (dict if native else plotly Figure).
+    """
+    names = [name for name, _, _ in get_oncv_plots(parser)]
+
+    if native:
+        return {name: globals()[f"_oncv_fig_{name}"](parser) for name in names}
+
+    plotter = parser.get_plotter()
+    if plotter is None:
+        raise RuntimeError(f"Cannot build plotter from {parser.filepath=}")
+
+    # Use plotly True to generate a matplotlib figure and convert it to plotly automatically.
+    # plot_tau and plot_vtau do not support the plotly option hence we convert the figure explicitly.
+    from abipy.tools.plotting import mpl_to_ply
+    return {name: mpl_to_ply(getattr(plotter, f"plot_{name}")(show=False, plotly=True)) for name in names}
+
+
+def compare_oncv_figures(out_path: str, rtol: float = 1e-8) -> list[str]:
+    """
+    Compare the traces of the figures built with the native version with the ones
+    produced by converting the matplotlib figures of OncvPlotter.
+    The names of the traces, the data and the position of the vertical lines are compared.
+
+    Return: list of strings with the differences (empty if the figures are equivalent).
+    """
+    import plotly.graph_objects as go
+
+    parser = OncvParser(out_path).scan()
+    native_figs = get_oncv_figures(parser, native=True)
+    mpl_figs = get_oncv_figures(parser, native=False)
+
+    errors = []
+    for name, native_fig in native_figs.items():
+        native_fig, mpl_fig = go.Figure(native_fig), mpl_figs[name]
+        if len(native_fig.data) != len(mpl_fig.data):
+            errors.append(f"{name}: {len(native_fig.data)} traces != {len(mpl_fig.data)}")
+            continue
+
+        for i, (t1, t2) in enumerate(zip(native_fig.data, mpl_fig.data, strict=True)):
+            # Traces without label in matplotlib get a private name e.g. `_child3`.
+            if t2.name and not t2.name.startswith("_") and t1.name != t2.name:
+                errors.append(f"{name}: name of trace {i}: {t1.name} != {t2.name}")
+            for xy in ("x", "y"):
+                v1, v2 = np.asarray(getattr(t1, xy), dtype=float), np.asarray(getattr(t2, xy), dtype=float)
+                if v1.shape != v2.shape or not np.allclose(v1, v2, rtol=rtol, equal_nan=True):
+                    errors.append(f"{name}: {xy} of trace {i} ({t1.name}) differ")
+
+        vlines1 = sorted(s.x0 for s in native_fig.layout.shapes)
+        vlines2 = sorted(s.x0 for s in mpl_fig.layout.shapes)
+        if not np.allclose(vlines1, vlines2, rtol=rtol):
+            errors.append(f"{name}: vertical lines {vlines1} != {vlines2}")
+
+    return errors
+
+
+def write_html_from_oncvpsp_outpath(out_path: str, native: bool = True, sidecar: bool = False,
+                                    tolerance: float | None = None) -> str:
     """
     "Use Jinja2 to produce an HTML page for a single oncvps pseudo and write it to disk.
 
     Args:
         out_path: Absolute path to the onvcpsp output file.
-        json_path: Absolute path to the json file with the validation results.
-            If file does not exist, ignore it as not all the pseudos have validation results.
+        native: True to build the plotly figures directly from the parsed arrays
+            False to convert the matplotlib figures produced by OncvPlotter.
+        sidecar: True to write the data of the figures to a separated JSON file loaded lazily by the page.
+            Note that the page must be served by a web server as browsers do not fetch file:// URLs
+            (see embed_plots_sidecar for the copies stored in the tarballs).
+        tolerance: If not None, the traces are simplified with decimate_figure before serialization.
+            Fraction of the size of the plot by which the curves may change. Requires native=True.
 
     Returns: Absolute path to the HTML file produced.
     """
-    # Read oncvpsp output file and build plotter.
-    parser = OncvParser(out_path).scan()
+    if (sidecar or tolerance) and not native:
+        raise ValueError("sidecar and tolerance require native=True")
 
-    plotter = parser.get_plotter()
-    if plotter is None:
-        raise RuntimeError(f"Cannot build plotter from {out_path=}")
+    # Read oncvpsp output file. All the figures are built from the same parsed results.
+    parser = OncvParser(out_path).scan()
+    figures = get_oncv_figures(parser, native=native)
+    if tolerance:
+        figures = {name: decimate_figure(fig, tolerance) for name, fig in figures.items()}
+    html_path = out_path.replace(".out", ".html", 1)
 
     def to_html(fig):
         """
         Convert from plotly figure to html that will then be included in the HTML page using Jinja2 template.
         Note: plotly.js is loaded in the template from CDN to reduce file size.
+        The native figures are already valid so we skip the (expensive) validation step.
         """
-        return pio.to_html(fig, include_plotlyjs=False, full_html=False)
-
-    plots = []
-    app = plots.append
+        return pio.to_html(fig, include_plotlyjs=False, full_html=False, validate=not native)
 
-    # Use plotly True to generate a matplotlib figure and convert it to plotly automatically.
-    kwargs = dict(show=False, plotly=True)
-
-    # This won't work for Si, I have to fix it at the abipy level.
-    app(OncvData(
-        html=to_html(plotter.plot_radial_wfs(**kwargs)),
-        title="AE and PS radial wavefunctions",
-        text="These are the radial wavefunctions",
-    ))
-
-    app(OncvData(
-        html=to_html(plotter.plot_atan_logders(**kwargs)),
-        title="Arctan of the logarithmic derivatives",
-        text="These are the famous ATAN LOGDERs signaling the presence of ghost states ...",
-    ))
-
-    app(OncvData(
-        html=to_html(plotter.plot_kene_vs_ecut(**kwargs)),
-        title="Convergence in  G-space estimated by ONCVPSP",
-        text="kene_vs_ecut ...",
-    ))
-
-    app(OncvData(
-        html=to_html(plotter.plot_projectors(**kwargs)),
-        title="Projectors",
-        text="These are the projectors",
-    ))
-
-    app(OncvData(
-        html=to_html(plotter.plot_potentials(**kwargs)),
-        title="Local potential and l -dependent potentials",
-        text="These are the potentials",
-    ))
-
-    app(OncvData(
-        html=to_html(plotter.plot_densities(**kwargs)),
-        title="Core-Valence-Model charge densities",
-        text="These are the densities",
-    ))
-
-    # This only for meta-gga pseudos.
-    if parser.is_metapsp:
-        app(OncvData(
-            html=to_html(plotter.plot_tau(**kwargs)),
-            title="Kinetic energy density",
-            text="This is tau",
-        ))
-
-        app(OncvData(
-            html=to_html(plotter.plot_vtau(**kwargs)),
-            title="Meta-GGA potential",
-            text="This is vtau",
-        ))
+    oncv_plots = get_oncv_plots(parser)
+    sidecar_url = None
+    if sidecar:
+        sidecar_url = write_plots_sidecar(html_path, [figures[name] for name, _, _ in oncv_plots])
+        plots = [PlotData(html="", title=title, text=text) for _, title, text in oncv_plots]
+    else:
+        plots = [PlotData(html=to_html(figures[name]), title=title, text=text) for name, title, text in oncv_plots]
 
     # Here we read the json file with the validation results and produce plotly plots.
     # Note that this step is optional as a pseudo migth not have validation results.
@@ -182,52 +572,328 @@ def write_html_from_oncvpsp_outpath(out_path: str) -> str:
         title=f"Oncvpsp figures for {name} ",
         input_str=parser.get_input_str(),
         plots=plots,
+        sidecar=sidecar_url,
+        plotly_url=PLOTLY_CDN_URL,
     )
 
     # Write the HTML file.
-    html_path = out_path.replace(".out", ".html", 1)
-    with open(html_path, "wt") as f:
-        f.write(html)
+    write_atomic(html_path, html)
 
     return html_path
 
 
+class FileMemo:
+    """
+    Bounded LRU cache for a function whose first argument is the path of a file e.g. the conversion of README.md.
+    The key includes the mtime and the size of the file so that the value is computed again if the file changed.
+    Each process (e.g. each worker of the multiprocessing Pool used by deploy.py) has its own cache
+    that is reset by `clear_file_caches` at the beginning of the build.
+    """
+
+    def __init__(self, func, maxsize: int):
+        self.func, self.maxsize = func, maxsize
+        self.cache = collections.OrderedDict()
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+        functools.update_wrapper(self, func)
+
+    def __call__(self, path: str, *args):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, args)
+        with self._lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        value = self.func(path, *args)
+        with self._lock:
+            self.misses += 1
+            self.cache[key] = value
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return value
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self.cache.clear()
+            self.hits, self.misses = 0, 0
+
+
+# List of FileMemo objects created by file_memoize.
+_FILE_MEMOS = []
+
+
+def file_memoize(maxsize: int = 128):
+    """Decorator caching the results of a function of a file path with FileMemo."""
+    def decorator(func):
+        memo = FileMemo(func, maxsize)
+        _FILE_MEMOS.append(memo)
+        return memo
+    return decorator
+
+
+def clear_file_caches() -> None:
+    """Clear the caches of all the functions decorated with file_memoize. Called at the beginning of a build."""
+    for memo in _FILE_MEMOS:
+        memo.cache_clear()
+
+
 def md_to_html(input_path: str) -> str:
     """Read markdown from input_path and convert it to html."""
     text = Path(input_path).read_text(encoding="utf-8")
     return markdown.markdown(text)
 
 
-def write_html_from_jth_xml(xml_path: str) -> str:
+@file_memoize(maxsize=64)
+def render_readme(readme_path: str) -> str:
     """
-    "Use Jinja2 to produce an HTML page for a single oncvps pseudo and write it to disk.
+    Render the section of the JTH page with the README.md file.
+    The result is cached as the README is shared by all the pseudos in the same directory.
+    """
+    return README_TEMPLATE.render(readme_str=md_to_html(readme_path))
+
+
+# Plotly default colors used for the quantities associated to the PAW states.
+STATE_COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f",
+                "#bcbd22", "#17becf"]
+
+# Tags of the radial functions in the PAW XML file that are shown in the JTH pages.
+PAWXML_DENSITY_TAGS = ("ae_core_density", "pseudo_core_density", "pseudo_valence_density")
+PAWXML_POTENTIAL_TAGS = ("zero_potential", "blochl_local_ionic_potential", "kresse_joubert_local_ionic_potential")
+PAWXML_STATE_TAGS = ("ae_partial_wave", "pseudo_partial_wave", "projector_function")
+
+
+@dataclasses.dataclass(kw_only=True)
+class PawXmlData:
+    """
+    Radial functions read from a PAW XML file. The functions are stored as (rmesh, values) tuples of numpy arrays.
+    """
+    symbol: str
+    rpaw: float | None
+    states: dict[str, dict]                # state id --> dict with n, l, f, rc, e.
+    shape_function: dict                   # type, rc and (rmesh, values) tuple if numeric.
+    functions: dict[str, tuple]            # tag --> (rmesh, values) for densities and potentials.
+    state_functions: dict[str, dict]       # tag --> {state_id: (rmesh, values)} for partial waves and projectors.
+
+
+def radial_grid_from_attrib(attrib: dict) -> np.ndarray:
+    """Build the radial mesh from the attributes of a radial_grid element of the PAW XML format."""
+    eq = attrib["eq"].replace(" ", "")
+    i = np.arange(int(attrib["istart"]), int(attrib["iend"]) + 1, dtype=float)
+    a = float(attrib.get("a", 0))
+    b = float(attrib.get("b", 0))
+    d = float(attrib.get("d", 0))
+    n = float(attrib.get("n", 0))
+
+    if eq == "r=a*(exp(d*i)-1)":
+        return a * np.expm1(d * i)
+    if eq == "r=a*exp(d*i)":
+        return a * np.exp(d * i)
+    if eq == "r=a*i/(1-b*i)":
+        return a * i / (1 - b * i)
+    if eq == "r=a*i/(n-i)":
+        return a * i / (n - i)
+    if eq == "r=d*i":
+        return d * i
+    if eq == "r=(i/n+a)^5/a-a^4":
+        return (i / n + a) ** 5 / a - a ** 4
+
+    raise ValueError(f"Unsupported radial grid: {attrib['eq']}")
+
+
+# Numbers written by Fortran without the E in the exponent e.g. 2.5847464847713638-156
+_FORTRAN_EXPONENT_RE = re.compile(r"(\d)([+-]\d{3})\b")
+
+
+def read_pawxml_data(path: str) -> PawXmlData:
+    """
+    Read the radial functions from a PAW XML file with a single streaming parse.
+    The elements are discarded once processed so that the memory does not grow with the size of the file.
+    """
+    import xml.etree.ElementTree as ET
+    symbol, rpaw = None, None
+    grids, states, shape_function = {}, {}, {}
+    functions, state_functions = {}, {tag: {} for tag in PAWXML_STATE_TAGS}
+
+    def _values(elem):
+        # Fortran drops the E in exponents with three digits e.g. 2.5847464847713638-156.
+        # Note that np.fromstring cannot be used as old versions of numpy stop at the first invalid number
+        # with a DeprecationWarning instead of raising.
+        text = _FORTRAN_EXPONENT_RE.sub(r"\1E\2", elem.text)
+        return grids[elem.attrib["grid"]], np.array(text.split(), dtype=float)
+
+    with open(path, "rb") as fh:
+        for _, elem in ET.iterparse(fh, events=("end",)):
+            tag = elem.tag
+            if tag == "atom":
+                symbol = elem.attrib["symbol"]
+            elif tag == "PAW_radius":
+                rpaw = float(elem.attrib["rpaw"])
+            elif tag == "state":
+                a = elem.attrib
+                states[a["id"]] = dict(n=int(a["n"]) if "n" in a else None, l=int(a["l"]),
+                                       f=float(a.get("f", 0)), rc=float(a["rc"]), e=float(a["e"]))
+            elif tag == "radial_grid":
+                grids[elem.attrib["id"]] = radial_grid_from_attrib(elem.attrib)
+            elif tag == "shape_function":
+                shape_function = dict(type=elem.attrib["type"], rc=float(elem.attrib.get("rc", 0)))
+                if "grid" in elem.attrib:
+                    shape_function["values"] = _values(elem)
+            elif tag in PAWXML_DENSITY_TAGS or tag in PAWXML_POTENTIAL_TAGS:
+                functions[tag] = _values(elem)
+            elif tag in PAWXML_STATE_TAGS:
+                state_functions[tag][elem.attrib["state"]] = _values(elem)
+            # All the elements are cleared (including the ones that are not used) so that the tree stays small.
+            elem.clear()
+
+    return PawXmlData(symbol=symbol, rpaw=rpaw, states=states, shape_function=shape_function,
+                      functions=functions, state_functions=state_functions)
+
+
+def get_shape_function(shape: dict, rmesh: np.ndarray) -> np.ndarray | None:
+    """
+    Compute the l=0 compensation charge shape function on rmesh (see the PAW XML specification).
+    The analytic shape functions are normalized so that int g(r) r^2 dr = 1.
+    Return None if the type is not supported.
+    """
+    stype, rc = shape["type"], shape["rc"]
+    if "values" in shape:
+        return np.interp(rmesh, *shape["values"])
+
+    x = rmesh / rc
+    if stype == "gauss":
+        g = np.exp(-x**2)
+    elif stype == "sinc":
+        g = np.where(x < 1, np.sinc(x)**2, 0.0)
+    elif stype == "bessel":
+        # alpha_1 j0(q_1 r) + alpha_2 j0(q_2 r) with j0(q_i rc) = 0 and zero derivative at rc i.e. alpha_1 = alpha_2.
+        g = np.where(x < 1, np.sinc(x) + np.sinc(2 * x), 0.0)
+    else:
+        return None
+
+    # Trapezoidal rule (np.trapz has been renamed in numpy 2).
+    f = g * rmesh**2
+    return g / np.sum(0.5 * (f[1:] + f[:-1]) * np.diff(rmesh))
+
+
+def _state_label(state_id: str, state: dict) -> str:
+    """Label used for the quantities associated to a PAW state e.g. `Si1: l=s, e=-0.397 Ha`."""
+    return f"{state_id}: l={l2char[state['l']]}, e={state['e']:.3f} Ha"
+
+
+def _rpaw_shapes(data: PawXmlData) -> list[dict]:
+    """Vertical line showing the PAW radius."""
+    return _vlines([(data.rpaw, "black")]) if data.rpaw is not None else []
+
+
+def _jth_fig_partial_waves(data: PawXmlData) -> dict:
+    traces = []
+    for i, (state_id, state) in enumerate(data.states.items()):
+        color, label = STATE_COLORS[i % len(STATE_COLORS)], _state_label(state_id, state)
+        for tag, aeps in (("ae_partial_wave", "AE"), ("pseudo_partial_wave", "PS")):
+            if state_id not in data.state_functions[tag]: continue
+            rmesh, values = data.state_functions[tag][state_id]
+            traces.append(_line(rmesh, values, f"{aeps} {label}", color, DASH_AEPS[aeps.lower()],
+                                legendgroup=state_id))
+
+    return _figure(traces, "r (Bohr)", "phi(r)", title="Partial waves", shapes=_rpaw_shapes(data))
+
+
+def _jth_fig_projectors(data: PawXmlData) -> dict:
+    traces = []
+    for i, (state_id, state) in enumerate(data.states.items()):
+        if state_id not in data.state_functions["projector_function"]: continue
+        rmesh, values = data.state_functions["projector_function"][state_id]
+        traces.append(_line(rmesh, values, f"Proj {_state_label(state_id, state)}",
+                            STATE_COLORS[i % len(STATE_COLORS)]))
+
+    return _figure(traces, "r (Bohr)", "p(r)", title="Projectors", shapes=_rpaw_shapes(data))
+
+
+def _jth_fig_densities(data: PawXmlData) -> dict:
+    traces = [_line(*data.functions[tag], tag) for tag in PAWXML_DENSITY_TAGS if tag in data.functions]
+
+    return _figure(traces, "r (Bohr)", "n(r)", title="Charge densities", shapes=_rpaw_shapes(data))
+
+
+def _jth_fig_potentials(data: PawXmlData) -> dict:
+    traces = [_line(*data.functions[tag], tag) for tag in PAWXML_POTENTIAL_TAGS if tag in data.functions]
+
+    return _figure(traces, "r (Bohr)", "v(r) (Ha)", title="Potentials", shapes=_rpaw_shapes(data))
+
+
+def _jth_fig_shape_function(data: PawXmlData) -> dict:
+    traces = []
+    if data.shape_function:
+        # Use the mesh of the densities as it extends beyond the PAW radius.
+        rmesh = data.functions["pseudo_valence_density"][0] if "pseudo_valence_density" in data.functions \
+                else np.linspace(0, 2 * data.shape_function["rc"], 400)
+        values = get_shape_function(data.shape_function, rmesh)
+        if values is not None:
+            traces.append(_line(rmesh, values, f"{data.shape_function['type']}, rc={data.shape_function['rc']:.3f}"))
+
+    return _figure(traces, "r (Bohr)", "g(r)", title="Compensation charge shape function", shapes=_rpaw_shapes(data))
+
+
+# List of (name, title, text) with the JTH figures shown in the HTML page.
+JTH_PLOTS = [
+    ("partial_waves", "AE and PS partial waves", "These are the partial waves"),
+    ("projectors", "Projectors", "These are the projectors"),
+    ("densities", "Core and valence densities", "These are the densities"),
+    ("potentials", "Zero potential and local ionic potential", "These are the potentials"),
+    ("shape_function", "Shape function", "This is the shape function of the compensation charge"),
+]
+
+
+def get_jth_figures(data: PawXmlData) -> dict[str, dict]:
+    """Build the plotly figures from the data read from the PAW XML file."""
+    return {name: globals()[f"_jth_fig_{name}"](data) for name, _, _ in JTH_PLOTS}
+
+
+def write_html_from_jth_xml(xml_path: str, sidecar: bool = False, tolerance: float | None = None) -> str:
+    """
+    "Use Jinja2 to produce an HTML page for a single JTH pseudo and write it to disk.
 
     Args:
-        out_path: Absolute path to the onvcpsp output file.
-        json_path: Absolute path to the json file with the validation results.
-            If file does not exist, ignore it as not all the pseudos have validation results.
+        xml_path: Absolute path to the PAW XML file.
+        sidecar: True to write the data of the figures to a separated JSON file loaded lazily by the page.
+        tolerance: If not None, the traces are simplified with decimate_figure before serialization.
 
     Returns: Absolute path to the HTML file produced.
     """
     dirpath = os.path.dirname(xml_path)
+    html_path = xml_path.replace(".xml", ".html", 1)
 
     input_path = xml_path.replace(".xml", ".atompaw.input")
     with open(input_path, "rt") as f:
         input_str =  f.read()
 
-    readme_path = os.path.join(dirpath, "README.md")
-    readme_str = md_to_html(readme_path)
+    figures = get_jth_figures(read_pawxml_data(xml_path))
+    if tolerance:
+        figures = {name: decimate_figure(fig, tolerance) for name, fig in figures.items()}
+
+    sidecar_url = None
+    if sidecar:
+        sidecar_url = write_plots_sidecar(html_path, [figures[name] for name, _, _ in JTH_PLOTS])
+        plots = [PlotData(html="", title=title, text=text) for _, title, text in JTH_PLOTS]
+    else:
+        plots = [PlotData(html=pio.to_html(figures[name], include_plotlyjs=False, full_html=False, validate=False),
+                          title=title, text=text) for name, title, text in JTH_PLOTS]
+
+    name = os.path.basename(xml_path).replace(".xml", "")
 
     html = JTH_TEMPLATE.render(
-        title=f"JTH_TEMPLATE ",
+        title=f"JTH figures for {name}",
         input_str=input_str,
-        readme_str=readme_str,
+        readme_html=render_readme(os.path.join(dirpath, "README.md")),
+        plots=plots,
+        sidecar=sidecar_url,
+        plotly_url=PLOTLY_CDN_URL,
     )
 
     # Write the HTML file.
-    html_path = xml_path.replace(".xml", ".html", 1)
-    with open(html_path, "wt") as f:
-        f.write(html)
+    write_atomic(html_path, html)
 
     return html_path
 
@@ -237,8 +903,20 @@ if __name__ == "__main__":
     if len(sys.argv) == 1 or "-h" in sys.argv or "--help" in sys.argv:
         print("This module can be executed as a standalone script to facilitate developments")
         print("Syntax: `python html_tools.py Si.out`")
+        print("Use `python html_tools.py --check Si.out` to compare the native plotly figures")
+        print("with the ones obtained by converting the matplotlib figures produced by abipy.")
         sys.exit(1)
 
+    if sys.argv[1] == "--check":
+        retcode = 0
+        for out_path in sys.argv[2:]:
+            errors = compare_oncv_figures(out_path)
+            print(f"{out_path}: {'OK' if not errors else 'FAILED'}")
+            for err in errors:
+                print("   ", err)
+            retcode += len(errors)
+        sys.exit(int(retcode > 0))
+
     path = sys.argv[1]
 
     if path.endswith(".out"):
@@ -37,8 +37,13 @@ const COLORS = {
 };
 
 
-var FILES = null;
+var INDEX = null;          // Content of json/index.json: location of the per-table shards and targz dictionary.
+var CAPS = {};             // Lookup built from INDEX.capabilities: type -> {label, xcs: {xc -> {table -> {count, formats}}}}.
+var CELLS = null;          // DOM nodes of the periodic table showing the metadata (see get_cells).
+var CELL_TEXT = null;      // Text shown in CELLS so that unchanged cells are not written again.
 var TARGZ = null;
+var TABLE_FILES = {};      // Shard of the selected table: element symbol -> {fmt: url, meta: {...}}.
+var SHARDS = {};           // Cache: shard url -> jQuery promise.
 
 
 function getParameterByName(name) {
@@ -96,96 +101,130 @@ function make_light() {
 }
 
 
-function set_info(info) {
-    var averages = {};
-    var sums = {};
-    for (key of ALL_KEYS) {
-      averages[key] = 0.0;
-      sums[key] = 0.0;
+function get_cells() {
+    // Return CELLS[i][k] with the DOM node showing the value of INDEX.meta_keys[k] for ALL_ELEMENTS[i].
+    // The nodes are looked up only once.
+    if (CELLS === null) {
+        CELLS = ALL_ELEMENTS.map(function(el) {
+            return INDEX.meta_keys.map(function(key) { return document.getElementById(el + '_' + key); });
+        });
+        CELL_TEXT = CELLS.map(function(row) { return row.map(function() { return null; }); });
     }
+    return CELLS;
+}
 
-    if (ANIMATE === 1){
-        //console.log('in set_info with animate option');
-        $('.plugin').removeClass('anim');
-        $('.plugin').removeClass('chaos');
-        setTimeout("$('.plugin').addClass('anim')", 10)
-    }
-
-    for (var el of ALL_ELEMENTS) {
-        for (const key of ALL_KEYS) {
-            var id_key = el + '_' + key;
-            var x = document.getElementById(id_key);
-            var el_info = info[el];
-            if (x === null) console.log("null for id_key:", id_key, "el:", el, "key", key, "el_info", el_info);
-
-            var val = 'na';
-            if (el_info === undefined || el_info === null) {
-                val = 'na';
-            }
-            else {
-                val = el_info[key];
-                if (val === undefined || val === null) val = "na";
-            }
 
-            if (val === 'na' || val === 'nan'){
-                var xx = 1;
-            }
-            else {
-                averages[key] += parseFloat(val);
-                sums[key] += 1;
-            }
-            x.innerHTML = val;
+function set_info(table) {
+    // Show the metadata of the table in the periodic table.
+    // table is the entry of INDEX.tables computed by deploy.py with the statistics of the table
+    // and the metadata of the elements indexed by Z - 1. undefined if the table is not available.
+    // The new values are computed first and the DOM is then updated in a single animation frame,
+    // writing only the cells whose value changed.
+    var cells = get_cells();
+    var nkeys = INDEX.meta_keys.length;
+    var updates = [];
+
+    for (var i = 0; i < ALL_ELEMENTS.length; i++) {
+        var row = table ? table.meta[i] : null;
+        for (var k = 0; k < nkeys; k++) {
+            var val = (row && row[k] !== null) ? String(row[k]) : 'na';
+            if (cells[i][k] === null || CELL_TEXT[i][k] === val) continue;
+            CELL_TEXT[i][k] = val;
+            updates.push([cells[i][k], val]);
         }
     }
 
-    //console.log("averages:", averages);
-    //console.log("sums:", sums);
+    requestAnimationFrame(function() {
+        if (ANIMATE === 1){
+            //console.log('in set_info with animate option');
+            $('.plugin').removeClass('anim');
+            $('.plugin').removeClass('chaos');
+            setTimeout("$('.plugin').addClass('anim')", 10)
+        }
 
-    for (var key of ALL_KEYS) {
-        averages[key] = averages[key] / sums[key];
-        averages[key] = averages[key].toFixed(1);
-    }
+        for (const [node, val] of updates) {
+            node.textContent = val;
+        }
 
-    if (sums["hl"] > 0) {
-        set_average(averages);
-        reset_X();
-    }
+        if (table && table.stats.hl) {
+            set_average(table.stats);
+            reset_X();
+        }
+    });
 }
 
 function dojo_start() {
     // Main entry point.
-    // Load dictionaries from json files, set the global variables FILES and TARGZ and build the user interface.
-    var a = $.getJSON("json/files.json");
-    var b = $.getJSON("json/targz.json");
-
-    $.when(a, b).done(function(v1, v2){
-       // when all requests are successful
-       FILES = v1[0];
-       TARGZ = v2[0];
+    // Load the index with the location of the per-table shards, set the global variables INDEX and TARGZ
+    // and build the user interface. The shard of the selected table is fetched by load_set_info.
+    // DOJO_INDEX_URL is defined in index.html and points to the fingerprinted version of the index.
+    var url = (typeof DOJO_INDEX_URL !== "undefined") ? DOJO_INDEX_URL : "json/index.json";
+    $.getJSON(url).done(function(index){
+       INDEX = index;
+       TARGZ = index.targz;
+       CAPS = build_capabilities(index.capabilities || []);
        build_ui();
     });
 }
 
 
+function get_shard(type, xcf, table) {
+    // Return a jQuery promise resolved with the shard of the given table.
+    // Requests are cached so that each shard is downloaded only once.
+    try {
+        var url = INDEX.shards[type][xcf][table];
+    }
+    catch (error) {
+        var url = undefined;
+    }
+    if (!url) {
+        if (DEBUG) console.log("Cannot find shard for type:", type, "xcf:", xcf, "table:", table);
+        return $.Deferred().resolve({}).promise();
+    }
+
+    if (!(url in SHARDS)) {
+        SHARDS[url] = $.getJSON(url);
+        // Allow the user to retry if the request fails.
+        SHARDS[url].fail(function() { delete SHARDS[url]; });
+    }
+    return SHARDS[url];
+}
+
+
 function load_set_info() {
     var type = document.getElementById('TYP').value;
     var xcf = document.getElementById('XCF').value;
     var table = document.getElementById('TABLE').value;
     //if (DEBUG) console.log("In load_set_info with type:", type, "xcf:", xcf, "table:", table);
 
-    // Build dictionary element_symbol -> metadata.
-    var meta = {};
-    for (const elm of ALL_ELEMENTS) {
-        try {
-            meta[elm] = FILES[type][xcf][table][elm]["meta"];
-        }
-        catch (error) {
-            if (DEBUG) console.log("Cannot find element:", elm, "with type:", type, "xcf:", xcf, "table:", table, "\n", error);
-            meta[elm] = {};
-        }
-    }
-    if (DEBUG) console.log("meta:", meta);
-    set_info(meta);
+    // The metadata and the statistics of the tables are precomputed by deploy.py and stored in the index
+    // so that the periodic table can be updated without waiting for the shard.
+    var info = ((INDEX.tables[type] || {})[xcf] || {})[table];
+    if (DEBUG && info === undefined) console.log("Cannot find table with type:", type, "xcf:", xcf, "table:", table);
+    set_info(info);
+
+    // Files are not available until the shard of the new table is loaded.
+    TABLE_FILES = {};
+    with_table_files(function() {});
+}
+
+
+function with_table_files(callback) {
+    // Call callback() once the shard of the selected table has been stored in TABLE_FILES.
+    // The shard is loaded asynchronously so the handlers of the periodic table must wait for it.
+    // The callback is executed immediately if the shard is already available.
+    var type = document.getElementById('TYP').value;
+    var xcf = document.getElementById('XCF').value;
+    var table = document.getElementById('TABLE').value;
+
+    return get_shard(type, xcf, table).done(function(shard) {
+        // Ignore the response if the user changed the selection in the meantime.
+        if (type !== document.getElementById('TYP').value || xcf !== document.getElementById('XCF').value ||
+            table !== document.getElementById('TABLE').value) return;
+
+        TABLE_FILES = shard;
+        callback();
+    });
 }
 
 
@@ -224,16 +263,20 @@ function reset_X(){
 }
 
 
-function set_average(vals){
+function set_average(stats){
+    // Show the mean of the metadata of the table. Minimum and maximum are shown in the tooltip.
+    // stats: {key: [mean, min, max]} computed by deploy.py.
     document.getElementById('av_el').innerHTML = 'Mean'
     for (var key of ALL_KEYS) {
         var node = document.getElementById("av_" + key)
+        var mean = stats[key] ? stats[key][0].toFixed(1) : 'na';
         if (key === "nv") {
-            node.innerHTML = "<small>n<sub>v</sub></small>" + vals[key];
+            node.innerHTML = "<small>n<sub>v</sub></small>" + mean;
         }
         else {
-            node.innerHTML = vals[key];
+            node.innerHTML = mean;
         }
+        node.title = stats[key] ? "min: " + stats[key][1] + ", max: " + stats[key][2] : "";
     }
 }
 
@@ -363,91 +406,87 @@ function dojoTour_guidedtour() {
 }
 
 
+function build_capabilities(capabilities) {
+    // Convert the list of capabilities produced by deploy.py into nested objects so that the options
+    // of the dropdown menus are found with direct lookups. Objects preserve the insertion order of the keys
+    // hence the options are shown in the order chosen by deploy.py.
+    var caps = {};
+    for (const t of capabilities) {
+        var xcs = {};
+        for (const x of t.xcs) {
+            var tables = {};
+            for (const tab of x.tables) {
+                tables[tab.table] = {count: tab.count, formats: tab.formats};
+            }
+            xcs[x.xc] = tables;
+        }
+        caps[t.type] = {label: t.label, xcs: xcs};
+    }
+    return caps;
+}
+
+
+function fill_select(id, values, labels, storage_key) {
+  // Replace the options of the select element with the given values.
+  // Keep the current value if still available else use the value stored in localStorage or the first one.
+  var select = document.getElementById(id);
+  var old_value = select.value;
+  var stored = storage_key ? localStorage.getItem(storage_key) : null;
+  select.length = 0;
+  for (var i = 0; i < values.length; i++) {
+    select.options[i] = new Option(labels[i], values[i]);
+  }
+  if (values.indexOf(old_value) >= 0) {
+    select.value = old_value;
+  }
+  else if (stored !== null && values.indexOf(stored) >= 0) {
+    select.value = stored;
+  }
+}
+
+
+function fill_types() {
+  // Set the options of the Type widget from the capabilities of the build.
+  var types = Object.keys(CAPS);
+  fill_select("TYP", types, types.map(function(t) { return CAPS[t].label; }), null);
+}
+
+
 function dynamic_dropdown(type){
   // Set the values of the XC/Table/Format widgets given the pseudo type.
+  // Only the combinations that have been built by deploy.py are shown (see INDEX.capabilities).
   if (DEBUG) console.log('dynamic dropdown: setting for type:', type);
-  var table = document.getElementById("TABLE");
-  var xcf = document.getElementById("XCF");
-  var fmt = document.getElementById("FMT");
-  // Empty options before starting.
-  table.length = 0;
-  xcf.length = 0;
-  fmt.length = 0;
-
   document.getElementById('warning_box').innerHTML = "";
   //set_warning(' this version is outdated')
 
-  switch (type) {
-    case "jth-sr-v2.0" :
-      // List of tables
-      table.options[0] = new Option("standard", "standard");
-      //table.options[1] = new Option("stringent", "stringent");
-      // List of XC functionals
-      xcf.options[0] = new Option("PBE", "PBE");
-      xcf.options[1] = new Option("LDA", "LDA");
-      // List of file formats
-      fmt.options[0] = new Option("xml", "xml");
-      fmt.options[1] = new Option("upf", "UPF");
-      fmt.options[2] = new Option("html", "html");
-      //fmt.options[3] = new Option("djrepo", "djrepo");
-      break;
-
-    case "nc-sr-v0.4" :
-      // List of tables
-      table.options[0] = new Option("standard", "standard");
-      table.options[1] = new Option("stringent", "stringent");
-      //table.options[2] = new Option("f-frozen", "f-frozen");
-      // List of XC functionals
-      xcf.options[0] = new Option("PBE", "PBE");
-      xcf.options[1] = new Option("PBEsol", "PBEsol");
-      xcf.options[2] = new Option("LDA", "LDA");
-      // List of file formats
-      fmt.options[0] = new Option("psp8", "psp8");
-      fmt.options[1] = new Option("upf", "upf");
-      fmt.options[2] = new Option("psml", "psml");
-      fmt.options[3] = new Option("html", "html");
-      fmt.options[4] = new Option("djrepo", "djrepo");
-      break;
-
-    case "nc-fr-v0.4" :
-      // List of tables
-      table.options[0] = new Option("standard", "standard");
-      table.options[1] = new Option("stringent", "stringent");
-      // List of XC functionals
-      xcf.options[0] = new Option("PBE", "PBE");
-      xcf.options[1] = new Option("PBEsol", "PBEsol");
-      //xcf.options[2] = new Option("LDA", "LDA");
-      // List of file formats
-      fmt.options[0] = new Option("psp8", "psp8");
-      fmt.options[1] = new Option("upf", "upf");
-      fmt.options[2] = new Option("psml", "psml");
-      fmt.options[3] = new Option("html", "html");
-      fmt.options[4] = new Option("djrepo", "djrepo");
-      break;
-
-    //case "nc-sr-04-3plus" :
-    //  set_warning(" this table contains Lanthanide potentials for use in the 3+ configuration only. " +
-    //            "<b>They all have the f-electrons frozen in the core.</b> " +
-    //            "The hints are based on the convergence of the nitride lattice parameter, see the report under format:html for details.");
-    //  table.options[0] = new Option("standard", "standard");
-    //  xcf.options[0] = new Option("PBE", "PBE");
-    //  fmt.options[0] = new Option("psp8", "psp8");
-    //  fmt.options[1] = new Option("upf", "upf");
-    //  fmt.options[2] = new Option("psml", "psml");
-    //  fmt.options[3] = new Option("html", "html");
-    //  fmt.options[4] = new Option("djrepo", "djrepo");
-    //  break;
-
-    //case "core" :
-    //  // TODO or perhaps add new format and handle file download.
-    //  document.getElementById("table").options[0] = new Option("", "standard");
-    //  document.getElementById("XCF").options[0] = new Option("PBE","pbe");
-    //  document.getElementById("FMT").options[2] = new Option("FC","fc");
-    //  break;
-    default:
-      //throw 'Invalid type: ' + type;
-      throw new Error(`Invalid type: ${type}`);
+  if (!(type in CAPS)) {
+    if (DEBUG) console.log("Invalid type:", type);
+    type = Object.keys(CAPS)[0];
+    if (type === undefined) return;
+    document.getElementById("TYP").value = type;
   }
+
+  var xcs = Object.keys(CAPS[type].xcs);
+  fill_select("XCF", xcs, xcs, 'selectedXCF');
+  fill_tables();
+}
+
+
+function fill_tables() {
+  // Set the options of the Table widget given the type and the XC functional.
+  var xcs = CAPS[document.getElementById("TYP").value].xcs;
+  var tables = Object.keys(xcs[document.getElementById("XCF").value] || {});
+  fill_select("TABLE", tables, tables, 'selectedTABLE');
+  fill_formats();
+}
+
+
+function fill_formats() {
+  // Set the options of the Format widget given the type, the XC functional and the table.
+  var xcs = CAPS[document.getElementById("TYP").value].xcs;
+  var table = (xcs[document.getElementById("XCF").value] || {})[document.getElementById("TABLE").value];
+  var formats = table ? table.formats.map(function(f) { return f[0]; }) : [];
+  fill_select("FMT", formats, formats.map(function(f) { return f.toLowerCase(); }), 'selectedFMT');
 }
 
 
@@ -496,6 +535,14 @@ function chaos() {
 }
 
 
+function _get_size(entry, fmt) {
+  // Size of the file stored in the json files. undefined if not available (old json files)
+  // so that _open_selection falls back to a HEAD request.
+  if (entry && entry["size"] && entry["size"][fmt] !== undefined) return entry["size"][fmt];
+  return undefined;
+}
+
+
 function _get_pseudo_selection(dom_object){
 
   var str = dom_object.attr("class");
@@ -512,17 +559,20 @@ function _get_pseudo_selection(dom_object){
   var fmt = $("#FMT").val();
 
   try {
-    var url = FILES[type][xcf][table][elm][fmt];
+    // TABLE_FILES contains the shard of the table currently selected.
+    var url = TABLE_FILES[elm][fmt];
+    var size = _get_size(TABLE_FILES[elm], fmt);
   }
   catch (error) {
     var url = null;
+    var size = undefined;
     if (DEBUG) {
         console.log("Error in _get_pseudo_selection for elm:", elm, "type: ", type, "xcf:", xcf, "table:", table, "fmt:", fmt);
         console.log(error);
     }
   }
 
-  var select = {elm: elm, url: url, type: type, xcf: xcf, table: table, fmt: fmt, color: color, n: n};
+  var select = {elm: elm, url: url, size: size, type: type, xcf: xcf, table: table, fmt: fmt, color: color, n: n};
   if (DEBUG) {
     console.log("in _get_pseudo_selection with url:", url);
     console.log("select:", select);
@@ -540,14 +590,38 @@ function _get_targz_selection(){
 
   try {
     var url = TARGZ[type][xcf][table][fmt];
+    var size = _get_size(TARGZ[type][xcf][table], fmt);
   }
   catch (error) {
     console.log("Error in _get_targz_selection:", error);
     var url = null;
+    var size = undefined;
   }
   if (DEBUG) console.log("in _get_targz_selection with url:", url)
 
-  return {url: url, type: type, xcf: xcf, table: table, fmt: fmt};
+  return {url: url, size: size, type: type, xcf: xcf, table: table, fmt: fmt};
+}
+
+
+function _open_selection(sel, action) {
+  // Call action(sel.url) without downloading the file twice.
+  // The size of the files is stored in the json files generated by deploy.py so the file exists
+  // if the size is known. Use a HEAD request only if the size is not available (old json files).
+  if (sel.size !== undefined) {
+    if (sel.fmt !== "html") show_toast("Downloading " + humanize(sel.size));
+    action(sel.url);
+    return;
+  }
+
+  $.ajax({url: sel.url, type: "HEAD"})
+    .done(function(data, textStatus, jqXHR) {
+      var size = parseInt(jqXHR.getResponseHeader("Content-Length"));
+      if (sel.fmt !== "html" && size > 0) show_toast("Downloading " + humanize(size));
+      action(sel.url);
+    })
+    .fail(function() {
+      show_toast("Sorry but this file is not available!");
+    });
 }
 
 
@@ -599,22 +673,29 @@ function build_ui(){
       // .hover(handlerIn, handlerOut)
       function(){
         var mythis = $(this);
+        mythis.data("hover", true);
         var sel = _get_pseudo_selection(mythis);
 
         // update the X_n box.
         set_X(sel.elm, sel.color, sel.n);
 
-        if (sel.url) {
-            mythis.css("background-color", "#44AA44");
-            mythis.css("color", "#FFFFFF");
-        }
-        else {
-            mythis.css("background-color", "#CC4444");
-            mythis.css("color", "#FFFFFF");
-        }
+        // Wait for the shard before telling the user whether the file is available.
+        with_table_files(function() {
+          if (!mythis.data("hover")) return;
+          var sel = _get_pseudo_selection(mythis);
+          if (sel.url) {
+              mythis.css("background-color", "#44AA44");
+              mythis.css("color", "#FFFFFF");
+          }
+          else {
+              mythis.css("background-color", "#CC4444");
+              mythis.css("color", "#FFFFFF");
+          }
+        });
       }, function(){
         reset_X();
         var mythis = $(this);
+        mythis.data("hover", false);
         var str = mythis.attr("class");
         var res = str.split(" ");
         var bgori = COLORS[res[1]];
@@ -625,32 +706,27 @@ function build_ui(){
     $('.plugin').on('click', function() {
       // get the element selected by the user.
       var mythis = $(this);
-      var sel = _get_pseudo_selection(mythis);
 
-      if (! sel.url) {
-        show_toast("Sorry but this file is not available!");
-        return;
-      }
+      // The files of the table are known only after the shard has been loaded.
+      with_table_files(function() {
+        var sel = _get_pseudo_selection(mythis);
 
-      if (sel.fmt === 'html'){
-        $.get(sel.url)
-          .done(function() {
-            // exists code
-            window.location.href = sel.url;
-            //window.open(sel.url, '_blank');
-          })
-          .fail(function() {
-            // not exists code
-          })}
-      else {
-        $.get(sel.url)
-          .done(function() {
-            // exists code
-            window.downloadFile(sel.url);
-          })
-          .fail(function() {
-            // not exists code
+        if (! sel.url) {
+          show_toast("Sorry but this file is not available!");
+          return;
+        }
+
+        if (sel.fmt === 'html'){
+          _open_selection(sel, function(url) {
+              window.location.href = url;
+              //window.open(url, '_blank');
           })}
+        else {
+          _open_selection(sel, window.downloadFile);
+        }
+      }).fail(function() {
+        show_toast("Cannot load the list of files of the table. Please retry.");
+      });
     });
 
 
@@ -690,14 +766,9 @@ function build_ui(){
         return;
       }
 
-      $.get(sel.url)
-        .done(function() {
-            // exists code
-          window.location.href = sel.url;
-        })
-        .fail(function() {
-            // not exists code
-        })
+      _open_selection(sel, function(url) {
+          window.location.href = url;
+      });
     });
 
     if (getParameterByName('layout') === 'light'){
@@ -747,45 +818,14 @@ function build_ui(){
 
 
 function set_options(){
-  // fill the options for XCF TABLE and FMT based on the type.
+  // fill the options for TYP, XCF, TABLE and FMT.
+  // The type can be selected with the `typ` query parameter.
+  // XCF, TABLE and FMT are set back to the previous selections stored in localStorage if available.
+  fill_types();
   var typ = getParameterByName('typ');
-  if (typ === null){
-    typ = document.getElementById('TYP').value;
-  }
-  var options = document.getElementById('TYP').options;
-  for (var i in options){
-    if (options[i].value == typ){
-         options[i].selected = true;
-    }
-  }
-
-  dynamic_dropdown(typ);
-
-  // if XCF TABLE and FMT have been changed previously set them back to those selections
-  if (localStorage.getItem('selectedXCF')) {
-    var options = document.getElementById('XCF').options
-    for (var i in options){
-       if (options[i].value == localStorage.getItem('selectedXCF')){
-         options[i].selected = true;
-       }
-    }
-  }
-
-  if (localStorage.getItem('selectedTABLE')) {
-    var options = document.getElementById('TABLE').options
-    for (var i in options){
-       if (options[i].value == localStorage.getItem('selectedTABLE')){
-         options[i].selected = true;
-       }
-    }
+  if (typ !== null && typ in CAPS){
+    document.getElementById('TYP').value = typ;
   }
 
-  if (localStorage.getItem('selectedFMT')) {
-    var options = document.getElementById('FMT').options
-    for (var i in options){
-       if (options[i].value == localStorage.getItem('selectedFMT')){
-         options[i].selected = true;
-       }
-    }
-  }
+  dynamic_dropdown(document.getElementById('TYP').value);
 }
@@ -0,0 +1,153 @@
+"""
+Fast readers for the metadata (number of valence electrons and hints for the cutoff energy)
+stored in the pseudopotential files. These functions read only the header of the file
+instead of building the full pymatgen objects that also parse the radial meshes.
+"""
+from __future__ import annotations
+
+import os
+import re
+import xml.etree.ElementTree as ET
+
+
+# Elements that come after the header in a PAW XML file. If we reach one of them,
+# the information we are looking for is not present in the header.
+_PAWXML_DATA_TAGS = {"radial_grid", "shape_function", "ae_core_density"}
+
+
+def read_pawxml_meta(path: str) -> dict:
+    """
+    Extract the number of valence electrons and the hints from the header of a PAW XML file.
+    The file is stream-parsed and the parser stops as soon as the `atom` and `pw_ecut` elements
+    have been found so that the radial grids are never read.
+
+    Return: dictionary with nv, hl, hn, hh. Hints are set to -1 if the file does not provide them.
+    Raise ValueError if the header does not have the expected structure.
+    """
+    nv, hints = None, None
+
+    with open(path, "rb") as fh:
+        for _, elem in ET.iterparse(fh, events=("start",)):
+            tag = elem.tag
+            if tag == "atom":
+                nv = float(elem.attrib["valence"])
+            elif tag == "pw_ecut":
+                hints = elem.attrib
+            elif tag in _PAWXML_DATA_TAGS:
+                break
+
+            if nv is not None and hints is not None:
+                break
+
+    if nv is None:
+        raise ValueError(f"Cannot find the atom element in the header of {path}")
+
+    if hints is None:
+        print("Cannot find hints (pw_ecut) in:", path)
+        low, normal, high = -1, -1, -1
+    else:
+        low = float(hints["low"])
+        normal = float(hints["medium"])
+        high = float(hints["high"])
+
+    return dict(nv=nv, hl=low, hn=normal, hh=high)
+
+
+def read_pawxml_meta_with_pymatgen(path: str) -> dict:
+    """
+    Same as read_pawxml_meta but use the pymatgen PawXmlSetup object that parses the full XML file.
+    Slow but more robust.
+    """
+    from pymatgen.io.abinit.pseudos import PawXmlSetup
+    pseudo = PawXmlSetup(path)
+    meta = {
+        "nv": pseudo.valence,
+    }
+
+    e = pseudo.root.find("pw_ecut")
+    if e is None:
+        print("Cannot find hints (pw_ecut) in:", path)
+        low, normal, high = -1, -1, -1
+    else:
+        hints = e.attrib
+        low = float(hints["low"])
+        normal = float(hints["medium"])
+        high = float(hints["high"])
+
+    meta.update(hl=low, hn=normal, hh=high)
+    return meta
+
+
+def read_psp8_zval(path: str) -> float:
+    """
+    Read the number of valence electrons from the header of a psp8 file.
+    The second line has the format: `zatom, zion, pspd`.
+    """
+    with open(path, "rt") as fh:
+        fh.readline()
+        tokens = fh.readline().split()
+
+    if len(tokens) < 3:
+        raise ValueError(f"Cannot find `zatom, zion, pspd` in the second line of {path}")
+
+    return float(tokens[1].replace("D", "E").replace("d", "e"))
+
+
+# UPF2: <PP_HEADER ... z_valence="4.0" .../>
+_UPF2_ZVAL_RE = re.compile(r'<PP_HEADER\b[^>]*?\bz_valence\s*=\s*"\s*([^"\s]+)\s*"', re.DOTALL)
+
+# UPF1: the PP_HEADER section contains a line of the form `   4.00000000000    Z valence`.
+_UPF1_HEADER_RE = re.compile(r"<PP_HEADER>(.*?)</PP_HEADER>", re.DOTALL)
+
+
+def read_upf_zval(path: str, chunk_size: int = 16 * 1024, max_size: int = 4 * 1024**2) -> float:
+    """
+    Read the number of valence electrons from the PP_HEADER section of a UPF file (version 1 or 2).
+    The file is read in chunks and the reader stops as soon as the header has been found.
+    """
+    text = ""
+    with open(path, "rt") as fh:
+        while len(text) < max_size:
+            chunk = fh.read(chunk_size)
+            if not chunk: break
+            text += chunk
+
+            m = _UPF2_ZVAL_RE.search(text)
+            if m:
+                return float(m.group(1).replace("D", "E").replace("d", "e"))
+
+            m = _UPF1_HEADER_RE.search(text)
+            if m:
+                for line in m.group(1).splitlines():
+                    if "z valence" in line.lower():
+                        return float(line.split()[0].replace("D", "E").replace("d", "e"))
+                break
+
+    raise ValueError(f"Cannot find z_valence in the PP_HEADER section of {path}")
+
+
+def read_zval(path: str) -> float:
+    """
+    Read the number of valence electrons from the header of a psp8 or UPF file.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".psp8":
+        return read_psp8_zval(path)
+    if ext == ".upf":
+        return read_upf_zval(path)
+
+    raise ValueError(f"Don't know how to read the number of valence electrons from {path}")
+
+
+def read_zval_full(path: str) -> float:
+    """
+    Same as read_zval but parse the full file with a different parser: pymatgen is used for psp8 files
+    while the XML tree is built for UPF2 files as pymatgen does not support the UPF format.
+    Slow but more robust.
+    """
+    if os.path.splitext(path)[1].lower() == ".upf":
+        root = ET.parse(path).getroot()
+        return float(root.find("PP_HEADER").attrib["z_valence"].strip())
+
+    from pymatgen.io.abinit.pseudos import Pseudo
+    return Pseudo.from_file(path).Z_val
@@ -0,0 +1,175 @@
+"""
+Tools to profile the build of the website (see the --profile option of deploy.py).
+The profiler records the wall time, the CPU time and the change of the RSS of each phase of the build
+(download, HTML pages, tables, tarballs, metadata, ...) as well as the timings of the single artifacts
+(e.g. the HTML page of each pseudo) so that we can find the pseudos that are pathologically slow.
+"""
+from __future__ import annotations
+
+import os
+import io
+import sys
+import json
+import time
+import resource
+import threading
+
+from contextlib import contextmanager
+
+
+def get_peak_rss_mb() -> tuple[float, float]:
+    """
+    Return the peak resident set size in Mb of this process and of its terminated children
+    (e.g. the workers of a multiprocessing Pool).
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return self_rss, children_rss
+
+
+def get_rss_mb() -> float | None:
+    """
+    Return the current resident set size in Mb of this process or None if not available.
+    Contrary to ru_maxrss, the value can decrease hence it can be used to measure the memory used by a single task.
+    """
+    try:
+        with open("/proc/self/statm", "rt") as fh:
+            resident_pages = int(fh.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        # /proc is available only on Linux.
+        return None
+    return resident_pages * resource.getpagesize() / 1024**2
+
+
+def get_rss_delta_mb(rss_start: float | None) -> float | None:
+    """Return the change of the current RSS in Mb with respect to `rss_start` (None if not available)."""
+    rss = get_rss_mb()
+    return None if rss is None or rss_start is None else rss - rss_start
+
+
+def get_cpu_time() -> float:
+    """CPU time (user + system) of this process and of its terminated children."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class BuildProfiler:
+    """
+    Record the timings of the phases of the build and of the single artifacts.
+    Phases are recorded with the `phase` context manager while artifacts are registered with `add_artifact`
+    (the timings of the artifacts built in a worker process are measured by the worker).
+    The methods can be called from different threads.
+    """
+
+    def __init__(self, enabled: bool = False, cprofile_phase: str | None = None, cprofile_dir: str = "."):
+        """
+        Args:
+            enabled: False to record nothing.
+            cprofile_phase: Run the phases whose name starts with this string under cProfile.
+                Note that cProfile sees only the code executed in the main process.
+            cprofile_dir: Directory in which the cProfile files are written.
+        """
+        self.enabled = enabled
+        self.cprofile_phase = cprofile_phase
+        self.cprofile_dir = cprofile_dir
+        self.phases = []
+        self.artifacts = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager recording wall time, CPU time and the change of the RSS of the main process
+        during a phase of the build. The peak RSS of the process at the end of the phase is recorded as well.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        prof = None
+        if self.cprofile_phase is not None and name.startswith(self.cprofile_phase):
+            import cProfile
+            prof = cProfile.Profile()
+
+        wall_start, cpu_start, rss_start = time.perf_counter(), get_cpu_time(), get_rss_mb()
+        if prof is not None: prof.enable()
+        try:
+            yield
+        finally:
+            if prof is not None: prof.disable()
+            wall, cpu = time.perf_counter() - wall_start, get_cpu_time() - cpu_start
+            rss_delta = get_rss_delta_mb(rss_start)
+            rss, children_rss = get_peak_rss_mb()
+            with self._lock:
+                self.phases.append(dict(name=name, wall=wall, cpu=cpu, rss_delta_mb=rss_delta,
+                                        peak_rss_mb=rss, children_peak_rss_mb=children_rss))
+            if prof is not None:
+                self._write_cprofile(name, prof)
+
+    def _write_cprofile(self, name: str, prof) -> None:
+        """Write the cProfile stats to a .prof file and print the functions with the largest cumulative time."""
+        import pstats
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        prof_path = os.path.join(self.cprofile_dir, name.replace("/", "_").replace(":", "_") + ".prof")
+        prof.dump_stats(prof_path)
+        stream = io.StringIO()
+        pstats.Stats(prof, stream=stream).sort_stats("cumulative").print_stats(20)
+        print(f"\ncProfile results for phase {name} (saved to {prof_path}):")
+        print(stream.getvalue())
+
+    def add_artifact(self, kind: str, name: str, wall: float, cpu: float | None = None,
+                     rss_delta_mb: float | None = None) -> None:
+        """
+        Register the timings of a single artifact.
+
+        Args:
+            kind: Type of artifact e.g. "html", "tarball", "meta".
+            name: Name of the artifact e.g. the path of the pseudo.
+            wall: Wall time in seconds.
+            cpu: CPU time in seconds. None if not available.
+            rss_delta_mb: Change of the RSS in Mb of the process that built the artifact
+                between the beginning and the end of the task. None if not available.
+        """
+        if not self.enabled: return
+        with self._lock:
+            self.artifacts.append(dict(kind=kind, name=name, wall=wall, cpu=cpu, rss_delta_mb=rss_delta_mb))
+
+    def get_slowest(self, kind: str, top: int) -> list[dict]:
+        """Return the `top` slowest artifacts of the given kind."""
+        return sorted((a for a in self.artifacts if a["kind"] == kind), key=lambda a: a["wall"], reverse=True)[:top]
+
+    def write_report(self, filepath: str) -> None:
+        """Write the results in JSON format."""
+        rss, children_rss = get_peak_rss_mb()
+        data = dict(
+            phases=self.phases,
+            artifacts=self.artifacts,
+            peak_rss_mb=rss,
+            children_peak_rss_mb=children_rss,
+        )
+        with open(filepath, "wt") as fh:
+            json.dump(data, fh, indent=2)
+        print("Profiling report written to:", filepath)
+
+    def print_summary(self, top: int = 10, stream=sys.stdout) -> None:
+        """Print the timings of the phases and the `top` slowest artifacts of each kind."""
+        def _fmt(value, fmt):
+            return "-" if value is None else format(value, fmt)
+
+        print("\nBuild phases:", file=stream)
+        print(f"{'phase':<48} {'wall [s]':>10} {'cpu [s]':>10} {'drss [Mb]':>10} {'peak [Mb]':>10}", file=stream)
+        for p in self.phases:
+            print(f"{p['name']:<48} {p['wall']:>10.3f} {p['cpu']:>10.3f} {_fmt(p['rss_delta_mb'], '10.1f'):>10} "
+                  f"{p['peak_rss_mb']:>10.1f}", file=stream)
+
+        for kind in sorted({a["kind"] for a in self.artifacts}):
+            items = [a for a in self.artifacts if a["kind"] == kind]
+            total = sum(a["wall"] for a in items)
+            print(f"\nTop {top} slowest {kind} artifacts out of {len(items)} (total wall: {total:.3f} s):",
+                  file=stream)
+            print(f"{'name':<64} {'wall [s]':>10} {'cpu [s]':>10} {'drss [Mb]':>10}", file=stream)
+            for a in self.get_slowest(kind, top):
+                print(f"{a['name']:<64} {a['wall']:>10.3f} {_fmt(a['cpu'], '10.3f'):>10} "
+                      f"{_fmt(a['rss_delta_mb'], '10.1f'):>10}", file=stream)
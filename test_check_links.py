@@ -0,0 +1,187 @@
+"""
+Tests for check_links.py: the async engine is checked against a local server simulating
+slow, HEAD-rejecting and redirecting hosts. Run them with `python -m pytest` from the root of the website.
+"""
+from __future__ import annotations
+
+import time
+import socket
+import threading
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from collections import defaultdict
+
+from check_links import AsyncChecker, ExternalChecker, LinkChecker, REDIRECT_STATUS
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """
+    Request handler simulating problematic hosts:
+
+        /ok            200
+        /slow          200 after 0.2 s
+        /hang          200 after 3 s (longer than the timeout)
+        /nohead        405 for HEAD requests, 200 with a large body for GET requests
+        /redirect      302 -> /moved -> 301 -> /ok
+        /elsewhere     302 -> server.elsewhere + "/slow" (another host)
+        /loop          302 -> /loop
+        /flaky         503 for the first request, 200 afterwards
+        /missing       404
+        /malformed     invalid status line
+
+    The server records the maximum number of concurrent requests received for each Host header.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body: bool):
+        server, path, host = self.server, urlsplit(self.path).path, self.headers.get("Host")
+        with server.lock:
+            server.inflight[host] += 1
+            server.max_inflight[host] = max(server.max_inflight[host], server.inflight[host])
+            server.counts[path] += 1
+            count = server.counts[path]
+        try:
+            body = b""
+            if path == "/malformed":
+                self.wfile.write(b"garbage\r\n\r\n")
+                return
+            if path == "/slow":
+                time.sleep(0.2)
+            elif path == "/hang":
+                time.sleep(3)
+
+            if path in ("/ok", "/slow", "/hang") or (path == "/flaky" and count > 1):
+                status = 200
+            elif path == "/nohead":
+                status, body = (200, b"x" * 2**22) if send_body else (405, b"")
+            elif path in ("/redirect", "/moved", "/loop", "/elsewhere"):
+                status = 301 if path == "/moved" else 302
+                location = {"/redirect": "/moved", "/moved": "/ok", "/loop": "/loop",
+                            "/elsewhere": server.elsewhere + "/slow"}[path]
+            elif path == "/flaky":
+                status = 503
+            else:
+                status = 404
+
+            self.send_response(status)
+            if status in REDIRECT_STATUS:
+                self.send_header("Location", location)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if send_body and body:
+                # The checker closes the connection after the headers so the body is not sent completely.
+                for i in range(0, len(body), 2**16):
+                    self.wfile.write(body[i:i + 2**16])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with server.lock:
+                server.inflight[host] -= 1
+
+
+def _start_server(host: str, family=socket.AF_INET) -> ThreadingHTTPServer:
+    server_cls = type("_Server", (ThreadingHTTPServer,), dict(address_family=family))
+    server = server_cls((host, 0), _StandInHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.counts, server.inflight, server.max_inflight = defaultdict(int), defaultdict(int), defaultdict(int)
+    server.elsewhere = f"http://localhost:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def server():
+    server = _start_server("127.0.0.1")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_async_checker(server):
+    port, per_host = server.server_address[1], 4
+    base = f"http://127.0.0.1:{port}"
+    # The server keeps on sleeping after the timeout of the client so /hang is requested via another
+    # host name in order not to count these requests when checking the per-host limit.
+    other_base = f"http://localhost:{port}"
+
+    # path: (ok, dict with the expected values of other entries of the result)
+    expected = {
+        "/ok": (True, dict(method="HEAD", redirects=0, attempts=1)),
+        "/hang": (False, dict(status=None, attempts=2)),
+        "/nohead": (True, dict(method="GET", status=200)),
+        "/redirect": (True, dict(redirects=2, final_url=f"{base}/ok")),
+        "/loop": (False, dict(status=None)),
+        "/flaky": (True, dict(status=200, attempts=2)),
+        "/missing": (False, dict(status=404, attempts=1)),
+        "/malformed": (False, dict(status=None, attempts=1)),
+    }
+    def _url(path):
+        return (other_base if path == "/hang" else base) + path
+
+    urls = [_url(path) for path in expected] + [f"{base}/slow?{i}" for i in range(4 * per_host)]
+    checker = AsyncChecker(concurrency=64, per_host=per_host, timeout=1, retries=1, backoff=0.1)
+    results = checker.check_all(urls)
+
+    for path, (ok, values) in expected.items():
+        result = results[_url(path)]
+        assert result["ok"] == ok, (path, result)
+        assert {k: result[k] for k in values} == values, (path, result)
+    assert all(results[url]["ok"] for url in urls if "/slow" in url)
+    assert server.max_inflight[f"127.0.0.1:{port}"] <= per_host
+
+
+def test_per_host_limit_after_redirect(server):
+    """The requests to the targets of the redirects are limited by the semaphore of the target host."""
+    port, per_host = server.server_address[1], 2
+    # Several hosts (servers listening on different ports) redirecting to the same host.
+    origins = [_start_server("127.0.0.1") for _ in range(4)]
+    try:
+        urls = []
+        for origin in origins:
+            origin.elsewhere = f"http://localhost:{port}"
+            urls.extend(f"http://127.0.0.1:{origin.server_address[1]}/elsewhere?{i}" for i in range(per_host))
+        results = AsyncChecker(concurrency=64, per_host=per_host, timeout=5).check_all(urls)
+    finally:
+        for origin in origins:
+            origin.shutdown()
+            origin.server_close()
+
+    assert all(r["ok"] and r["redirects"] == 1 for r in results.values())
+    assert 0 < server.max_inflight[f"localhost:{port}"] <= per_host
+
+
+def test_ipv6_host_header():
+    try:
+        server = _start_server("::1", family=socket.AF_INET6)
+    except OSError:
+        pytest.skip("IPv6 is not available")
+
+    try:
+        url = f"http://[::1]:{server.server_address[1]}/ok"
+        result = AsyncChecker(timeout=5).check_all([url])[url]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert result["ok"], result
+    assert list(server.max_inflight) == [f"[::1]:{server.server_address[1]}"]
+
+
+def test_proxy_uses_threads_engine(tmp_path, monkeypatch):
+    for name in ("http_proxy", "https_proxy", "HTTP_PROXY", "HTTPS_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+    assert isinstance(LinkChecker(str(tmp_path)).get_external_checker(), AsyncChecker)
+
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.invalid:3128")
+    assert isinstance(LinkChecker(str(tmp_path)).get_external_checker(), ExternalChecker)
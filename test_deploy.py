@@ -0,0 +1,157 @@
+"""
+Tests for the build tools of deploy.py. The git mirrors are tested against a local bare repository
+accessed via file:// so no network connection is needed. Run them with `python -m pytest` from the root of the website.
+"""
+from __future__ import annotations
+
+import os
+import pytest
+
+import deploy
+from concurrent.futures.process import BrokenProcessPool
+from deploy import BuildManifest, ChecksumCache, JthRepo, run_git, update_git_mirror, imap_html_tasks
+
+
+def _write(path, text: str) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    """
+    Bare git repository with the layout of paw_jth_datasets served via file://
+    Return (url, worktree) where worktree is a clone used to push new commits.
+    """
+    for name, value in dict(GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+                            GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com").items():
+        monkeypatch.setenv(name, value)
+    # Each test starts with mirrors that have not been updated by this process.
+    monkeypatch.setattr(deploy, "_UPDATED_MIRRORS", set())
+
+    bare, worktree = tmp_path / "remote.git", tmp_path / "worktree"
+    run_git("init", "--bare", "-b", "main", str(bare))
+    # Required by the partial clones (--filter) of the mirror.
+    run_git("config", "uploadpack.allowFilter", "true", cwd=str(bare))
+    run_git("clone", str(bare), str(worktree))
+    _write(worktree / "README.md", "readme")
+    _write(worktree / "pseudos" / "JTH-PBE-v2.0" / "Si.GGA_PBE-JTH.xml", "Si v1")
+    _write(worktree / "pseudos" / "JTH-LDA-v2.0" / "Si.LDA_PW-JTH.xml", "Si v1")
+    _push(worktree, "initial commit")
+    return f"file://{bare}", worktree
+
+
+def _push(worktree, message: str) -> None:
+    run_git("add", "-A", cwd=str(worktree))
+    run_git("commit", "-m", message, cwd=str(worktree))
+    run_git("push", "origin", "HEAD:main", cwd=str(worktree))
+
+
+def _make_page(dirpath: str, prefix: str) -> None:
+    """Stand-in for make_oncv_html executed by the workers: exit abruptly or fail depending on prefix."""
+    if prefix == "killed":
+        os._exit(1)
+    if prefix == "failed":
+        raise ValueError("Cannot parse the pseudo")
+
+
+def _tree_id(worktree, subdir: str) -> str:
+    return run_git("rev-parse", f"HEAD:{subdir}", cwd=str(worktree)).strip()
+
+
+def test_manifest_prune(tmp_path):
+    kept, removed = _write(tmp_path / "kept.in", "kept"), _write(tmp_path / "removed.in", "removed")
+    manifest = BuildManifest(str(tmp_path))
+    manifest.record("kept", [kept], "fp", payload=1)
+    manifest.record("removed", [removed], "fp", payload=2)
+    manifest.save()
+
+    # Next build: removed.in has been deleted so its artifact is not requested anymore.
+    os.remove(removed)
+    manifest = BuildManifest(str(tmp_path))
+    assert not manifest.is_stale("kept", [kept], "fp")
+    assert manifest.get_payload("kept") == 1
+    manifest.prune()
+    manifest.save()
+
+    manifest = BuildManifest(str(tmp_path))
+    assert list(manifest.artifacts) == ["kept"]
+    assert list(manifest.stats) == ["kept.in"]
+
+
+def test_checksum_cache_prune(tmp_path):
+    old, new = _write(tmp_path / "old.txt", "data"), str(tmp_path / "new.txt")
+    cache = ChecksumCache(str(tmp_path))
+    cache.compute([old])
+    cache.save()
+
+    # Next run: old.txt has been renamed.
+    os.rename(old, new)
+    cache = ChecksumCache(str(tmp_path))
+    checksums = cache.compute([new])
+    cache.prune()
+    cache.save()
+
+    assert list(ChecksumCache(str(tmp_path)).entries) == ["new.txt"]
+    assert checksums[new][0] == 4
+
+
+def test_update_git_mirror(remote, tmp_path, monkeypatch):
+    url, worktree = remote
+    mirror_dir = str(tmp_path / "cache" / "mirror")
+    update_git_mirror(url, mirror_dir)
+    # Only the top-level files are checked out.
+    assert os.path.isfile(os.path.join(mirror_dir, "README.md"))
+    assert not os.path.exists(os.path.join(mirror_dir, "pseudos"))
+    assert run_git("rev-parse", "HEAD", cwd=mirror_dir) == run_git("rev-parse", "HEAD", cwd=str(worktree))
+
+    # The mirror is updated at most once per process.
+    _write(worktree / "README.md", "new readme")
+    _push(worktree, "update readme")
+    update_git_mirror(url, mirror_dir)
+    assert (tmp_path / "cache" / "mirror" / "README.md").read_text() == "readme"
+
+    # Fetch the new commits in the existing mirror.
+    monkeypatch.setattr(deploy, "_UPDATED_MIRRORS", set())
+    update_git_mirror(url, mirror_dir)
+    assert (tmp_path / "cache" / "mirror" / "README.md").read_text() == "new readme"
+    assert run_git("rev-parse", "HEAD", cwd=mirror_dir) == run_git("rev-parse", "HEAD", cwd=str(worktree))
+
+
+def test_jth_source_id(remote, tmp_path, monkeypatch):
+    url, worktree = remote
+    monkeypatch.setattr(JthRepo, "git_url", url)
+    repo, cache_dir = JthRepo.from_github("PBE", "SR", "2.0"), str(tmp_path / "cache")
+    source_id = repo.get_source_id(cache_dir)
+    assert source_id == _tree_id(worktree, repo.subdir)
+
+    # The id does not change if other directories of the repository change.
+    _write(worktree / "pseudos" / "JTH-LDA-v2.0" / "Si.LDA_PW-JTH.xml", "Si v2")
+    _push(worktree, "update LDA")
+    monkeypatch.setattr(deploy, "_UPDATED_MIRRORS", set())
+    assert repo.get_source_id(cache_dir) == source_id
+
+    _write(worktree / "pseudos" / "JTH-PBE-v2.0" / "Si.GGA_PBE-JTH.xml", "Si v2")
+    _push(worktree, "update PBE")
+    monkeypatch.setattr(deploy, "_UPDATED_MIRRORS", set())
+    new_id = repo.get_source_id(cache_dir)
+    assert new_id != source_id and new_id == _tree_id(worktree, repo.subdir)
+
+    # The subdirectory is materialized on demand.
+    path = str(tmp_path / "tables" / repo.name)
+    repo.download_to(path, cache_dir)
+    assert os.listdir(path) == ["Si.GGA_PBE-JTH.xml"]
+    assert (tmp_path / "tables" / repo.name / "Si.GGA_PBE-JTH.xml").read_text() == "Si v2"
+
+
+def test_imap_html_tasks():
+    prefixes = [f"Si{i}" for i in range(8)] + ["failed"]
+    results = {prefix: tb for prefix, tb, _ in imap_html_tasks([(_make_page, ".", p) for p in prefixes], 2)}
+    assert sorted(results) == sorted(prefixes)
+    assert "ValueError: Cannot parse the pseudo" in results.pop("failed")
+    assert all(tb is None for tb in results.values())
+
+    # A worker killed e.g. by the OOM killer breaks the pool instead of blocking the build forever.
+    with pytest.raises(BrokenProcessPool):
+        list(imap_html_tasks([(_make_page, ".", p) for p in ["Si", "killed", "Ge"]], 2))
@@ -0,0 +1,52 @@
+"""
+Tests for html_tools.py. Run them with `python -m pytest` from the root of the website.
+"""
+from __future__ import annotations
+
+import os
+import numpy as np
+
+from abipy.ppcodes.oncv_parser import OncvParser
+
+from html_tools import read_pawxml_data, get_jth_figures, decimate_figure, get_oncv_figures, compare_oncv_figures
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+def test_oncv_figures_parity():
+    """The native plotly figures must be equivalent to the ones obtained from the matplotlib figures of abipy."""
+    out_path = os.path.join(TEST_DATA, "Ge.out")
+    figures = get_oncv_figures(OncvParser(out_path).scan(), native=True)
+    assert figures and all(fig["data"] for fig in figures.values())
+    assert compare_oncv_figures(out_path) == []
+
+
+def test_read_pawxml_data():
+    """The file contains numbers written without the E in the exponent e.g. 2.5847464847713638-156."""
+    path = os.path.join(TEST_DATA, "Al.GGA_PBE-JTH.xml")
+    data = read_pawxml_data(path)
+    assert data.symbol == "Al" and len(data.states) == 4
+    arrays = list(data.functions.values()) + [v for d in data.state_functions.values() for v in d.values()]
+    assert arrays
+    for rmesh, values in arrays:
+        assert len(values) == len(rmesh) and np.all(np.isfinite(values))
+
+    with open(path, "rt") as fh:
+        assert "2.5847464847713638-156" in fh.read()
+    rmesh, values = data.functions["ae_core_density"]
+    assert np.any((values > 0) & (values < 1e-150))
+
+
+def test_decimate_figure_jth():
+    """The error of each trace must be bounded by the tolerance times the range of the trace itself."""
+    tolerance = 5e-4
+    figures = get_jth_figures(read_pawxml_data(os.path.join(TEST_DATA, "Al.GGA_PBE-JTH.xml")))
+
+    for name, fig in figures.items():
+        new_fig = decimate_figure(fig, tolerance)
+        for trace, new_trace in zip(fig["data"], new_fig["data"], strict=True):
+            x, y = np.asarray(trace["x"], dtype=float), np.asarray(trace["y"], dtype=float)
+            new_x, new_y = np.asarray(new_trace["x"], dtype=float), np.asarray(new_trace["y"], dtype=float)
+            assert len(new_x) < len(x), f"{name}: {trace['name']}"
+            error = np.max(np.abs(np.interp(x, new_x, new_y) - y)) / np.ptp(y)
+            assert error <= tolerance * (1 + 1e-8), f"{name}: {trace['name']} {error=}"
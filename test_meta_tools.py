@@ -0,0 +1,49 @@
+"""
+Tests for meta_tools.py: the fast header readers are cross-validated against the parsers
+that read the full file. Run them with `python -m pytest` from the root of the website.
+"""
+from __future__ import annotations
+
+import os
+import pytest
+
+from pymatgen.io.abinit.pseudos import Pseudo, PawXmlSetup
+
+from meta_tools import read_pawxml_meta, read_pawxml_meta_with_pymatgen, read_zval, read_zval_full
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data")
+
+
+def test_read_pawxml_meta():
+    path = os.path.join(TEST_DATA, "Al.GGA_PBE-JTH.xml")
+    meta = read_pawxml_meta(path)
+    assert meta == read_pawxml_meta_with_pymatgen(path)
+    assert meta["nv"] == PawXmlSetup(path).valence == 3
+    assert meta["hl"] <= meta["hn"] <= meta["hh"]
+
+
+def test_read_zval_psp8():
+    path = os.path.join(TEST_DATA, "N.psp8")
+    assert read_zval(path) == Pseudo.from_file(path).Z_val == read_zval_full(path) == 5
+
+
+def test_read_zval_upf():
+    # pymatgen does not support the UPF format: the fast reader is compared with the parser of the full XML tree.
+    path = os.path.join(TEST_DATA, "Fe.upf")
+    assert read_zval(path) == read_zval_full(path) == 16
+
+
+def test_read_zval_upf1(tmp_path):
+    path = tmp_path / "Si.UPF"
+    path.write_text("<PP_INFO>\n  Generated by hand\n</PP_INFO>\n<PP_HEADER>\n   0                   Version Number\n"
+                    "  Si                   Element\n   NC                   Norm - Conserving pseudopotential\n"
+                    "    F                   Nonlinear Core Correction\n  4.00000000000      Z valence\n"
+                    "</PP_HEADER>\n<PP_MESH>\n</PP_MESH>\n")
+    assert read_zval(str(path)) == 4
+
+
+def test_read_zval_invalid(tmp_path):
+    path = tmp_path / "Si.upf"
+    path.write_text("<PP_INFO>\n</PP_INFO>\n")
+    with pytest.raises(ValueError):
+        read_zval(str(path))